@@ -0,0 +1,128 @@
+## Setup
+
+import math
+import numpy as np
+import pandas as pd
+import scipy
+import seaborn as sns
+import timeit
+
+import sklearn.metrics as metrics
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import PolynomialFeatures
+
+df = pd.read_csv("data/gp.csv")
+
+
+## Polynomial degree sweep
+
+def poly_model(X, y, degree):
+  X  = PolynomialFeatures(
+    degree=degree, include_bias=False
+  ).fit_transform(
+    X=X
+  )
+  y_pred = LinearRegression(
+  ).fit(
+    X=X, y=y
+  ).predict(
+    X
+  )
+  return metrics.root_mean_squared_error(y, y_pred)
+
+
+## Incremental degree path
+#
+# Degree d's monomials are degree d-1's monomials times one more feature, so
+# each step only builds the new columns. These are orthogonalized against the
+# current basis (block Gram-Schmidt with a reorthogonalization pass) and appended
+# to Q, after which the residual is updated by projecting out the new
+# directions - the least squares fit is never recomputed from scratch.
+# Columns that are (numerically) in the span of the current basis are skipped,
+# which matches the minimum norm solution LinearRegression finds.
+
+def poly_path(X, y, max_degree, tol=1e-10):
+  X = np.asarray(X, dtype=np.float64)
+  X = X.reshape(len(X), -1)
+  y = np.asarray(y, dtype=np.float64)
+  n, p = X.shape
+
+  # Preallocate the basis for every monomial up to max_degree
+  Q = np.empty((n, math.comb(p + max_degree, max_degree) - 1))
+  k = 0
+  resid = y - y.mean()    # intercept column already projected out
+  ones = np.ones((n, 1)) / np.sqrt(n)
+
+  # Monomials of the previous degree and the largest feature index each uses
+  prev, prev_last = np.ones((n, 1)), np.zeros(1, dtype=np.intp)
+  res = {"degree": [], "n_features": [], "rmse": []}
+  n_features = 0
+
+  for d in range(1, max_degree+1):
+    new_cols, new_last = [], []
+    for j in range(p):
+      use = prev_last <= j
+      new_cols.append(prev[:, use] * X[:, j:j+1])
+      new_last.append(np.full(use.sum(), j))
+    prev, prev_last = np.hstack(new_cols), np.concatenate(new_last)
+    n_features += prev.shape[1]
+
+    norms = np.linalg.norm(prev, axis=0)
+    V = prev - ones @ (ones.T @ prev)
+    V -= Q[:, :k] @ (Q[:, :k].T @ V)
+
+    # Orthogonalize the new block against itself, pivoting so that the leading
+    # columns of Qd span every column that is not (numerically) redundant
+    Qd, Rd, piv = scipy.linalg.qr(V, mode="economic", pivoting=True)
+    ok = np.abs(np.diag(Rd)) > tol * norms[piv[:len(Rd)]]
+    Qd = Qd[:, :np.argmin(ok) if not ok.all() else len(ok)]
+    # Second Gram-Schmidt pass to restore orthogonality lost to cancellation
+    Qd -= ones @ (ones.T @ Qd)
+    Qd -= Q[:, :k] @ (Q[:, :k].T @ Qd)
+    Qd /= np.linalg.norm(Qd, axis=0)
+
+    Q[:, k:k+Qd.shape[1]] = Qd
+    k += Qd.shape[1]
+    resid -= Qd @ (Qd.T @ resid)
+
+    res["degree"].append(d)
+    res["n_features"].append(n_features)
+    res["rmse"].append(np.sqrt(np.mean(resid**2)))
+
+  return pd.DataFrame(res)
+
+
+degrees = range(1,10)
+rmses = [
+  poly_model(X=df[["x"]], y=df.y, degree=d)
+  for d in degrees
+]
+
+path = poly_path(df[["x"]], df.y, max_degree=9); path
+
+# By degree 9 the raw monomials are ill-conditioned enough that LinearRegression
+# loses accuracy, the orthogonalized path still agrees with a well-conditioned fit
+np.allclose(path.rmse[:8], rmses[:8])
+
+p9 = np.polynomial.Polynomial.fit(df.x, df.y, deg=9)
+np.isclose(path.rmse.iloc[8], metrics.root_mean_squared_error(df.y, p9(df.x)))
+
+g = sns.relplot(data=path, x="degree", y="rmse")
+
+
+## Benchmark
+
+rng = np.random.default_rng(1234)
+
+for n, p, max_degree in [(5000, 5, 6), (20000, 3, 10), (20000, 1, 30)]:
+  X = rng.uniform(-1, 1, size=(n, p))
+  y = np.sin(X).sum(axis=1) + rng.normal(scale=0.1, size=n)
+
+  t_model = min(timeit.repeat(
+    lambda: [poly_model(X, y, d) for d in range(1, max_degree+1)], number=1, repeat=3
+  ))
+  t_path = min(timeit.repeat(
+    lambda: poly_path(X, y, max_degree), number=1, repeat=3
+  ))
+
+  print(f"{n=} {p=} {max_degree=}: poly_model={t_model:.3f}s poly_path={t_path:.3f}s")
@@ -12,6 +12,7 @@ from sklearn.pipeline import make_pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.model_selection import GridSearchCV, KFold, StratifiedKFold, train_test_split
 from sklearn.metrics import accuracy_score, confusion_matrix
+from sklearn.tree import DecisionTreeClassifier
 
 
 ## Digits
@@ -47,3 +48,104 @@ confusion_matrix(
 )
 
 
+## Successive halving
+
+# Rather than fully training all 28 candidates x 5 folds, successive halving
+# scores every candidate on a small subsample and only keeps the best 1/factor
+# of them for the next round with factor times as many samples.
+
+import time
+from sklearn.experimental import enable_halving_search_cv
+from sklearn.model_selection import HalvingGridSearchCV
+
+# Trees fit on float32 C-contiguous data, converting once up front avoids a copy
+# per fit and reusing the fold indices avoids re-splitting for each candidate.
+X_train32 = np.ascontiguousarray(X_train, dtype=np.float32)
+X_test32 = np.ascontiguousarray(X_test, dtype=np.float32)
+folds = list(KFold(5, shuffle=True, random_state=12345).split(X_train32, y_train))
+
+param_grid = {
+  "criterion": ["gini", "entropy"],
+  "max_depth": range(2,16)
+}
+
+def bench(search, X_train, X_test):
+  start = time.perf_counter()
+  search.fit(X_train, y_train)
+  elapsed = time.perf_counter() - start
+
+  return {
+    "time": elapsed,
+    "fits": len(search.cv_results_["params"]) * search.n_splits_,
+    "best_params": search.best_params_,
+    "cv_score": search.best_score_,
+    "test_acc": accuracy_score(y_test, search.best_estimator_.predict(X_test))
+  }
+
+digits_tree_halving = HalvingGridSearchCV(
+  DecisionTreeClassifier(random_state=1234),
+  param_grid = param_grid,
+  cv = folds,
+  factor = 3,
+  resource = "n_samples",
+  min_resources = 100,
+  random_state = 1234,
+  n_jobs = 4
+)
+
+# Both searches use the same float32 data and folds, so the difference in time
+# is only down to the search strategy
+pd.DataFrame({
+  "exhaustive": bench(
+    GridSearchCV(
+      DecisionTreeClassifier(random_state=1234), param_grid = param_grid,
+      cv = folds, n_jobs = 4
+    ),
+    X_train32, X_test32
+  ),
+  "halving": bench(digits_tree_halving, X_train32, X_test32)
+})
+
+digits_tree_halving.n_candidates_
+digits_tree_halving.n_resources_
+
+
+## Caching pipeline stages
+
+# Only the tree's parameters vary across the grid, so the scaler, interaction
+# features and feature selection only need to be fit once per fold. With a
+# TransformCache as the pipeline's memory, later candidates reuse the cached
+# transformed folds.
+
+from sklearn.preprocessing import PolynomialFeatures
+from sklearn.feature_selection import SelectKBest
+from pipeline_cache import TransformCache
+
+def tree_pipeline(memory=None):
+  return make_pipeline(
+    StandardScaler(),
+    PolynomialFeatures(degree=2, interaction_only=True, include_bias=False),
+    SelectKBest(k=100),
+    DecisionTreeClassifier(random_state=1234),
+    memory = memory
+  )
+
+pipe_grid = {
+  "decisiontreeclassifier__criterion": ["gini", "entropy"],
+  "decisiontreeclassifier__max_depth": range(2,16)
+}
+
+cache = TransformCache(location="data/pipeline_cache", max_bytes=256 * 2**20)
+cache.clear()
+
+pd.DataFrame({
+  "uncached": bench(
+    GridSearchCV(tree_pipeline(), pipe_grid, cv=folds), X_train32, X_test32
+  ),
+  "cached": bench(
+    GridSearchCV(tree_pipeline(cache), pipe_grid, cv=folds), X_train32, X_test32
+  )
+})
+
+cache.stats
+cache.hit_rate()
@@ -1,68 +1,138 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import sklearn
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.utils.validation import check_is_fitted, validate_data, _check_feature_names
 
 sklearn.set_config(display="text")
 
-class interact_features(BaseEstimator, TransformerMixin):
-  def __init__(self, interaction_only = False, include_intercept = False):
+# Full validation (validate_data + _check_feature_names) runs at fit and the
+# validated dtype is cached. With fast_path=True, transform() only checks that
+# a dense input has the fitted shape, dtype (frame columns may be any dtype
+# that casts safely to it) and column names before using it, falling back to
+# full validation for anything else (e.g. sparse or string columns).
+class FastValidationMixin:
+  def _validate_fit(self, X, **kwargs):
+    # https://github.com/scikit-learn/scikit-learn/blob/main/sklearn/base.py#L495
+    _check_feature_names(self, X=X, reset=True)
+    X = validate_data(self, X=X, reset=True, **kwargs)
+    self.dtype_ = X.dtype
+    return X
+
+  def _validate_transform(self, X, **kwargs):
+    if self.fast_path:
+      X_fast = self._fast_check(X)
+      if X_fast is not None:
+        return X_fast
+
+    check_is_fitted(self, "dtype_")
+    _check_feature_names(self, X=X, reset=False)
+    return validate_data(self, X=X, reset=False, **kwargs)
+
+  def _fast_check(self, X):
+    if not hasattr(self, "dtype_"):
+      return None
+
+    names = getattr(self, "feature_names_in_", None)
+    if isinstance(X, np.ndarray):
+      ok = names is None and X.ndim == 2 and X.dtype == self.dtype_
+    elif isinstance(X, pd.DataFrame):
+      ok = (
+        names is not None and X.ndim == 2 and len(X.columns) == len(names) and
+        all(a == b for a, b in zip(X.columns, names)) and
+        all(dt.kind in "biuf" and np.can_cast(dt, self.dtype_, "safe") for dt in X.dtypes)
+      )
+      if ok:
+        try:
+          X = X.to_numpy(dtype=self.dtype_)
+        except (ValueError, TypeError):
+          return None
+    else:
+      ok = False
+
+    if not ok or X.shape[1] != self.n_features_in_:
+      return None
+    return X
+
+
+class interact_features(FastValidationMixin, BaseEstimator, TransformerMixin):
+  def __init__(self, interaction_only = False, include_intercept = False, chunk_size = None,
+               fast_path = False):
     self.interaction_only = interaction_only
     self.include_intercept = include_intercept
+    self.chunk_size = chunk_size
+    self.fast_path = fast_path
   
   def fit(self, X, y=None):
-    # https://github.com/scikit-learn/scikit-learn/blob/main/sklearn/base.py#L495
-    validate_data(self, X=X, reset=True, ensure_min_features=2)
-    _check_feature_names(self, X=X, reset=True)
+    self._validate_fit(X, ensure_min_features=2, accept_sparse=["csr", "csc"])
+
+    # Each unique pair (i < j) of input columns, computed once
+    self.pairs_ = np.triu_indices(self.n_features_in_, k=1)
 
     return self
   
   def transform(self, X, y=None):
-    check_is_fitted(self, "n_features_in_")
-    
-    validate_data(self, X=X, reset=False)
-    _check_feature_names(self, X=X, reset=False)
-    
-    X = np.array(X)
+    X = self._validate_transform(X, accept_sparse=["csr", "csc"])
     
-    new_cols = []
-    for i in range(self.n_features_in_-1):
-      for j in range(1, self.n_features_in_):
-        new_cols.append( X[:,i] * X[:,j] )
+    if sp.issparse(X):
+      return self._transform_sparse(X)
 
-    new_X = np.column_stack(new_cols)
-    
-    if not self.interaction_only:
-      new_X = np.column_stack([X, new_X])
+    n, p = X.shape
+    n_int = len(self.pairs_[0])
+    offset = int(self.include_intercept) + (0 if self.interaction_only else p)
 
+    new_X = np.empty((n, offset + n_int), dtype=X.dtype)
     if self.include_intercept:
-      new_X = np.column_stack([np.ones((new_X.shape[0],1)), new_X])
+      new_X[:, 0] = 1
+    if not self.interaction_only:
+      new_X[:, int(self.include_intercept):offset] = X
 
+    # Column k's interactions X[:,k] * X[:,k+1:] are a contiguous block of the output,
+    # written in place one row chunk at a time
+    step = max(n if self.chunk_size is None else self.chunk_size, 1)
+    for s in range(0, n, step):
+      rows = slice(s, s + step)
+      start = offset
+      for k in range(p-1):
+        np.multiply(X[rows, k:k+1], X[rows, k+1:], out=new_X[rows, start:start+p-k-1])
+        start += p-k-1
     
     return new_X
 
-  def get_feature_names_out(self):
-    check_is_fitted(self, "n_features_in_")
+  def _transform_sparse(self, X):
+    i, j = self.pairs_
+    X = X.tocsc()
+
+    blocks = [X[:, i].multiply(X[:, j])]
+    if not self.interaction_only:
+      blocks.insert(0, X)
+    if self.include_intercept:
+      # Same container (sparse matrix or array) as the input
+      ones = sp.csc_matrix if isinstance(X, sp.spmatrix) else sp.csc_array
+      blocks.insert(0, ones(np.ones((X.shape[0], 1), dtype=X.dtype)))
+
+    return sp.hstack(blocks, format="csr")
+
+  def get_feature_names_out(self, input_features=None):
+    check_is_fitted(self, "pairs_")
     
     if not hasattr(self, "feature_names_in_"):
       feat_names = ["x"+str(i) for i in range(self.n_features_in_)]
     else:
-      feat_names = self.feature_names_in_
+      feat_names = list(self.feature_names_in_)
     
-    new_feat_names = []
-    for i in range(self.n_features_in_-1):
-      for j in range(1, self.n_features_in_):
-        new_feat_names.append( feat_names[i] + " * " + feat_names[j] )
+    new_feat_names = [
+      feat_names[i] + " * " + feat_names[j] for i, j in zip(*self.pairs_)
+    ]
     
     if not self.interaction_only:
-      new_feat_names = np.concatenate((feat_names, new_feat_names), axis=0)
+      new_feat_names = feat_names + new_feat_names
       
     if self.include_intercept:
       new_feat_names = ["1"] + new_feat_names
     
-    return new_feat_names
-
+    return np.array(new_feat_names, dtype=object)
 
 X = pd.DataFrame({"x1": range(1,6), "x2": range(5, 0, -1)})
 Y = pd.DataFrame({"x1": range(1,6)})
@@ -81,3 +151,307 @@ itf2.transform(Z)
 itf2
 itf2.get_feature_names_out()
 
+
+## Benchmark
+
+import timeit
+
+# The original double loop + np.column_stack approach (with the pairs fixed)
+def interact_loop(X):
+  new_cols = []
+  for i in range(X.shape[1]-1):
+    for j in range(i+1, X.shape[1]):
+      new_cols.append( X[:,i] * X[:,j] )
+
+  return np.column_stack([X, np.column_stack(new_cols)])
+
+rng = np.random.default_rng(1234)
+
+for p in [50, 200, 400]:
+  W = rng.normal(size=(500, p))
+  itf = interact_features(chunk_size=100).fit(W)
+  assert np.allclose(itf.transform(W), interact_loop(W))
+
+  print(
+    f"{p=:4d}",
+    f"loop={min(timeit.repeat(lambda: interact_loop(W), number=1, repeat=3)):.3f}s",
+    f"vectorized={min(timeit.repeat(lambda: itf.transform(W), number=1, repeat=3)):.3f}s"
+  )
+
+S = sp.random_array((2000, 400), density=0.01, format="csr", rng=rng)
+itf = interact_features().fit(S)
+itf.transform(S)
+min(timeit.repeat(lambda: itf.transform(S), number=1, repeat=3))
+
+# The output container matches the input's, whatever the options
+{
+  (kind.__name__, io, ii): type(
+    interact_features(interaction_only=io, include_intercept=ii).fit(kind(S)).transform(kind(S))
+  ).__name__
+  for kind in [sp.csr_matrix, sp.csr_array] for io in [False, True] for ii in [False, True]
+}
+
+
+## Fast path validation
+
+from sklearn.pipeline import make_pipeline
+
+class scaler(FastValidationMixin, BaseEstimator, TransformerMixin):
+  def __init__(self, m = 1, b = 0, fast_path = False):
+    self.m = m
+    self.b = b
+    self.fast_path = fast_path
+  
+  def fit(self, X, y=None):
+    self._validate_fit(X)
+    return self
+  
+  def transform(self, X, y=None):
+    X = self._validate_transform(X)
+    return X*self.m + self.b
+
+W = pd.DataFrame(rng.normal(size=(1000, 10)), columns=[f"x{i}" for i in range(10)])
+rows = [W.iloc[[i]] for i in range(len(W))]
+
+def per_row_latency(pipe, rows):
+  return min(timeit.repeat(
+    lambda: [pipe.transform(row) for row in rows], number=1, repeat=5
+  )) / len(rows)
+
+pipes = {
+  fast: make_pipeline(
+    interact_features(fast_path=fast), scaler(2, -3, fast_path=fast)
+  ).fit(W)
+  for fast in [False, True]
+}
+
+assert np.allclose(pipes[False].transform(W), pipes[True].transform(W))
+
+{ f"fast_path={k}": f"{per_row_latency(p, rows)*1e6:.1f}µs / row" for k, p in pipes.items() }
+
+# Float input to a transformer fitted on ints takes the full path (no truncation)
+itf_int = interact_features(fast_path=True).fit(pd.DataFrame({"a": [1, 2], "b": [3, 4]}))
+itf_int.transform(pd.DataFrame({"a": [1.5], "b": [2.5]}))
+
+# Non numeric columns take the full validation path, and raise its errors
+try:
+  pipes[True].transform(W.astype({"x0": str}).assign(x0="a"))
+except ValueError as err:
+  print(err)
+
+
+## Compiled PatsyTransformer
+
+from patsy import dmatrix, build_design_matrices, NAAction, PatsyError
+
+# Private patsy helpers (checked with patsy 1.0), without them
+# CompiledPatsyTransformer falls back to build_design_matrices
+try:
+  from patsy.build import _subterm_column_combinations
+  from patsy.categorical import _CategoricalBox
+except ImportError:
+  _subterm_column_combinations = _CategoricalBox = None
+
+# From Lec12.qmd
+class PatsyTransformer(TransformerMixin, BaseEstimator):
+    def __init__(self, formula):
+        self.formula = formula
+
+    def fit(self, X, y=None):
+        m = dmatrix(self.formula, X)
+        assert np.array(m).shape[0] == np.array(X).shape[0]
+        self.design_info_ = m.design_info
+        return self
+
+    def transform(self, X):
+        check_is_fitted(self, 'design_info_')
+        return build_design_matrices([self.design_info_], X)[0]
+
+# The formula is parsed once at fit and compiled into a column plan: for every
+# subterm, the output columns it fills and, for each of its factors, either the
+# numeric factor columns or a (levels x columns) contrast lookup table used to
+# gather rows by category code. transform() evaluates each factor once per
+# chunk of rows (stateful transforms like center() or bs() reuse their fitted
+# state) and writes the products straight into a preallocated float array.
+#
+# Missing values follow NA_action as in dmatrix: with "drop" (the default) rows
+# with a NaN / None in any factor, numeric or categorical, are left out (the
+# result is then the first rows of `out`), with "raise" they raise. If the plan
+# can not be compiled (e.g. a patsy version without the private helpers it
+# uses) transform() falls back to build_design_matrices.
+class CompiledPatsyTransformer(TransformerMixin, BaseEstimator):
+  def __init__(self, formula, chunk_size = None, NA_action = "drop"):
+    self.formula = formula
+    self.chunk_size = chunk_size
+    self.NA_action = NA_action
+
+  def fit(self, X, y=None):
+    self.NA_action_ = (
+      self.NA_action if isinstance(self.NA_action, NAAction) else NAAction(on_NA=self.NA_action)
+    )
+    m = dmatrix(self.formula, X, NA_action=self.NA_action_)
+    assert np.array(m).shape[0] == np.array(X).shape[0]
+    self.design_info_ = m.design_info
+    self.n_features_out_ = len(self.design_info_.column_names)
+    try:
+      self.factors_, self.plan_ = self._compile(self.design_info_, X)
+    except Exception:
+      self.factors_, self.plan_ = None, None
+    return self
+
+  def _compile(self, design_info, X):
+    if _subterm_column_combinations is None:
+      raise ImportError("patsy internals not available")
+
+    columns = set(getattr(X, "columns", []))
+    factors = {
+      factor: (fi.type, fi.categories, factor.name() in columns)
+      for factor, fi in design_info.factor_infos.items()
+    }
+
+    plan = []
+    for term, subterms in design_info.term_codings.items():
+      start = design_info.term_slices[term].start
+      for subterm in subterms:
+        idx = np.array(
+          list(_subterm_column_combinations(design_info.factor_infos, subterm)), dtype=np.intp
+        ).reshape(subterm.num_columns, len(subterm.factors))
+
+        parts = []
+        for k, factor in enumerate(subterm.factors):
+          if factors[factor][0] == "categorical":
+            parts.append((factor, subterm.contrast_matrices[factor].matrix[:, idx[:, k]]))
+          else:
+            parts.append((factor, idx[:, k]))
+
+        plan.append((slice(start, start + subterm.num_columns), parts))
+        start += subterm.num_columns
+
+    return factors, plan
+
+  def _categorical_NA(self, v):
+    v = np.asarray(v, dtype=object)
+    is_none = np.equal(v, None)
+    na = np.zeros(len(v), dtype=bool)
+    if "None" in self.NA_action_.NA_types:
+      na |= is_none
+    if "NaN" in self.NA_action_.NA_types:
+      na |= pd.isna(v) & ~is_none
+    return na
+
+  def _eval_factors(self, X, n):
+    values = {}
+    na = np.zeros(n, dtype=bool)
+    for factor, (kind, categories, is_column) in self.factors_.items():
+      if is_column:
+        v = X[factor.name()]
+      else:
+        v = factor.eval(self.design_info_.factor_infos[factor].state, X)
+
+      if kind == "categorical":
+        if isinstance(v, _CategoricalBox):
+          v = v.data
+        v_na = self._categorical_NA(v)
+        codes = pd.Categorical(np.asarray(v), categories=categories).codes
+        if np.any((codes < 0) & ~v_na):
+          raise ValueError(f"{factor.name()} contains unseen levels")
+        values[factor] = codes
+      else:
+        v = np.asarray(v, dtype=np.float64)
+        v = v.reshape(len(v), -1)
+        v_na = self.NA_action_.is_numerical_NA(v)
+        values[factor] = v
+
+      if v_na.any() and self.NA_action_.on_NA == "raise":
+        raise PatsyError(f"factor contains missing values: {factor.name()}")
+      na |= v_na
+
+    return values, na
+
+  # Rows like patsy, the length of the first column of a dict of columns
+  @staticmethod
+  def _n_rows(X):
+    if hasattr(X, "shape"):
+      return X.shape[0]
+    return len(np.asarray(next(iter(X.values()))))
+
+  def transform(self, X, out=None):
+    check_is_fitted(self, "design_info_")
+    if self.plan_ is None:
+      return np.asarray(build_design_matrices([self.design_info_], X, NA_action=self.NA_action_)[0])
+
+    n = self._n_rows(X)
+    if out is None:
+      out = np.empty((n, self.n_features_out_), dtype=np.float64)
+    elif out.shape != (n, self.n_features_out_):
+      raise ValueError(f"out must have shape {(n, self.n_features_out_)}, not {out.shape}")
+
+    step = max(n if self.chunk_size is None else self.chunk_size, 1)
+    n_out = 0
+    for s in range(0, n, step):
+      rows = slice(s, s + step)
+      chunk = X.iloc[rows] if isinstance(X, pd.DataFrame) else {k: v[rows] for k, v in X.items()}
+      n_chunk = min(step, n - s)
+      values, na = self._eval_factors(chunk, n_chunk)
+      if na.any():
+        values = {factor: v[~na] for factor, v in values.items()}
+        n_chunk -= na.sum()
+
+      for cols, parts in self.plan_:
+        block = out[n_out:n_out + n_chunk, cols]
+        block[...] = 1
+        for factor, lookup in parts:
+          v = values[factor]
+          block *= lookup[v] if lookup.ndim == 2 else v[:, lookup]
+      n_out += n_chunk
+
+    return out[:n_out]
+
+  def get_feature_names_out(self, input_features=None):
+    check_is_fitted(self, "design_info_")
+    return np.array(self.design_info_.column_names, dtype=object)
+
+
+df = pd.DataFrame({
+  "y": [2, 2, 4, 4, 6], "x": [1, 2, 3, 4, 5],
+  "a": ["yes", "yes", "no", "no", "yes"]
+})
+X, y = df[["x", "a"]], df[["y"]].values
+
+cpt = CompiledPatsyTransformer("x*a + np.log(x)").fit(X)
+cpt.transform(X)
+cpt.get_feature_names_out()
+
+# dict input, missing values (dropped like dmatrix, or raised) and the
+# build_design_matrices fallback all agree with patsy
+X_na = {"x": np.array([1., np.nan, 3., 4., 5.]), "a": np.array(["yes", "yes", None, "no", "yes"], dtype=object)}
+np.allclose(cpt.transform(X_na), dmatrix(cpt.design_info_, X_na))
+
+try:
+  CompiledPatsyTransformer("x*a", NA_action="raise").fit(X).transform(X_na)
+except PatsyError as err:
+  print(err)
+
+cpt_fallback = CompiledPatsyTransformer("x*a + np.log(x)").fit(X)
+cpt_fallback.plan_ = None
+np.allclose(cpt_fallback.transform(X_na), cpt.transform(X_na))
+
+n = 1_000_000
+big = pd.DataFrame({
+  "x": rng.uniform(1, 10, size=n),
+  "a": rng.choice(["yes", "no"], size=n),
+  "b": rng.choice(["lo", "mid", "hi"], size=n)
+})
+
+for formula in ["x*a + np.log(x)", "bs(x, df=4) + a:b + center(x):b"]:
+  pt = PatsyTransformer(formula).fit(big)
+  cpt = CompiledPatsyTransformer(formula, chunk_size=100_000).fit(big)
+  out = np.empty((n, cpt.n_features_out_))
+
+  assert np.allclose(pt.transform(big), cpt.transform(big, out=out))
+
+  print(
+    formula,
+    f"patsy={min(timeit.repeat(lambda: pt.transform(big), number=1, repeat=3)):.2f}s",
+    f"compiled={min(timeit.repeat(lambda: cpt.transform(big, out=out), number=1, repeat=3)):.2f}s"
+  )
@@ -0,0 +1,843 @@
+## Setup
+
+import time
+import timeit
+import warnings
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+import jax
+import jax.numpy as jnp
+from jax import lax
+from functools import partial
+
+# float64 throughout, so the jax and numpy / scipy results are comparable
+jax.config.update("jax_enable_x64", True)
+
+import scipy.linalg
+from scipy import optimize
+
+from optim_problems import mk_quad, mk_rosenbrock, mk_quad_hessp, mk_rosenbrock_hessp
+
+
+## Gradient descent w/ backtracking (from Lec13)
+
+def grad_desc(x, f, grad, step, tau=0.5, max_step=100, max_back=10, tol = 1e-8):
+  res = {"x": [x], "f": [f(x)]}
+
+  for i in range(max_step):
+    grad_f = grad(x)
+
+    for j in range(max_back):
+      x = res["x"][-1] - grad_f * step
+      f_x = f(x)
+      if (f_x < res["f"][-1]):
+        break
+      step = step * tau
+
+    if np.sqrt(np.sum((x - res["x"][-1])**2)) < tol:
+      break
+
+    res["x"].append(x)
+    res["f"].append(f_x)
+
+  if i == max_step-1:
+    warnings.warn("Failed to converge!", RuntimeWarning)
+
+  return res
+
+
+## Multi-start gradient descent
+#
+# Runs grad_desc from every row of x0 (starts x dim) at once, f and grad must
+# accept a (m, dim) array and return shapes (m,) and (m, dim). Each start keeps
+# its own step size, backtracking only re-evaluates f for the rows whose step
+# was rejected, and rows that have converged are frozen and dropped from later
+# evaluations. Iterates are written to a preallocated (n_saved, starts, dim)
+# buffer every `record_every` steps (None to skip), so memory does not grow
+# with the number of steps taken.
+
+def grad_desc_multi(x0, f, grad, step, tau=0.5, max_step=100, max_back=10, tol=1e-8, record_every=1):
+  x = np.array(x0, dtype=np.float64, ndmin=2)
+  m = x.shape[0]
+  step = np.array(np.broadcast_to(step, (m,)), dtype=np.float64)
+
+  with np.errstate(over="ignore", invalid="ignore"):
+    f_x = np.asarray(f(x), dtype=np.float64)
+
+  n_iter = np.zeros(m, dtype=np.intp)
+  converged = np.zeros(m, dtype=bool)
+
+  traj, n_saved = None, 1
+  if record_every:
+    traj = {
+      "x": np.empty((max_step // record_every + 1,) + x.shape),
+      "f": np.empty((max_step // record_every + 1, m))
+    }
+    traj["x"][0], traj["f"][0] = x, f_x
+
+  for i in range(max_step):
+    idx = np.flatnonzero(~converged)
+    if idx.size == 0:
+      break
+
+    x_a, f_a, s = x[idx], f_x[idx], step[idx]
+    with np.errstate(over="ignore", invalid="ignore"):
+      grad_f = grad(x_a)
+      x_new, f_new = np.empty_like(x_a), np.empty_like(f_a)
+
+      back = np.arange(idx.size)
+      for j in range(max_back):
+        x_new[back] = x_a[back] - grad_f[back] * s[back, None]
+        f_new[back] = f(x_new[back])
+        reject = ~(f_new[back] < f_a[back])
+        back = back[reject]
+        s[back] *= tau
+        if back.size == 0:
+          break
+
+    step[idx] = s
+    done = np.sqrt(np.sum((x_new - x_a)**2, axis=1)) < tol
+    converged[idx[done]] = True
+
+    move = idx[~done]
+    x[move], f_x[move] = x_new[~done], f_new[~done]
+    n_iter[move] += 1
+
+    if record_every and (i+1) % record_every == 0:
+      traj["x"][n_saved], traj["f"][n_saved] = x, f_x
+      n_saved += 1
+
+  if not converged.all():
+    warnings.warn(f"{np.sum(~converged)} of {m} starts failed to converge!", RuntimeWarning)
+
+  if record_every:
+    traj = {k: v[:n_saved] for k, v in traj.items()}
+
+  return {
+    "x": x, "f": f_x, "n_iter": n_iter, "converged": converged,
+    "step": step, "traj": traj, "record_every": record_every
+  }
+
+# Recorded trajectory of a single start in grad_desc()'s format
+def start_traj(res, i):
+  n = res["n_iter"][i] // res["record_every"] + 1
+  return {"x": list(res["traj"]["x"][:n, i]), "f": list(res["traj"]["f"][:n, i])}
+
+
+## Agrees with grad_desc
+
+f, grad, hess = mk_rosenbrock()
+opt = grad_desc(np.array((1.6, 1.1)), f, grad, step=0.25)
+multi = grad_desc_multi([(1.6, 1.1), (-0.5, 0)], f, grad, step=0.25)
+
+np.allclose(opt["x"][-1], multi["x"][0]), len(opt["x"]) == multi["n_iter"][0] + 1
+np.allclose(np.array(opt["x"]), start_traj(multi, 0)["x"])
+
+
+## Many starting points
+
+f, grad, hess = mk_rosenbrock()
+rng = np.random.default_rng(1234)
+x0 = rng.uniform(-1, 2, size=(500, 2))
+
+with warnings.catch_warnings():
+  warnings.simplefilter("ignore", RuntimeWarning)
+  res = grad_desc_multi(x0, f, grad, step=0.25, max_step=1000, record_every=10)
+
+  t_loop = min(timeit.repeat(
+    lambda: [grad_desc(x, f, grad, step=0.25, max_step=1000) for x in x0], number=1, repeat=3
+  ))
+  t_multi = min(timeit.repeat(
+    lambda: grad_desc_multi(x0, f, grad, step=0.25, max_step=1000, record_every=10), number=1, repeat=3
+  ))
+
+{"loop": t_loop, "multi": t_multi}
+res["converged"].mean(), np.percentile(res["n_iter"], [50, 90, 100])
+
+# Where each start ended up, colored by the final objective value
+plt.figure()
+plt.scatter(x0[:,0], x0[:,1], c=np.log10(res["f"] + 1e-16), s=10)
+plt.colorbar(label="log10 f(x*)")
+plt.show()
+
+
+## Local minima (1d)
+#
+# Number of starts that reach each of the two minima of
+# f(x) = x^4 + x^3 - x^2 - x from Lec13
+
+f = lambda x: np.sum(x**4 + x**3 - x**2 - x, axis=-1)
+grad = lambda x: 4*x**3 + 3*x**2 - 2*x - 1
+
+x0 = np.linspace(-1.75, 1.5, 201).reshape(-1, 1)
+res = grad_desc_multi(x0, f, grad, step=0.2, record_every=None)
+
+np.unique(res["x"].round(3), return_counts=True)
+
+
+## A jax implementation of GD (from Lec13)
+
+from sklearn.datasets import make_regression
+from sklearn.linear_model import LinearRegression, Ridge, Lasso
+
+X, y, coef = make_regression(
+  n_samples=200, n_features=20, n_informative=4,
+  bias=3, noise=1, random_state=1234, coef=True
+)
+
+def grad_desc_jax(x, f, step, tau=0.5, max_step=100, max_back=10, tol = 1e-8):
+  grad_f = jax.grad(f)
+  f_x = f(x)
+  converged = False
+
+  for i in range(max_step):
+    grad_f_x = grad_f(x)
+
+    for j in range(max_back):
+      new_x = x - grad_f_x * step
+      new_f_x = f(new_x)
+      if (new_f_x < f_x):
+        break
+      step *= tau
+
+    cur_tol = jnp.sqrt(jnp.sum((x - new_x)**2))
+
+    x = new_x
+    f_x = new_f_x
+
+    if cur_tol < tol:
+      converged = True
+      break
+
+  if not converged:
+    warnings.warn("Failed to converge!", RuntimeWarning)
+
+  return {
+    "x": x,
+    "n_iter": i,
+    "converged": converged,
+    "final_tol": tol,
+    "final_step": step
+  }
+
+def jax_linear_regression(X, y, beta):
+  Xb = jnp.c_[jnp.ones(X.shape[0]), X]
+  return jnp.sum((y - Xb @ beta)**2)
+
+def jax_ridge(X, y, beta, alpha):
+  Xb = jnp.c_[jnp.ones(X.shape[0]), X]
+  ls_loss = jnp.sum((y - Xb @ beta)**2)
+  coef_loss = alpha * jnp.sum(beta[1:]**2)
+  return ls_loss + coef_loss
+
+def jax_lasso(X, y, beta, alpha):
+  n = X.shape[0]
+  Xb = jnp.c_[jnp.ones(n), X]
+  ls_loss = (1/(2*n))*jnp.sum((y - Xb @ beta)**2)
+  coef_loss = alpha * jnp.sum(jnp.abs(beta[1:]))
+  return ls_loss + coef_loss
+
+
+## Compiled GD
+#
+# The whole descent, backtracking included, is a single lax.while_loop so it
+# runs as one XLA program without returning to Python (or syncing on the
+# convergence check) between steps. f is called as f(x, *args) and is static,
+# so it should be defined once (not a new lambda per call) while the data in
+# args can change without recompiling. With record_every > 0 every
+# record_every-th iterate is written to a fixed size trajectory buffer (rows
+# past n_iter are nan). The result can't warn from inside jit, check
+# "converged" instead.
+
+@partial(jax.jit, static_argnames=("f", "max_step", "max_back", "record_every"))
+def grad_desc_lax(x, f, args=(), step=1., tau=0.5, max_step=100, max_back=10, tol=1e-8, record_every=0):
+  value_and_grad = jax.value_and_grad(f)
+  x = jnp.asarray(x, dtype=jnp.result_type(float))
+  step = jnp.asarray(step, dtype=x.dtype)
+  f_x, grad_f_x = value_and_grad(x, *args)
+
+  n_saved = max_step // record_every + 1 if record_every else 0
+  traj = {
+    "x": jnp.full((n_saved,) + x.shape, jnp.nan, dtype=x.dtype).at[:1].set(x),
+    "f": jnp.full(n_saved, jnp.nan, dtype=x.dtype).at[:1].set(f_x)
+  }
+
+  def backtrack(x, f_x, grad_f_x, step):
+    def cond(state):
+      j, step, new_x, new_f_x = state
+      return (j < max_back-1) & ~(new_f_x < f_x)
+
+    def body(state):
+      j, step, new_x, new_f_x = state
+      step = step * tau
+      new_x = x - grad_f_x * step
+      return j+1, step, new_x, f(new_x, *args)
+
+    new_x = x - grad_f_x * step
+    _, step, new_x, new_f_x = lax.while_loop(cond, body, (0, step, new_x, f(new_x, *args)))
+    # like grad_desc_jax the step is also shrunk after the last failed attempt
+    step = jnp.where(new_f_x < f_x, step, step * tau)
+    return new_x, step
+
+  def cond(state):
+    i, x, f_x, grad_f_x, step, cur_tol, traj = state
+    return (i < max_step) & (cur_tol >= tol)
+
+  def body(state):
+    i, x, f_x, grad_f_x, step, cur_tol, traj = state
+    new_x, step = backtrack(x, f_x, grad_f_x, step)
+    cur_tol = jnp.sqrt(jnp.sum((x - new_x)**2))
+    new_f_x, new_grad_f_x = value_and_grad(new_x, *args)
+    i = i+1
+
+    if record_every:
+      k = jnp.where(i % record_every == 0, i // record_every, n_saved)
+      traj = {
+        "x": traj["x"].at[k].set(new_x, mode="drop"),
+        "f": traj["f"].at[k].set(new_f_x, mode="drop")
+      }
+
+    return i, new_x, new_f_x, new_grad_f_x, step, cur_tol, traj
+
+  i, x, f_x, _, step, cur_tol, traj = lax.while_loop(
+    cond, body, (0, x, f_x, grad_f_x, step, jnp.asarray(jnp.inf, dtype=x.dtype), traj)
+  )
+
+  res = {
+    "x": x,
+    "f": f_x,
+    "n_iter": i-1,
+    "converged": cur_tol < tol,
+    "final_tol": cur_tol,
+    "final_step": step
+  }
+  if record_every:
+    res["traj"] = traj
+  return res
+
+# Multiple starts, x0 has shape (starts, dim). Under vmap the loop runs until
+# every start has converged but the results of finished starts are frozen.
+@partial(jax.jit, static_argnames=("f", "max_step", "max_back", "record_every"))
+def grad_desc_lax_multi(x0, f, args=(), step=1., tau=0.5, max_step=100, max_back=10, tol=1e-8, record_every=0):
+  return jax.vmap(
+    lambda x: grad_desc_lax(
+      x, f, args, step, tau, max_step=max_step, max_back=max_back, tol=tol,
+      record_every=record_every
+    )
+  )(x0)
+
+
+## Compiled GD - regression examples
+
+# f(beta, *args) versions of the objectives above
+def lm_obj(beta, X, y):
+  return jax_linear_regression(X, y, beta)
+
+def ridge_obj(beta, X, y, alpha):
+  return jax_ridge(X, y, beta, alpha)
+
+def lasso_obj(beta, X, y, alpha):
+  return jax_lasso(X, y, beta, alpha)
+
+lm = LinearRegression().fit(X,y)
+r_alpha, ls_alpha = 1.0, 0.1
+
+problems = {
+  "linear regression": (jax_linear_regression, lm_obj, (X, y), 1e-8),
+  "ridge": (partial(jax_ridge, alpha=r_alpha), ridge_obj, (X, y, r_alpha), 1e-8),
+  "lasso": (partial(jax_lasso, alpha=ls_alpha), lasso_obj, (X, y, ls_alpha), 1e-10)
+}
+
+beta0 = np.zeros(X.shape[1]+1)
+
+res = grad_desc_lax(beta0, lm_obj, (X, y), step=1, tau=0.5)
+res
+np.abs(res["x"] - np.r_[lm.intercept_, lm.coef_]).max()
+
+# Trajectory of the lasso fit, every 5th iterate
+res = grad_desc_lax(beta0, lasso_obj, (X, y, ls_alpha), tol=1e-10, record_every=5)
+plt.figure()
+plt.semilogy(np.arange(len(res["traj"]["f"])) * 5, res["traj"]["f"] - res["f"] + 1e-8, ".-")
+plt.xlabel("iteration")
+plt.ylabel("f(x) - f(x*)")
+plt.show()
+
+# 100 random starts at once
+x0 = np.random.default_rng(1234).normal(scale=10, size=(100, X.shape[1]+1))
+multi = grad_desc_lax_multi(x0, ridge_obj, (X, y, r_alpha))
+multi["converged"].mean(), multi["n_iter"].max(), np.ptp(multi["x"], axis=0).max()
+
+
+## Compiled GD - benchmark
+
+def block(res):
+  return jax.block_until_ready(res["x"])
+
+timings = {}
+with warnings.catch_warnings():
+  warnings.simplefilter("ignore", RuntimeWarning)
+
+  for name, (f_py, f_jit, args, tol) in problems.items():
+    t_py = min(timeit.repeat(
+      lambda: block(grad_desc_jax(beta0, lambda beta: f_py(*args[:2], beta), step=1, tau=0.5, tol=tol)),
+      number=1, repeat=3
+    ))
+
+    start = time.perf_counter()
+    block(grad_desc_lax(beta0, f_jit, args, tol=tol))
+    t_compile = time.perf_counter() - start
+
+    t_jit = min(timeit.repeat(
+      lambda: block(grad_desc_lax(beta0, f_jit, args, tol=tol)), number=10, repeat=3
+    )) / 10
+
+    t_multi = min(timeit.repeat(
+      lambda: block(grad_desc_lax_multi(x0, f_jit, args, tol=tol)), number=3, repeat=3
+    )) / 3
+
+    timings[name] = {
+      "python loop": t_py, "first call (compile)": t_compile,
+      "lax.while_loop": t_jit, "100 starts (vmap)": t_multi
+    }
+
+pd.DataFrame(timings).T
+
+
+## Damped Newton's method (from Lec13)
+
+def newtons_method_damped(
+  x, f, grad, hess, max_iter=100, max_back=10, tol=1e-8,
+  alpha=0.5, beta=0.75
+):
+    res = {"x": [x], "f": [f(x)]}
+
+    for i in range(max_iter):
+      grad_f = grad(x)
+      step = - np.linalg.solve(hess(x), grad_f)
+      t = 1
+      for j in range(max_back):
+        if f(x+t*step) < f(x) + alpha * t * grad_f @ step:
+          break
+        t = t * beta
+
+      x = x + t * step
+
+      if np.sqrt(np.sum((x - res["x"][-1])**2)) < tol:
+        break
+
+      res["x"].append(x)
+      res["f"].append(f(x))
+
+    return res
+
+
+## Matrix-free Newton-CG
+#
+# The Newton step H p = -g is solved approximately with conjugate gradients
+# that only need Hessian-vector products hessp(x, v), so H is never formed and
+# each iteration costs a few gradients worth of work and O(d) memory. CG is
+# truncated once ||r|| < min(0.5, sqrt(||g||)) ||g|| (loose far from the
+# minimum, tight close to it) or when it finds a direction of non-positive
+# curvature, then the step is damped with the same backtracking line search as
+# newtons_method_damped. Unlike conjugate_gradient in Lec13 each CG iteration
+# uses a single Hessian-vector product.
+#
+# For small dense problems cholesky=k uses hess(x) instead, factors it and
+# reuses the factorization for k iterations (falling back to CG with H @ v if
+# H is not positive definite).
+
+def truncated_cg(hessp, g, max_iter, eta):
+  z = np.zeros_like(g)
+  r = g.copy()
+  d = -r
+  rr = r @ r
+  tol = eta * np.sqrt(rr)
+
+  for j in range(max_iter):
+    Hd = hessp(d)
+    dHd = d @ Hd
+    if dHd <= 0:
+      return (-g if j == 0 else z), j+1
+    a = rr / dHd
+    z += a * d
+    r += a * Hd
+    rr_new = r @ r
+    if np.sqrt(rr_new) < tol:
+      return z, j+1
+    d = -r + (rr_new / rr) * d
+    rr = rr_new
+
+  return z, max_iter
+
+def newton_cg(
+  x, f, grad, hessp=None, hess=None, max_iter=100, cg_max_iter=None,
+  max_back=10, tol=1e-8, alpha=0.5, beta=0.75, cholesky=None, record=False
+):
+  x = np.array(x, dtype=np.float64)
+  cg_max_iter = cg_max_iter or min(x.size, 200)
+  f_x = f(x)
+  traj = {"x": [x], "f": [f_x]} if record else None
+  n_hessp = n_chol = 0
+  factor = None
+  converged = False
+
+  for i in range(max_iter):
+    grad_f = grad(x)
+    g_norm = np.sqrt(grad_f @ grad_f)
+    if g_norm < tol:
+      converged = True
+      break
+
+    if cholesky:
+      if i % cholesky == 0:
+        H = hess(x)
+        try:
+          factor = scipy.linalg.cho_factor(H)
+          n_chol += 1
+        except np.linalg.LinAlgError:
+          factor = None
+      if factor is not None:
+        step = -scipy.linalg.cho_solve(factor, grad_f)
+      else:
+        step, n = truncated_cg(lambda v: H @ v, grad_f, cg_max_iter, min(0.5, np.sqrt(g_norm)))
+    else:
+      step, n = truncated_cg(lambda v: hessp(x, v), grad_f, cg_max_iter, min(0.5, np.sqrt(g_norm)))
+      n_hessp += n
+
+    # A stale factorization may not give a descent direction
+    slope = grad_f @ step
+    if slope >= 0:
+      step, slope = -grad_f, -g_norm**2
+
+    t = 1
+    for j in range(max_back):
+      new_x = x + t * step
+      new_f_x = f(new_x)
+      if new_f_x < f_x + alpha * t * slope:
+        break
+      t = t * beta
+
+    if np.sqrt(np.sum((new_x - x)**2)) < tol:
+      converged = True
+      break
+
+    x, f_x = new_x, new_f_x
+    if record:
+      traj["x"].append(x)
+      traj["f"].append(f_x)
+
+  if not converged:
+    warnings.warn("Failed to converge!", RuntimeWarning)
+
+  return {
+    "x": x, "f": f_x, "n_iter": i, "converged": converged,
+    "n_hessp": n_hessp, "n_chol": n_chol, "traj": traj
+  }
+
+# Hessian-vector products of a jax function, forward-over-reverse: the jvp of
+# the gradient, about the cost of 2-3 gradients. Returned as a numpy array so
+# the CG arithmetic doesn't dispatch to jax.
+def jax_hessp(f):
+  hvp = jax.jit(lambda x, v: jax.jvp(jax.grad(f), (x,), (v,))[1])
+  return lambda x, v: np.asarray(hvp(x, v))
+
+
+## Matrix-free Newton-CG - agrees with Newton's method
+
+f, grad, hess = mk_rosenbrock()
+hessp = mk_rosenbrock_hessp()
+
+opt = newtons_method_damped(np.array((1.6, 1.1)), f, grad, hess)
+res = newton_cg((1.6, 1.1), f, grad, hessp, record=True)
+np.allclose(opt["x"][-1], res["x"]), len(opt["x"]), res["n_iter"]
+
+res_chol = newton_cg((1.6, 1.1), f, grad, hess=hess, cholesky=3)
+np.allclose(res_chol["x"], res["x"]), res_chol["n_iter"], res_chol["n_chol"]
+
+
+## Matrix-free Newton-CG - scaling with d
+#
+# The dense methods need the d x d Hessian (80 GB at d=1e5), the matrix-free
+# ones stay at O(d). Rosenbrock's minimum is at x = (0, -0.5, ..., -0.5).
+
+def rosenbrock_jax(x):
+  y = 4*x
+  y = y.at[0].add(1).at[1:].add(3)
+  return jnp.sum(.5*(1 - y[:-1])**2 + (y[1:] - y[:-1]**2)**2)
+
+hessp_jax = jax_hessp(rosenbrock_jax)
+
+timings = []
+for d in [100, 1_000, 10_000, 100_000]:
+  f, grad, hess = mk_rosenbrock()
+  hessp = mk_rosenbrock_hessp()
+  x0 = np.full(d, 0.1)
+  x_opt = np.r_[0, np.full(d-1, -0.5)]
+  hessp_jax(x0, x0)    # compile for this d outside of the timing
+
+  row = {"d": d}
+  for name, run in {
+    "newton (dense)": lambda: newtons_method_damped(x0, f, grad, hess)["x"][-1],
+    "newton-cg (cholesky=3)": lambda: newton_cg(x0, f, grad, hess=hess, cholesky=3)["x"],
+    "newton-cg (hessp)": lambda: newton_cg(x0, f, grad, hessp)["x"],
+    "newton-cg (jax hessp)": lambda: newton_cg(x0, f, grad, hessp_jax)["x"],
+    "scipy newton-cg (hessp)": lambda: optimize.minimize(f, x0, jac=grad, hessp=hessp, method="Newton-CG", options={"xtol": 1e-10}).x
+  }.items():
+    if d > 1_000 and ("dense" in name or "cholesky" in name):
+      continue
+    start = time.perf_counter()
+    x = run()
+    row[name] = time.perf_counter() - start
+    assert np.allclose(x, x_opt, atol=1e-5), name
+  timings.append(row)
+
+pd.DataFrame(timings).set_index("d")
+
+# mk_quad at d=1e5, scaled so the condition number stays at 1e4
+d = 100_000
+f, grad, hess = mk_quad(1e-2**(1/d), ndim=d)
+res = newton_cg(np.ones(d), f, grad, mk_quad_hessp(1e-2**(1/d), ndim=d), cg_max_iter=1000)
+res["n_iter"], res["n_hessp"], np.abs(res["x"]).max()
+
+
+## Regularization paths
+#
+# Fits jax_lasso / jax_ridge for a decreasing sequence of alphas. X and y are
+# centered so the (unpenalized) intercept drops out, and for tall data
+# (n > p) the Gram matrix X^T X and X^T y are computed once and every update
+# after that is O(p) or O(p^2) rather than O(n p).
+#
+# lasso_path: each alpha starts from the previous solution (warm start). The
+# sequential strong rule drops the features with |x_j^T r| / n < 2 alpha -
+# alpha_prev before solving, and the KKT conditions are then checked on the
+# dropped features, adding back any violators and resolving. The solver is
+# either cyclic coordinate descent ("cd") or FISTA (accelerated proximal
+# gradient).
+#
+# ridge_path: the whole path is closed form from a single eigendecomposition of
+# X^T X (SVD of X when n <= p), b(alpha) = V diag(1 / (w + alpha)) V^T X^T y.
+
+def soft_threshold(x, t):
+  return np.sign(x) * np.maximum(np.abs(x) - t, 0)
+
+def _center(X, y):
+  X = np.asarray(X, dtype=np.float64)
+  y = np.asarray(y, dtype=np.float64)
+  X_mean, y_mean = X.mean(axis=0), y.mean()
+  return X - X_mean, y - y_mean, X_mean, y_mean
+
+def _lasso_cd(b, S, alpha, n, Xty, G, Xc, r, tol, max_iter):
+  for it in range(max_iter):
+    max_delta = 0.
+    for j in S:
+      b_j = b[j]
+      if G is not None:
+        # r holds G b
+        rho = Xty[j] - r[j] + G[j, j] * b_j
+        b[j] = soft_threshold(rho, n * alpha) / G[j, j]
+        if b[j] != b_j:
+          r += G[:, j] * (b[j] - b_j)
+      else:
+        # r holds y - X b
+        sq = Xc[:, j] @ Xc[:, j]
+        rho = Xc[:, j] @ r + sq * b_j
+        b[j] = soft_threshold(rho, n * alpha) / sq
+        if b[j] != b_j:
+          r -= Xc[:, j] * (b[j] - b_j)
+      max_delta = max(max_delta, abs(b[j] - b_j))
+    if max_delta < tol:
+      break
+  return it+1
+
+def _lasso_fista(b, S, alpha, n, Xty, G, Xc, r, tol, max_iter):
+  # Nothing survived screening (alpha >= alpha_max), b is already all zero
+  if len(S) == 0:
+    return 0
+  if G is not None:
+    G_S = G[np.ix_(S, S)]
+    grad = lambda z: (G_S @ z - Xty[S]) / n
+    L = scipy.linalg.eigvalsh(G_S, subset_by_index=[len(S)-1, len(S)-1])[0] / n
+  else:
+    X_S = Xc[:, S]
+    y_c = r + Xc @ b    # r holds y - X b
+    grad = lambda z: X_S.T @ (X_S @ z - y_c) / n
+    L = np.linalg.norm(X_S, 2)**2 / n
+
+  x = z = b[S]
+  t = 1.
+  for it in range(max_iter):
+    x_new = soft_threshold(z - grad(z) / L, alpha / L)
+    t_new = (1 + np.sqrt(1 + 4 * t**2)) / 2
+    z = x_new + (t - 1) / t_new * (x_new - x)
+    done = np.abs(x_new - x).max() < tol
+    x, t = x_new, t_new
+    if done:
+      break
+
+  delta = x - b[S]
+  b[S] = x
+  if G is not None:
+    r += G[:, S] @ delta
+  else:
+    r -= Xc[:, S] @ delta
+  return it+1
+
+def lasso_path(X, y, alphas=None, n_alphas=50, eps=1e-3, method="cd", gram=None,
+               screen=True, tol=1e-8, max_iter=10_000):
+  Xc, yc, X_mean, y_mean = _center(X, y)
+  n, p = Xc.shape
+  gram = n > p if gram is None else gram
+  solver = {"cd": _lasso_cd, "fista": _lasso_fista}[method]
+
+  Xty = Xc.T @ yc
+  G = Xc.T @ Xc if gram else None
+
+  alpha_max = np.abs(Xty).max() / n
+  if alphas is None:
+    alphas = alpha_max * np.logspace(0, np.log10(eps), n_alphas)
+  alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+
+  b = np.zeros(p)
+  r = np.zeros(p) if gram else yc.copy()
+  corr = (lambda: (Xty - r) / n) if gram else (lambda: Xc.T @ r / n)
+
+  coef = np.empty((len(alphas), p))
+  n_iter = np.zeros(len(alphas), dtype=int)
+  n_solved = np.zeros(len(alphas), dtype=int)
+  alpha_prev = max(alpha_max, alphas[0])
+
+  for k, alpha in enumerate(alphas):
+    c = corr()
+    keep = (np.abs(c) >= 2 * alpha - alpha_prev) | (b != 0) if screen else np.ones(p, bool)
+
+    while True:
+      n_iter[k] += solver(b, np.flatnonzero(keep), alpha, n, Xty, G, Xc, r, tol, max_iter)
+      # KKT for the screened out features, x_j^T r / n must be in [-alpha, alpha]
+      viol = ~keep & (np.abs(corr()) > alpha * (1 + 1e-6))
+      if not viol.any():
+        break
+      keep |= viol
+
+    coef[k] = b
+    n_solved[k] = keep.sum()
+    alpha_prev = alpha
+
+  return {
+    "alphas": alphas,
+    "intercept": y_mean - coef @ X_mean,
+    "coef": coef,
+    "n_iter": n_iter,
+    "n_solved": n_solved
+  }
+
+def ridge_path(X, y, alphas=None, n_alphas=50, eps=1e-4, gram=None):
+  Xc, yc, X_mean, y_mean = _center(X, y)
+  n, p = Xc.shape
+  gram = n > p if gram is None else gram
+
+  if gram:
+    w, V = np.linalg.eigh(Xc.T @ Xc)
+    Vty = V.T @ (Xc.T @ yc)
+  else:
+    U, s, Vt = np.linalg.svd(Xc, full_matrices=False)
+    w, V = s**2, Vt.T
+    Vty = s * (U.T @ yc)
+
+  if alphas is None:
+    alphas = w.max() * np.logspace(0, np.log10(eps), n_alphas)
+  alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+
+  coef = (Vty / (w + alphas[:, None])) @ V.T
+  return {"alphas": alphas, "intercept": y_mean - coef @ X_mean, "coef": coef}
+
+
+## Regularization paths - agree with sklearn and gradient descent
+
+from sklearn.linear_model import lasso_path as sk_lasso_path
+
+X, y, coef = make_regression(
+  n_samples=200, n_features=20, n_informative=4,
+  bias=3, noise=1, random_state=1234, coef=True
+)
+
+path = lasso_path(X, y)
+path_fista = lasso_path(X, y, method="fista")
+path_wide = lasso_path(X, y, gram=False)
+
+Xc, yc, _, _ = _center(X, y)
+_, sk_coef, _ = sk_lasso_path(Xc, yc, alphas=path["alphas"], tol=1e-10)
+
+np.abs(path["coef"] - sk_coef.T).max(), np.abs(path_fista["coef"] - sk_coef.T).max(), np.abs(path_wide["coef"] - sk_coef.T).max()
+path["n_solved"]
+
+# alphas above alpha_max give all zero coefficients
+[
+  np.abs(lasso_path(X, y, alphas=[1e4, 1.], method=m, gram=g)["coef"] - lasso_path(X, y, alphas=[1e4, 1.])["coef"]).max()
+  for m in ["cd", "fista"] for g in [True, False]
+], np.abs(lasso_path(X, y, alphas=[1e4, 1.])["coef"][0]).max()
+
+k = 30
+ls_k = Lasso(alpha=path["alphas"][k], tol=1e-10).fit(X, y)
+np.abs(np.r_[path["intercept"][k], path["coef"][k]] - np.r_[ls_k.intercept_, ls_k.coef_]).max()
+
+r_path = ridge_path(X, y, alphas=[10., 1., 0.1])
+r_1 = Ridge(alpha=1.).fit(X, y)
+np.abs(np.r_[r_path["intercept"][1], r_path["coef"][1]] - np.r_[r_1.intercept_, r_1.coef_]).max()
+
+plt.figure()
+plt.semilogx(path["alphas"], path["coef"])
+plt.xlabel("alpha")
+plt.ylabel("coefficient")
+plt.show()
+
+
+## Regularization paths - benchmark
+#
+# Per alpha compiled gradient descent (grad_desc_lax, cold starts) vs. the
+# path solvers. On the non-smooth lasso objective backtracking keeps shrinking
+# the step near the kinks, so gradient descent stops (reporting convergence,
+# as the step length is below tol) short of the minimum - the last column is
+# its largest relative excess objective along the path.
+
+def lasso_objective(X, y, intercept, coef, alpha):
+  r = y - intercept - X @ coef
+  return np.sum(r**2) / (2*len(y)) + alpha * np.abs(coef).sum()
+
+bench = []
+for n, p in [(200, 20), (5_000, 200), (500, 2_000)]:
+  X, y = make_regression(
+    n_samples=n, n_features=p, n_informative=10, bias=3, noise=1, random_state=1234
+  )
+  alphas = lasso_path(X, y, n_alphas=20)["alphas"]
+
+  def gd_path():
+    res = [
+      grad_desc_lax(np.zeros(p+1), lasso_obj, (X, y, a), tol=1e-10, max_step=1000)["x"]
+      for a in alphas
+    ]
+    return np.asarray(res)
+
+  gd_path()   # compile
+  row = {"n": n, "p": p}
+
+  start = time.perf_counter()
+  beta = gd_path()
+  row["gd per alpha"] = time.perf_counter() - start
+
+  for name, kwargs in {
+    "cd": {}, "cd (no screening)": {"screen": False}, "fista": {"method": "fista"}
+  }.items():
+    start = time.perf_counter()
+    path = lasso_path(X, y, alphas=alphas, **kwargs)
+    row[name] = time.perf_counter() - start
+
+  row["gd excess"] = max(
+    lasso_objective(X, y, b[0], b[1:], a) / lasso_objective(X, y, i, c, a) - 1
+    for a, b, i, c in zip(alphas, beta, path["intercept"], path["coef"])
+  )
+  bench.append(row)
+
+pd.DataFrame(bench)
@@ -1,7 +1,7 @@
 ## Exercise 1
 
+import numpy as np
 from scipy import optimize
-import timeit
 
 def f(x): 
   return np.exp(x[0]-1) + np.exp(-x[1]+1) + (x[0]-x[1])**2
@@ -25,15 +25,91 @@ optimize.minimize(fun=f, x0=x0, jac=grad, method="CG")
 optimize.minimize(fun=f, x0=x0, jac=grad, method="Newton-CG")
 optimize.minimize(fun=f, x0=x0, method="Nelder-Mead")
 
-timeit.Timer(lambda: optimize.minimize(fun=f, x0=x0, jac=grad, method="BFGS")).repeat(1, 100)
-timeit.Timer(lambda: optimize.minimize(fun=f, x0=x0, jac=grad, method="CG")).repeat(1, 100)
-timeit.Timer(lambda: optimize.minimize(fun=f, x0=x0, jac=grad, method="Newton-CG")).repeat(1, 100)
-timeit.Timer(lambda: optimize.minimize(fun=f, x0=x0, method="Nelder-Mead")).repeat(1, 100)
+import pandas as pd
+import optim_bench, optim_problems
+
+# The exercise's f, grad and hess are registered as optim_problems.mk_exercise1
+optim_bench.run(
+  problems=["exercise 1"], methods=["bfgs", "CG", "newton-cg", "nelder-mead"],
+  repeat=100, jobs=1
+)
+
+# All registered problems x methods, in parallel. Where workers are spawned
+# rather than forked (macOS, Windows) they re-import this script, so the
+# parallel run is guarded
+if __name__ == "__main__":
+  bench = optim_bench.run(repeat=25, jobs=4)
+  print(bench)
+
+  # optim_bench.save(bench, "Lec14_bench.json")
+  # optim_bench.compare(bench, optim_bench.load("Lec14_bench.json"))
+
+
+## Exercise 1 - fused objective
+
+import math
+from optim_problems import FusedProblem
+
+# exp(x[0]-1), exp(-x[1]+1) and x[0]-x[1] are computed once per point and
+# shared by the value, gradient and Hessian
+def ex1_terms(x):
+  a, b = x
+  return math.exp(a-1), math.exp(-b+1), a-b
+
+ex1 = FusedProblem(
+  ex1_terms,
+  value = lambda x, t: t[0] + t[1] + t[2]**2,
+  grad  = lambda x, t: [t[0] + 2*t[2], -t[1] - 2*t[2]],
+  hess  = lambda x, t: [[t[0] + 2, -2], [-2, t[1] + 2]]
+)
+
+optimize.minimize(ex1.value_and_grad, x0=x0, jac=True, method="BFGS")
+optimize.minimize(ex1.value_and_grad, x0=x0, jac=True, hess=ex1.hess, method="Newton-CG")
+
+ex1.n_terms = 0
+optimize.minimize(ex1.value_and_grad, x0=x0, jac=True, hess=ex1.hess, method="Newton-CG")
+ex1.n_terms
+
+# Evaluation time only, separate from the optimizer's own overhead. For the 2d
+# exercise the objective is so cheap that the memoization bookkeeping costs
+# more than it saves, the gains show up once the shared terms are
+# expensive (e.g. Sigma_inv @ (x - mu) for the 50d mvn).
+def eval_time(f, grad, hess, x0, method):
+  fs = optim_bench._instrument(f, grad, hess)
+  optimize.minimize(fs[0], x0, jac=fs[1], hess=fs[2] if method == "Newton-CG" else None, method=method)
+  return sum(c.time for c in fs if c is not None)
+
+def fused_eval_time(prob, x0, method):
+  vg, h = optim_bench.Counted(prob.value_and_grad), optim_bench.Counted(prob.hess)
+  optimize.minimize(vg, x0, jac=True, hess=h if method == "Newton-CG" else None, method=method)
+  return vg.time + h.time
+
+mvn = optim_problems.mk_mvn(np.zeros(50), np.eye(50))
+mvn_fused = optim_problems.mk_mvn_fused(np.zeros(50), np.eye(50))
+x50 = np.random.default_rng(1234).uniform(-1, 1, 50)
+
+pd.DataFrame({
+  "ex1": {
+    method: (
+      np.median([eval_time(f, grad, hess, x0, method) for _ in range(25)]),
+      np.median([fused_eval_time(ex1, x0, method) for _ in range(25)])
+    )
+    for method in ["BFGS", "Newton-CG"]
+  },
+  "mvn (50d)": {
+    method: (
+      np.median([eval_time(*mvn, x50, method) for _ in range(25)]),
+      np.median([fused_eval_time(mvn_fused, x50, method) for _ in range(25)])
+    )
+    for method in ["BFGS", "Newton-CG"]
+  }
+})
 
 
 ## Exercise 2
 
-from numpy import np
+import numpy as np
+import matplotlib.pyplot as plt
 from scipy.stats import gamma
 from scipy import optimize
 
@@ -58,3 +134,61 @@ optimize.minimize(
 )
 
 gamma.fit(x, floc=0)
+
+
+## Exercise 2 - vectorized likelihood
+
+import timeit
+from mle import GammaMLE, NormalMLE
+
+# n, sum(x) and sum(log x) are computed once, each evaluation is then O(1)
+g_mle = GammaMLE(x)
+
+g_mle.nll([1,1]), mle_gamma([1,1])
+g_mle.score([1,1]), optimize.approx_fprime(np.array([1.,1.]), mle_gamma)
+
+g_mle.fit([1,1], method="bfgs")
+g_mle.fit()
+
+# A whole grid of candidate θs in one call, e.g. to pick a starting value
+θ_grid, nll_grid = g_mle.grid(np.linspace(0.1, 5, 200), np.linspace(0.1, 5, 200))
+g_mle.grid_start(np.linspace(0.1, 5, 200), np.linspace(0.1, 5, 200))
+
+# Profile likelihood of the shape (the scale's MLE given a is closed form)
+a_grid = np.linspace(0.5, 5, 500)
+plt.figure()
+plt.plot(a_grid, g_mle.profile_nll(a_grid), "-k")
+plt.xlabel("a")
+plt.ylabel("profile nll")
+plt.show()
+
+x_big = g.rvs(size=100_000, random_state=1234)
+def mle_gamma_big(θ):
+  if θ[0] <= 0 or θ[1] <= 0:
+    return 1e16
+  else:
+    return -np.sum(gamma.logpdf(x_big, a=θ[0], scale=θ[1]))
+
+g_mle_big = GammaMLE(x_big)
+
+{
+  "finite diff (n=100)": min(timeit.repeat(
+    lambda: optimize.minimize(mle_gamma, x0=[1,1], method="bfgs"), number=1, repeat=5
+  )),
+  "analytic (n=100)": min(timeit.repeat(
+    lambda: g_mle.fit([1,1], method="bfgs"), number=1, repeat=5
+  )),
+  "finite diff (n=100,000)": min(timeit.repeat(
+    lambda: optimize.minimize(mle_gamma_big, x0=[1,1], method="bfgs"), number=1, repeat=5
+  )),
+  "analytic (n=100,000)": min(timeit.repeat(
+    lambda: g_mle_big.fit([1,1], method="bfgs"), number=1, repeat=5
+  ))
+}
+
+
+## Normal (mle_norm2 from Lec14)
+
+n_mle = NormalMLE(x)
+n_mle.fit()
+{'µ': x.mean(), 'σ': x.std()}
@@ -0,0 +1,230 @@
+## Setup
+
+import time
+import timeit
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+import jax
+import jax.numpy as jnp
+
+jax.config.update("jax_enable_x64", True)
+
+from sklearn.datasets import make_regression
+from sklearn.linear_model import LinearRegression
+
+from sgd import sgd_lm
+
+
+## SGD variants (from Lec15)
+
+def mb_grad_desc_lm(X, y, beta, step, batch_size = 10, max_step=50, seed=1234, replace=True):
+  X = jnp.c_[jnp.ones(X.shape[0]), X]
+  f = lambda beta: jnp.sum((y - X @ beta)**2)
+  grad = lambda beta, i: 2*X[i,:].T @ (X[i,:]@beta - y[i])
+  n, k = X.shape
+
+  res = {"x": [beta], "loss": [f(beta).item()], "iter": [0]}
+  rng = np.random.default_rng(seed)
+
+  for i in range(max_step):
+    if replace:
+      js = rng.integers(0,n,n)
+    else:
+      js = np.array(range(n))
+      rng.shuffle(js)
+
+    for j in js.reshape(-1, batch_size):
+      beta = beta - grad(beta, j) * step
+      res["x"].append(beta)
+      res["loss"].append(f(beta).item())
+      res["iter"].append(res["iter"][-1]+1)
+
+  return res
+
+
+def adagrad_lm(X, y, beta, step, batch_size = 10, max_step=50, seed=1234, replace=True, eps=1e-8):
+  X = jnp.c_[jnp.ones(X.shape[0]), X]
+  f = lambda beta: jnp.sum((y - X @ beta)**2)
+  grad = lambda beta, i: 2*X[i,:].T @ (X[i,:]@beta - y[i])
+  n, k = X.shape
+
+  res = {"x": [beta], "loss": [f(beta).item()], "iter": [0]}
+  rng = np.random.default_rng(seed)
+
+  S = np.zeros(k)
+
+  for i in range(max_step):
+    if replace:
+      js = rng.integers(0,n,n)
+    else:
+      js = np.array(range(n))
+      rng.shuffle(js)
+
+    for j in js.reshape(-1, batch_size):
+      G = grad(beta, j)
+      S += G**2
+
+      beta = beta - step * (1/np.sqrt(S + eps)) * G
+
+      res["x"].append(beta)
+      res["loss"].append(f(beta).item())
+      res["iter"].append(res["iter"][-1]+1)
+
+  return res
+
+
+def rmsprop_lm(X, y, beta, step, batch_size = 10, max_step=50, seed=1234, replace=True, eps=1e-8, b=0.9):
+  X = jnp.c_[jnp.ones(X.shape[0]), X]
+  f = lambda beta: jnp.sum((y - X @ beta)**2)
+  grad = lambda beta, i: 2*X[i,:].T @ (X[i,:]@beta - y[i])
+  n, k = X.shape
+
+  res = {"x": [beta], "loss": [f(beta).item()], "iter": [0]}
+  rng = np.random.default_rng(seed)
+
+  S = np.zeros(k)
+
+  for i in range(max_step):
+    if replace:
+      js = rng.integers(0,n,n)
+    else:
+      js = np.array(range(n))
+      rng.shuffle(js)
+
+    for j in js.reshape(-1, batch_size):
+      G = grad(beta, j)
+      S = b*S + (1-b) * G**2
+
+      beta = beta - step * (1/np.sqrt(S + eps)) * G
+
+      res["x"].append(beta)
+      res["loss"].append(f(beta).item())
+      res["iter"].append(res["iter"][-1]+1)
+
+  return res
+
+
+def adam_lm(X, y, beta, step=0.001, batch_size = 10, max_step=50, seed=1234, replace=True, eps=1e-6, b1=0.9, b2=0.999):
+  X = jnp.c_[jnp.ones(X.shape[0]), X]
+  f = lambda beta: jnp.sum((y - X @ beta)**2)
+  grad = lambda beta, i: 2*X[i,:].T @ (X[i,:]@beta - y[i])
+  n, k = X.shape
+
+  res = {"x": [beta], "loss": [f(beta).item()], "iter": [0]}
+  rng = np.random.default_rng(seed)
+
+  S = np.zeros(k)
+  M = np.zeros(k)
+  t = 0
+
+  for i in range(max_step):
+    if replace:
+      js = rng.integers(0,n,n)
+    else:
+      js = np.array(range(n))
+      rng.shuffle(js)
+
+    for j in js.reshape(-1, batch_size):
+      t += 1
+      G = grad(beta, j)
+      S = b2*S + (1-b2) * G**2
+      M = b1*M + (1-b1) * G
+
+      M_hat = M / (1-b1**t)
+      S_hat = S / (1-b2**t)
+
+      beta = beta - step * (M_hat / np.sqrt(S_hat + eps))
+
+      res["x"].append(beta)
+      res["loss"].append(f(beta).item())
+      res["iter"].append(t)
+
+  return res
+
+
+## Unified engine - agrees with the Lec15 functions
+
+X, y, coef = make_regression(
+  n_samples=1000, n_features=20, n_informative=4,
+  bias=3, noise=1, random_state=1234, coef=True
+)
+beta0 = np.zeros(X.shape[1]+1)
+
+for name, orig, rule, step in [
+  ("mbgd", mb_grad_desc_lm, "sgd", 0.001),
+  ("adagrad", adagrad_lm, "adagrad", 10),
+  ("rmsprop", rmsprop_lm, "rmsprop", 0.1),
+  ("adam", adam_lm, "adam", 0.5)
+]:
+  a = orig(X, y, beta0, step=step, batch_size=25, max_step=3)
+  b = sgd_lm(X, y, beta0, step=step, rule=rule, batch_size=25, max_step=3)
+  print(name, np.allclose(a["x"][-1], b["x"][-1]), np.allclose(a["loss"], b["loss"]))
+
+# Momentum is new, all rules take the same arguments
+sgd_lm(X, y, beta0, step=0.0005, rule="momentum", batch_size=25, max_step=10, eval_every=None)["x"][-1]
+lm = LinearRegression().fit(X, y)
+np.r_[lm.intercept_, lm.coef_]
+
+
+## Unified engine - loss evaluation
+#
+# Evaluating the full data loss after every step costs as much as the steps
+# themselves, evaluating every 10 steps on a 1000 row subsample is much cheaper
+# and the curve looks the same.
+
+X, y, coef = make_regression(
+  n_samples=100_000, n_features=20, n_informative=4,
+  bias=3, noise=1, random_state=1234, coef=True
+)
+beta0 = np.zeros(X.shape[1]+1)
+
+full = sgd_lm(X, y, beta0, step=0.5, rule="adam", batch_size=100, max_step=2)
+sub = sgd_lm(X, y, beta0, step=0.5, rule="adam", batch_size=100, max_step=2, eval_every=10, eval_sample=1000)
+
+# Monitoring doesn't change the fit, both runs end at the same β
+np.array_equal(full["x"][-1], sub["x"][-1])
+
+plt.figure()
+plt.plot(full["iter"], full["loss"], label="full data, every step")
+plt.plot(sub["iter"], sub["loss"], label="1000 rows, every 10 steps")
+plt.yscale("log")
+plt.xlabel("iter")
+plt.ylabel("Loss")
+plt.legend()
+plt.show()
+
+
+## Unified engine - benchmark
+
+X, y, coef = make_regression(
+  n_samples=10_000, n_features=20, n_informative=4,
+  bias=3, noise=1, random_state=1234, coef=True
+)
+beta0 = np.zeros(X.shape[1]+1)
+
+timings = {}
+for size in [25, 100, 1000]:
+  start = time.perf_counter()
+  adam_lm(X, y, beta0, step=0.5, batch_size=size, max_step=1)
+  t_orig = time.perf_counter() - start
+
+  timings[size] = {
+    "adam_lm": t_orig,
+    "sgd_lm": min(timeit.repeat(
+      lambda: sgd_lm(X, y, beta0, step=0.5, rule="adam", batch_size=size, max_step=1),
+      number=1, repeat=3
+    )),
+    "sgd_lm (eval per epoch)": min(timeit.repeat(
+      lambda: sgd_lm(X, y, beta0, step=0.5, rule="adam", batch_size=size, max_step=1, eval_every=None),
+      number=1, repeat=3
+    ))
+  }
+
+# Lower bound for one epoch, the two matrix-vector products of a full gradient
+Xb = np.c_[np.ones(X.shape[0]), X]
+t_matmul = min(timeit.repeat(lambda: 2 * (Xb @ beta0 - y) @ Xb, number=100, repeat=3)) / 100
+
+pd.DataFrame(timings).T.assign(matmul=t_matmul)
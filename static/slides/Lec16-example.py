@@ -9,9 +9,33 @@ import jax.numpy as jnp
 jax.config.update("jax_enable_x64", True)
 
 import optax
+from functools import partial
+from jax import lax
 
 
-def optax_optimize(params, X, y, loss_fn, predict, score, optimizer, steps=50, batch_size=1, seed=1234):
+# With a BatchLoader (batch_loader.py) as `loader` its batches are used instead
+# of batch_size / seed, reshuffled every epoch, and the loss is called as
+# loss_fn(params, X_b, y_b, mask). X and y are then only used for the metrics.
+# A loader also allows a Checkpointer (checkpoint.py) as `checkpoint`, see
+# _fit_loader() below.
+def optax_optimize(params, X, y, loss_fn, predict, score, optimizer, steps=50, batch_size=1, seed=1234, jit=False, loader=None, checkpoint=None):
+  if jit:
+    return optax_optimize_jit(params, X, y, loss_fn, predict, score, optimizer, steps, batch_size, seed, loader, checkpoint)
+  if loader is not None:
+    value_and_grad = jax.value_and_grad(loss_fn)
+
+    def step(params, opt_state, batch):
+      loss, grad = value_and_grad(params, *batch)
+      updates, opt_state = optimizer.update(grad, opt_state, params)
+      return (optax.apply_updates(params, updates), opt_state), loss
+
+    def evaluate(params, X, y):
+      return loss_fn(params, X, y), score(predict(params, X), y)
+
+    return _fit_loader(params, X, y, optimizer, steps, loader, step, evaluate, checkpoint)
+  if checkpoint is not None:
+    raise ValueError("checkpoint requires a loader")
+
   n, k = X.shape
   res = {"loss": [], "score": [], "epoch": list(range(steps+1))}
 
@@ -25,7 +49,7 @@ def optax_optimize(params, X, y, loss_fn, predict, score, optimizer, steps=50, b
   for iter in range(steps):
     res["loss"].append(loss_fn(params, X, y).item())
     res["score"].append(score(predict(params, X), y).item())
-    
+
     for batch in batches.reshape(-1, batch_size):
       grad = grad_fn(params, X[batch,:], y[batch])
       updates, opt_state = optimizer.update(grad, opt_state)
@@ -37,6 +61,242 @@ def optax_optimize(params, X, y, loss_fn, predict, score, optimizer, steps=50, b
 
   return(res)
 
+
+## Compiled training loop
+#
+# One epoch is a single jitted lax.scan over the batches, which are gathered
+# into a (n_batches, batch_size, ...) array on the device once. Each scan step
+# fuses the gradient, optimizer update and apply_updates, and the metrics stay
+# on the device until all epochs have been dispatched, so there is no host
+# sync inside the loop. With a loader the batches are streamed instead and
+# each one is a call to the jitted train step (compiled once, as the loader
+# pads the last batch). The jitted functions are cached per (loss_fn, predict,
+# score, optimizer), reusing the functions and optimizer avoids recompiling.
+
+_epoch_cache = {}
+
+def make_epoch(loss_fn, predict, score, optimizer):
+  key = (loss_fn, predict, score, optimizer)
+  if key in _epoch_cache:
+    return _epoch_cache[key]
+
+  value_and_grad = jax.value_and_grad(loss_fn)
+
+  def train_step(carry, batch):
+    params, opt_state = carry
+    loss, grad = value_and_grad(params, *batch)
+    updates, opt_state = optimizer.update(grad, opt_state, params)
+    return (optax.apply_updates(params, updates), opt_state), loss
+
+  @jax.jit
+  def epoch(params, opt_state, batches, X, y):
+    metrics = (loss_fn(params, X, y), score(predict(params, X), y))
+    (params, opt_state), batch_loss = lax.scan(train_step, (params, opt_state), batches)
+    return params, opt_state, metrics, jnp.mean(batch_loss)
+
+  @jax.jit
+  def evaluate(params, X, y):
+    return loss_fn(params, X, y), score(predict(params, X), y)
+
+  @jax.jit
+  def step(params, opt_state, batch):
+    return train_step((params, opt_state), batch)
+
+  _epoch_cache[key] = epoch, evaluate, step
+  return epoch, evaluate, step
+
+
+def optax_optimize_jit(params, X, y, loss_fn, predict, score, optimizer, steps=50, batch_size=1, seed=1234, loader=None, checkpoint=None):
+  n, k = X.shape
+  epoch, evaluate, step = make_epoch(loss_fn, predict, score, optimizer)
+
+  # Host arrays and device arrays are cached separately by jit, so move
+  # everything to the device first
+  X, y, params = jax.device_put((X, y, params))
+
+  if loader is not None:
+    return _fit_loader(params, X, y, optimizer, steps, loader, step, evaluate, checkpoint)
+  if checkpoint is not None:
+    raise ValueError("checkpoint requires a loader")
+
+  # Same (fixed) batch order as optax_optimize
+  opt_state = optimizer.init(params)
+  rng = np.random.default_rng(seed)
+  idx = np.array(range(n))
+  rng.shuffle(idx)
+  idx = idx.reshape(-1, batch_size)
+  batches = (X[idx], y[idx])
+
+  metrics, batch_loss = [], []
+  for iter in range(steps):
+    params, opt_state, m, bl = epoch(params, opt_state, batches, X, y)
+    metrics.append(m)
+    batch_loss.append(bl)
+  metrics.append(evaluate(params, X, y))
+
+  return _result(params, metrics, batch_loss, steps)
+
+
+def _result(params, metrics, batch_loss, steps):
+  # The only transfer back to the host
+  metrics, batch_loss = jax.device_get((metrics, batch_loss))
+
+  return {
+    "loss": [float(m[0]) for m in metrics],
+    "score": [float(m[1]) for m in metrics],
+    "epoch": list(range(steps+1)),
+    "batch_loss": [float(l) for l in batch_loss],
+    "params": params
+  }
+
+
+## Checkpointed training with a loader
+#
+# Every checkpoint.every batches the params, optimizer state, position (epoch
+# and batch), the loader's RNG state at the start of the epoch and the metric
+# history are saved. If the checkpoint directory already has a checkpoint,
+# training resumes from it: the loader replays the interrupted epoch's batch
+# order and skips the batches already used, so an interrupted and resumed fit
+# ends with the same result as an uninterrupted one.
+
+def _fit_loader(params, X, y, optimizer, steps, loader, step, evaluate, checkpoint=None):
+  opt_state = optimizer.init(params)
+  metrics, batch_loss, losses = [], [], []
+  start_epoch, skip = 0, 0
+
+  saved = checkpoint.restore() if checkpoint is not None else None
+  if saved is not None:
+    _, state = saved
+    params, opt_state = jax.device_put((state["params"], state["opt_state"]))
+    metrics, batch_loss, losses = state["metrics"], state["batch_loss"], state["losses"]
+    start_epoch, skip = state["epoch"], state["batch"]
+    loader.set_state(state["loader_state"])
+
+  n_step = start_epoch * len(loader) + skip
+  for epoch in range(start_epoch, steps):
+    loader_state = loader.get_state()
+    if skip == 0:
+      metrics.append(evaluate(params, X, y))
+      losses = []
+
+    for b, batch in enumerate(loader.epoch(skip), start=skip+1):
+      (params, opt_state), loss = step(params, opt_state, batch)
+      losses.append(loss)
+      n_step += 1
+
+      if checkpoint is not None and checkpoint.due(n_step):
+        checkpoint.save(n_step, {
+          "params": params, "opt_state": opt_state,
+          "epoch": epoch, "batch": b, "loader_state": loader_state,
+          "metrics": metrics, "batch_loss": batch_loss, "losses": losses
+        })
+
+    batch_loss.append(jnp.mean(jnp.stack(losses)))
+    skip = 0
+  metrics.append(evaluate(params, X, y))
+
+  if checkpoint is not None:
+    checkpoint.wait()
+
+  return _result(params, metrics, batch_loss, steps)
+
+## Training many configurations at once
+#
+# Trains N configurations (initial parameters, seeds and optimizer
+# hyperparameters) as one compiled program: the train step is vmapped over a
+# leading config axis and the whole fit is a lax.scan over epochs of a
+# lax.scan over batches. `params` must have a leading axis of length N,
+# hyperparams are passed to optax.inject_hyperparams(optimizer_fn) and are
+# either scalars or length N arrays, and each seed gives the batch order for
+# its config (reshuffled every epoch, drawn like BatchLoader does). The last
+# partial batch is padded and masked so loss_fn must accept a mask. Returns a
+# list of N results with the same structure as optax_optimize's. The compiled
+# fit is cached per (loss_fn, predict, score, optimizer_fn) and only recompiles
+# for new shapes.
+
+def batch_indices(seed, n, batch_size, steps):
+  rng = np.random.default_rng(seed)
+  n_batches = -(-n // batch_size)
+  idx = np.zeros((steps, n_batches * batch_size), dtype=np.intp)
+  mask = np.zeros((steps, n_batches * batch_size))
+  for epoch in range(steps):
+    idx[epoch, :n] = rng.permutation(n)
+    mask[epoch, :n] = 1
+  return idx.reshape(steps, n_batches, batch_size), mask.reshape(steps, n_batches, batch_size)
+
+
+_vmap_cache = {}
+
+def make_fit_vmap(loss_fn, predict, score, optimizer_fn):
+  key = (loss_fn, predict, score, optimizer_fn)
+  if key in _vmap_cache:
+    return _vmap_cache[key]
+
+  value_and_grad = jax.value_and_grad(loss_fn)
+
+  def metrics(params, X, y):
+    return loss_fn(params, X, y), score(predict(params, X), y)
+
+  # Each config's optimizer is rebuilt from the hyperparameters in its state
+  def init(params, hyperparams):
+    return optax.inject_hyperparams(optimizer_fn)(**hyperparams).init(params)
+
+  def train_step(params, opt_state, X, y, idx, mask):
+    loss, grad = value_and_grad(params, X[idx], y[idx], mask)
+    optimizer = optax.inject_hyperparams(optimizer_fn)(**opt_state.hyperparams)
+    updates, opt_state = optimizer.update(grad, opt_state, params)
+    return optax.apply_updates(params, updates), opt_state
+
+  @jax.jit
+  def fit(params, hyperparams, X, y, idx, mask):
+    batch_step = jax.vmap(train_step, in_axes=(0, 0, None, None, 0, 0))
+    vmetrics = jax.vmap(metrics, in_axes=(0, None, None))
+
+    def batch_scan(carry, batch):
+      return batch_step(*carry, X, y, *batch), None
+
+    def epoch_scan(carry, epoch):
+      m = vmetrics(carry[0], X, y)
+      carry, _ = lax.scan(batch_scan, carry, epoch)
+      return carry, m
+
+    opt_state = jax.vmap(init)(params, hyperparams)
+    (params, opt_state), m = lax.scan(epoch_scan, (params, opt_state), (idx, mask))
+    m_final = vmetrics(params, X, y)
+    return params, jax.tree_util.tree_map(lambda a, b: jnp.concatenate([a, b[None]]), m, m_final)
+
+  _vmap_cache[key] = fit
+  return fit
+
+
+def optax_optimize_vmap(params, X, y, loss_fn, predict, score, optimizer_fn, hyperparams, seeds, steps=50, batch_size=1):
+  n, k = X.shape
+  n_configs = jax.tree_util.tree_leaves(params)[0].shape[0]
+  seeds = np.broadcast_to(seeds, (n_configs,))
+  hyperparams = {
+    name: np.broadcast_to(value, (n_configs,)) for name, value in hyperparams.items()
+  }
+
+  # (steps, batches, configs, batch_size), so each scan step gets every
+  # config's batch
+  idx, mask = zip(*[batch_indices(seed, n, batch_size, steps) for seed in seeds])
+  idx, mask = np.stack(idx, axis=2), np.stack(mask, axis=2)
+
+  fit = make_fit_vmap(loss_fn, predict, score, optimizer_fn)
+  params, (loss, sc) = fit(*jax.device_put((params, hyperparams, X, y, idx, mask)))
+  loss, sc = jax.device_get((loss, sc))
+
+  return [
+    {
+      "loss": loss[:, i].tolist(),
+      "score": sc[:, i].tolist(),
+      "epoch": list(range(steps+1)),
+      "params": jax.tree_util.tree_map(lambda p: p[i], params)
+    }
+    for i in range(n_configs)
+  ]
+
+
 ## Load data
 
 from sklearn.datasets import load_digits
@@ -68,12 +328,13 @@ def predict(beta, X):
 def accuracy(pred, y):
   return jnp.sum(pred == y) / len(y)
 
-def loss_fn(beta, X, y):
+# mask weights the rows of a padded batch (see batch_loader.py)
+def loss_fn(beta, X, y, mask=None):
   y_one_hot = jax.nn.one_hot(y, 10)
   preds = jax.nn.log_softmax(X @ beta)
   
   # Cross entropy loss function
-  return -jnp.mean(jnp.sum(y_one_hot * preds, axis=1))
+  return -jnp.average(jnp.sum(y_one_hot * preds, axis=1), weights=mask)
 
 loss_fn(beta, X, y)
 predict(beta, X)
@@ -102,3 +363,359 @@ plt.ylabel("accuracy")
 plt.show()
 
 
+## Compiled training loop
+
+sgd = optax.sgd(learning_rate=0.01)
+
+res_jit = optax_optimize(
+  beta, X, y, loss_fn, predict, accuracy, sgd,
+  steps=100, batch_size=100, seed=1234, jit=True
+)
+
+res_loop = optax_optimize(
+  beta, X, y, loss_fn, predict, accuracy, sgd,
+  steps=100, batch_size=100, seed=1234
+)
+
+np.allclose(res_jit["loss"], res_loop["loss"]), np.allclose(res_jit["score"], res_loop["score"])
+
+
+## Benchmark
+
+import time
+
+timings = {}
+for batch_size in [10, 100, 1700]:
+  t = {}
+  for name, jit in [("loop", False), ("scan", True)]:
+    start = time.perf_counter()
+    optax_optimize(
+      beta, X, y, loss_fn, predict, accuracy, sgd,
+      steps=20, batch_size=batch_size, seed=1234, jit=jit
+    )
+    t[name] = time.perf_counter() - start
+  timings[batch_size] = t
+
+# The first scan call above includes compiling, the second does not
+for batch_size in timings:
+  start = time.perf_counter()
+  optax_optimize(
+    beta, X, y, loss_fn, predict, accuracy, sgd,
+    steps=20, batch_size=batch_size, seed=1234, jit=True
+  )
+  timings[batch_size]["scan (compiled)"] = time.perf_counter() - start
+
+pd.DataFrame(timings).T
+
+
+## Streaming batches
+#
+# All 1797 digits (not a multiple of the batch size) with a new batch order
+# every epoch. The last batch of 97 rows is padded to 100, so the jitted step
+# is only compiled once.
+
+from batch_loader import BatchLoader
+
+X_all = np.c_[[1]*digits.data.shape[0], digits.data]
+y_all = digits.target
+
+loader = BatchLoader(X_all, y_all, batch_size=100, seed=1234)
+len(loader), [b[2].sum().item() for b in loader][-2:]
+
+res_stream = optax_optimize(
+  beta, X_all, y_all, loss_fn, predict, accuracy, sgd,
+  steps=100, jit=True, loader=loader
+)
+res_stream["score"][-1], make_epoch(loss_fn, predict, accuracy, sgd)[2]._cache_size()
+
+plt.figure()
+plt.plot(res_jit["epoch"], res_jit["loss"], "-k", label="fixed batch order (1700 rows)")
+plt.plot(res_stream["epoch"], res_stream["loss"], "-b", label="reshuffled each epoch (1797 rows)")
+plt.xlabel("epoch")
+plt.ylabel("loss")
+plt.legend()
+plt.show()
+
+
+## Streaming batches - memory mapped data
+#
+# 500k rows (~260MB) written to a memory mapped .npy file and read back a batch
+# at a time, the full data metrics use a 2000 row subsample. Prefetching
+# overlaps reading the next batch with the current step.
+
+import os
+import shutil
+import tempfile
+
+tmp = tempfile.mkdtemp()
+X_mm = np.lib.format.open_memmap(os.path.join(tmp, "X.npy"), mode="w+", dtype=np.float64, shape=(500_000, k))
+y_mm = np.lib.format.open_memmap(os.path.join(tmp, "y.npy"), mode="w+", dtype=np.int64, shape=(500_000,))
+for start in range(0, len(X_mm), len(X_all)):
+  stop = min(start + len(X_all), len(X_mm))
+  X_mm[start:stop] = X_all[:stop-start]
+  y_mm[start:stop] = y_all[:stop-start]
+X_mm.flush(); y_mm.flush()
+del X_mm, y_mm
+
+X_mm = np.load(os.path.join(tmp, "X.npy"), mmap_mode="r")
+y_mm = np.load(os.path.join(tmp, "y.npy"), mmap_mode="r")
+
+timings = {}
+for prefetch in [0, 2]:
+  loader = BatchLoader(X_mm, y_mm, batch_size=1000, seed=1234, prefetch=prefetch)
+  start = time.perf_counter()
+  res_mm = optax_optimize(
+    beta, X_all[:2000], y_all[:2000], loss_fn, predict, accuracy, sgd,
+    steps=2, jit=True, loader=loader
+  )
+  timings[f"{prefetch=}"] = time.perf_counter() - start
+
+timings, res_mm["score"]
+
+del X_mm, y_mm, loader
+shutil.rmtree(tmp)
+
+
+## Many configurations - vmap
+#
+# 4 learning rates x 4 seeds (initial values and batch order) in one program,
+# checked against optax_optimize with a BatchLoader for one of them.
+
+lrs = np.repeat([0.001, 0.01, 0.05, 0.1], 4)
+seeds = np.tile([1, 2, 3, 4], 4)
+betas = np.stack([np.random.default_rng(seed).normal(size=(k,l)) for seed in seeds])
+
+res_vmap = optax_optimize_vmap(
+  betas, X_all, y_all, loss_fn, predict, accuracy, optax.sgd,
+  hyperparams={"learning_rate": lrs}, seeds=seeds, steps=50, batch_size=100
+)
+
+res_one = optax_optimize(
+  betas[5], X_all, y_all, loss_fn, predict, accuracy, optax.sgd(learning_rate=lrs[5]),
+  steps=50, loader=BatchLoader(X_all, y_all, batch_size=100, seed=seeds[5])
+)
+np.allclose(res_vmap[5]["loss"], res_one["loss"]), np.allclose(res_vmap[5]["score"], res_one["score"])
+
+curves = pd.concat([
+  pd.DataFrame({key: r[key] for key in ["epoch", "loss", "score"]}).assign(lr=lr, seed=seed)
+  for r, lr, seed in zip(res_vmap, lrs, seeds)
+])
+sns.relplot(data=curves, x="epoch", y="loss", hue="lr", units="seed", estimator=None, kind="line", palette="viridis")
+plt.yscale("log")
+plt.show()
+
+curves.groupby("lr").score.last()
+
+# The serial baseline reuses one jitted step (make_epoch caches per optimizer
+# object), with the learning rate set in each run's optimizer state. Both are
+# run once first so the timings exclude compilation.
+sgd_inj = optax.inject_hyperparams(optax.sgd)(learning_rate=0.01)
+_, evaluate_inj, step_inj = make_epoch(loss_fn, predict, accuracy, sgd_inj)
+
+def serial_fit(beta, lr, seed, steps=50):
+  params = jax.device_put(beta)
+  opt_state = sgd_inj.init(params)
+  opt_state.hyperparams["learning_rate"] = jnp.asarray(lr, dtype=jnp.float64)
+  loader = BatchLoader(X_all, y_all, batch_size=100, seed=seed)
+  metrics = []
+  for epoch in range(steps):
+    metrics.append(evaluate_inj(params, X_all_d, y_all_d))
+    for batch in loader:
+      (params, opt_state), loss = step_inj(params, opt_state, batch)
+  metrics.append(evaluate_inj(params, X_all_d, y_all_d))
+  return jax.device_get((params, metrics))
+
+X_all_d, y_all_d = jax.device_put((X_all, y_all))
+vmap_args = (
+  betas, X_all, y_all, loss_fn, predict, accuracy, optax.sgd,
+  {"learning_rate": lrs}, seeds, 50, 100
+)
+
+serial_fit(betas[0], lrs[0], seeds[0])
+optax_optimize_vmap(*vmap_args)
+
+start = time.perf_counter()
+for lr, seed, b in zip(lrs, seeds, betas):
+  serial_fit(b, lr, seed)
+t_serial = time.perf_counter() - start
+
+start = time.perf_counter()
+optax_optimize_vmap(*vmap_args)
+t_vmap = time.perf_counter() - start
+
+{"serial (jit)": t_serial, "vmap": t_vmap}
+
+# One compiled fit, reused across calls and datasets of the same shape
+fit_vmap = make_fit_vmap(loss_fn, predict, accuracy, optax.sgd)
+fit_vmap._cache_size(), step_inj._cache_size()
+
+
+## Lean loss and predict
+#
+# The cross entropy only needs each row's logit for the true class minus the
+# row's logsumexp, so the labels are gathered with take_along_axis instead of
+# multiplying by a one_hot matrix, and argmax doesn't need log_softmax at all
+# (the normalization is the same for every class in a row). With many classes
+# even the (n, l) logit matrix is large, the chunked versions compute it
+# chunk_size rows at a time with lax.map (and jax.checkpoint recomputes a
+# chunk's logits in the backward pass rather than storing them).
+
+def predict_lean(beta, X):
+  return jnp.argmax(X @ beta, axis=1)
+
+def loss_fn_lean(beta, X, y, mask=None):
+  logits = X @ beta
+  ll = jnp.take_along_axis(logits, y[:, None], axis=1)[:, 0] - jax.nn.logsumexp(logits, axis=1)
+  return -jnp.average(ll, weights=mask)
+
+def _row_chunks(chunk_size, *arrays):
+  n = arrays[0].shape[0]
+  n_pad = -n % chunk_size
+  return [
+    jnp.pad(a, [(0, n_pad)] + [(0, 0)] * (a.ndim-1)).reshape((-1, chunk_size) + a.shape[1:])
+    for a in arrays
+  ]
+
+def predict_chunked(beta, X, chunk_size=1024):
+  (Xc,) = _row_chunks(chunk_size, X)
+  pred = lax.map(lambda Xi: jnp.argmax(Xi @ beta, axis=1), Xc)
+  return pred.reshape(-1)[:X.shape[0]]
+
+def loss_fn_chunked(beta, X, y, mask=None, chunk_size=1024):
+  Xc, yc = _row_chunks(chunk_size, X, y)
+
+  @jax.checkpoint
+  def chunk_ll(chunk):
+    Xi, yi = chunk
+    logits = Xi @ beta
+    return jnp.take_along_axis(logits, yi[:, None], axis=1)[:, 0] - jax.nn.logsumexp(logits, axis=1)
+
+  ll = lax.map(chunk_ll, (Xc, yc)).reshape(-1)[:X.shape[0]]
+  return -jnp.average(ll, weights=mask)
+
+
+## Lean loss and predict - agree with loss_fn / predict
+
+mask = np.random.default_rng(1234).integers(0, 2, size=len(y_all)).astype(float)
+
+for f in [loss_fn_lean, partial(loss_fn_chunked, chunk_size=256)]:
+  print(
+    np.allclose(f(beta, X_all, y_all), loss_fn(beta, X_all, y_all)),
+    np.allclose(f(beta, X_all, y_all, mask), loss_fn(beta, X_all, y_all, mask)),
+    np.allclose(jax.grad(f)(beta, X_all, y_all), jax.grad(loss_fn)(beta, X_all, y_all))
+  )
+
+np.array_equal(predict_lean(beta, X_all), predict(beta, X_all))
+np.array_equal(predict_chunked(beta, X_all, chunk_size=256), predict(beta, X_all))
+
+
+## Lean loss and predict - memory and latency
+#
+# Peak temporary memory of the compiled loss + gradient (from XLA's memory
+# analysis) and run time, for the digits model and a synthetic one with 5000
+# classes. loss_fn's one_hot uses the number of classes of beta here.
+
+import timeit
+
+def loss_fn_onehot(beta, X, y, mask=None):
+  y_one_hot = jax.nn.one_hot(y, beta.shape[1])
+  preds = jax.nn.log_softmax(X @ beta)
+  return -jnp.average(jnp.sum(y_one_hot * preds, axis=1), weights=mask)
+
+rng = np.random.default_rng(1234)
+wide = (
+  rng.normal(scale=0.1, size=(k, 5000)),
+  rng.normal(size=(10_000, k)),
+  rng.integers(0, 5000, size=10_000)
+)
+
+bench = []
+for data_name, args in [("digits", (beta, X_all, y_all)), ("5000 classes", wide)]:
+  args = jax.device_put(args)
+  for name, f in [
+    ("one_hot + log_softmax", loss_fn_onehot),
+    ("gather + logsumexp", loss_fn_lean),
+    ("chunked", loss_fn_chunked)
+  ]:
+    g = jax.jit(jax.value_and_grad(f))
+    mem = g.lower(*args).compile().memory_analysis().temp_size_in_bytes
+    jax.block_until_ready(g(*args))
+    t = min(timeit.repeat(lambda: jax.block_until_ready(g(*args)), number=10, repeat=3)) / 10
+    bench.append({"data": data_name, "function": name, "temp MB": mem / 2**20, "time (ms)": 1000 * t})
+
+  for name, f in [
+    ("log_softmax + argmax", predict),
+    ("argmax", predict_lean),
+    ("chunked argmax", predict_chunked)
+  ]:
+    g = jax.jit(f)
+    mem = g.lower(*args[:2]).compile().memory_analysis().temp_size_in_bytes
+    jax.block_until_ready(g(*args[:2]))
+    t = min(timeit.repeat(lambda: jax.block_until_ready(g(*args[:2])), number=10, repeat=3)) / 10
+    bench.append({"data": data_name, "function": name, "temp MB": mem / 2**20, "time (ms)": 1000 * t})
+
+pd.DataFrame(bench)
+
+
+## Checkpoint and resume
+#
+# A fit that is interrupted after 1234 batches (as a preempted node would be)
+# and then restarted with the same checkpoint directory picks up mid-epoch and
+# ends with the same parameters and history as an uninterrupted fit.
+
+from checkpoint import Checkpointer
+
+class interrupt_after:
+  def __init__(self, loader, n):
+    self.loader, self.n = loader, n
+
+  def __len__(self):
+    return len(self.loader)
+
+  def get_state(self):
+    return self.loader.get_state()
+
+  def set_state(self, state):
+    self.loader.set_state(state)
+
+  def epoch(self, skip=0):
+    for batch in self.loader.epoch(skip):
+      if self.n == 0:
+        raise KeyboardInterrupt("preempted")
+      self.n -= 1
+      yield batch
+
+ckpt_dir = tempfile.mkdtemp()
+fit_args = (beta, X_all, y_all, loss_fn, predict, accuracy, sgd)
+
+res_full = optax_optimize(*fit_args, steps=100, jit=True, loader=BatchLoader(X_all, y_all, batch_size=100, seed=42))
+
+ckpt = Checkpointer(ckpt_dir, keep=3, every=50)
+try:
+  optax_optimize(
+    *fit_args, steps=100, jit=True, checkpoint=ckpt,
+    loader=interrupt_after(BatchLoader(X_all, y_all, batch_size=100, seed=42), 1234)
+  )
+except KeyboardInterrupt:
+  ckpt.wait()
+ckpt.steps(), ckpt.stats
+
+res_resumed = optax_optimize(
+  *fit_args, steps=100, jit=True, checkpoint=Checkpointer(ckpt_dir, keep=3, every=50),
+  loader=BatchLoader(X_all, y_all, batch_size=100, seed=42)
+)
+np.array_equal(res_full["params"], res_resumed["params"]), res_full["loss"] == res_resumed["loss"]
+
+# Cost of checkpointing every 10 batches, the writes happen in the background
+shutil.rmtree(ckpt_dir)
+start = time.perf_counter()
+optax_optimize(*fit_args, steps=100, jit=True, loader=BatchLoader(X_all, y_all, batch_size=100, seed=42))
+t_plain = time.perf_counter() - start
+
+ckpt = Checkpointer(ckpt_dir, keep=3, every=10)
+start = time.perf_counter()
+optax_optimize(*fit_args, steps=100, jit=True, checkpoint=ckpt, loader=BatchLoader(X_all, y_all, batch_size=100, seed=42))
+t_ckpt = time.perf_counter() - start
+
+{"no checkpoints": t_plain, "checkpoint every 10 batches": t_ckpt}, ckpt.stats
+shutil.rmtree(ckpt_dir)
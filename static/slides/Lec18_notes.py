@@ -0,0 +1,360 @@
+## Setup
+
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import matplotlib.pyplot as plt
+
+import torch
+
+from sklearn.datasets import load_digits
+from sklearn.model_selection import train_test_split
+
+from checkpoint import Checkpointer
+
+digits = load_digits()
+X, y = digits.data, digits.target
+
+X_train, X_test, y_train, y_test = train_test_split(
+    X, y, test_size=0.20, shuffle=True, random_state=1234
+)
+
+X_train = torch.from_numpy(X_train).float()
+y_train = torch.from_numpy(y_train)
+X_test = torch.from_numpy(X_test).float()
+y_test = torch.from_numpy(y_test)
+
+
+## MNIST models (from Lec18)
+#
+# The models only differ in __init__ and forward, so fit lives in a shared
+# base class. With a Checkpointer (checkpoint.py) as `checkpoint`, every
+# checkpoint.every steps the weights, optimizer state (momentum buffers), torch
+# RNG state, step and loss / accuracy history are saved in the background, and
+# a fit started with a checkpoint directory that already has a checkpoint
+# resumes from its step.
+#
+# fit_loader() is the mini-batch version of fit, it takes a DataLoader (or any
+# iterable of (X_b, y_b) batches that can be iterated once per epoch) so only
+# one batch needs to be in memory at a time. With accum_steps=k the gradients
+# of k batches are summed before each optimizer step, i.e. steps are taken on
+# an effective batch of k * batch_size rows. The training accuracy comes from
+# the predictions made during the epoch and the test accuracy from accuracy(),
+# which works through the data in batches under torch.inference_mode() so no
+# autograd graph is built.
+
+class mnist_base(torch.nn.Module):
+    def fit(self, X_train, y_train, X_test, y_test, lr=0.001, n=1000, acc_step=10, checkpoint=None):
+      loss_fn = torch.nn.CrossEntropyLoss()
+      opt = torch.optim.SGD(self.parameters(), lr=lr, momentum=0.9)
+      losses, train_acc, test_acc = [], [], []
+      start = 0
+
+      saved = checkpoint.restore() if checkpoint is not None else None
+      if saved is not None:
+        start, state = saved
+        self.load_state_dict(state["model"])
+        opt.load_state_dict(state["opt"])
+        torch.set_rng_state(state["rng"])
+        losses, train_acc, test_acc = state["losses"], state["train_acc"], state["test_acc"]
+
+      for i in range(start, n):
+          opt.zero_grad()
+          loss = loss_fn(self(X_train), y_train)
+          loss.backward()
+          opt.step()
+
+          losses.append(loss.item())
+
+          if (i+1) % acc_step == 0:
+            train_acc.append( self.accuracy(X_train, y_train) )
+            test_acc.append( self.accuracy(X_test, y_test) )
+
+          if checkpoint is not None and checkpoint.due(i+1):
+            checkpoint.save(i+1, {
+              "model": self.state_dict(), "opt": opt.state_dict(),
+              "rng": torch.get_rng_state(),
+              "losses": losses, "train_acc": train_acc, "test_acc": test_acc
+            })
+
+      if checkpoint is not None:
+        checkpoint.wait()
+
+      return (losses, train_acc, test_acc)
+
+    def fit_loader(self, loader, X_test=None, y_test=None, lr=0.001, epochs=10, accum_steps=1):
+      loss_fn = torch.nn.CrossEntropyLoss()
+      opt = torch.optim.SGD(self.parameters(), lr=lr, momentum=0.9)
+      losses, train_acc, test_acc = [], [], []
+
+      for epoch in range(epochs):
+          total_loss, correct, total = 0.0, 0, 0
+          opt.zero_grad()
+          group_n = 0
+
+          for i, (X, y) in enumerate(loader):
+              out = self(X)
+              loss = loss_fn(out, y)
+              total_loss += loss.item() * len(y)
+              correct += (out.argmax(dim=1) == y).sum().item()
+              total += len(y)
+
+              if accum_steps == 1:
+                loss.backward()
+                opt.step()
+                opt.zero_grad()
+                continue
+
+              # Sum the per row gradients and average over the rows of the
+              # group when stepping, so a short last batch is weighted correctly
+              (loss * len(y)).backward()
+              group_n += len(y)
+              if (i+1) % accum_steps == 0:
+                self._step_mean(opt, group_n)
+                group_n = 0
+
+          # Left over gradients from a last incomplete group of batches
+          if group_n > 0:
+            self._step_mean(opt, group_n)
+
+          losses.append(total_loss / total)
+          train_acc.append(correct / total)
+          if X_test is not None:
+            test_acc.append(self.accuracy(X_test, y_test))
+
+      return (losses, train_acc, test_acc)
+
+    def _step_mean(self, opt, n):
+      for p in self.parameters():
+        if p.grad is not None:
+          p.grad /= n
+      opt.step()
+      opt.zero_grad()
+
+    # X, y tensors or X an iterable of (X_b, y_b) batches
+    def accuracy(self, X, y=None, batch_size=1000):
+      batches = X if y is None else (
+        (X[i:i+batch_size], y[i:i+batch_size]) for i in range(0, len(X), batch_size)
+      )
+      correct, total = 0, 0
+      with torch.inference_mode():
+          for X_b, y_b in batches:
+              correct += (self(X_b).argmax(dim=1) == y_b).sum().item()
+              total += len(y_b)
+      return correct / total
+
+
+class mnist_model(mnist_base):
+    def __init__(self, input_dim, output_dim):
+        super().__init__()
+        self.beta = torch.nn.Parameter(
+          torch.randn(input_dim, output_dim, requires_grad=True)
+        )
+        self.intercept = torch.nn.Parameter(
+          torch.randn(output_dim, requires_grad=True)
+        )
+
+    def forward(self, X):
+        return (X @ self.beta + self.intercept).squeeze()
+
+
+class mnist_nn_model(mnist_base):
+    def __init__(self, input_dim, output_dim):
+        super().__init__()
+        self.linear = torch.nn.Linear(input_dim, output_dim)
+
+    def forward(self, X):
+        return self.linear(X)
+
+
+class mnist_fnn_model(mnist_base):
+    def __init__(self, input_dim, hidden_dim, output_dim, nl_step = torch.nn.ReLU(), seed=1234):
+        super().__init__()
+        self.l1 = torch.nn.Linear(input_dim, hidden_dim)
+        self.nl = nl_step
+        self.l2 = torch.nn.Linear(hidden_dim, output_dim)
+
+    def forward(self, X):
+        out = self.l1(X)
+        out = self.nl(out)
+        out = self.l2(out)
+        return out
+
+
+class mnist_fnn2_model(mnist_base):
+    def __init__(self, input_dim, hidden_dim, output_dim, nl_step = torch.nn.ReLU(), seed=1234):
+        super().__init__()
+        self.l1 = torch.nn.Linear(input_dim, hidden_dim)
+        self.nl = nl_step
+        self.l2 = torch.nn.Linear(hidden_dim, hidden_dim)
+        self.nl = nl_step
+        self.l3 = torch.nn.Linear(hidden_dim, output_dim)
+
+    def forward(self, X):
+        out = self.l1(X)
+        out = self.nl(out)
+        out = self.l2(out)
+        out = self.nl(out)
+        out = self.l3(out)
+        return out
+
+
+class mnist_conv_model(mnist_base):
+    def __init__(self):
+        super().__init__()
+        self.cnn  = torch.nn.Conv2d(
+          in_channels=1, out_channels=8,
+          kernel_size=3, stride=1, padding=1
+        )
+        self.relu = torch.nn.ReLU()
+        self.pool = torch.nn.MaxPool2d(kernel_size=2)
+        self.lin  = torch.nn.Linear(8 * 4 * 4, 10)
+
+    def forward(self, X):
+        out = self.cnn(X.view(-1, 1, 8, 8))
+        out = self.relu(out)
+        out = self.pool(out)
+        out = self.lin(out.view(-1, 8 * 4 * 4))
+        return out
+
+
+## Checkpoint and resume
+#
+# A fit interrupted at step 1234 (as a preempted node would be) and restarted
+# with the same checkpoint directory continues from the last checkpoint and
+# ends with the same weights and history as an uninterrupted fit.
+
+tmp = tempfile.mkdtemp()
+ckpt_dir = os.path.join(tmp, "ckpt")
+
+class interrupt_at(Checkpointer):
+  def __init__(self, directory, stop, **kwargs):
+    super().__init__(directory, **kwargs)
+    self.stop = stop
+
+  def due(self, step):
+    if step == self.stop:
+      raise KeyboardInterrupt("preempted")
+    return super().due(step)
+
+torch.manual_seed(1234)
+m_full = mnist_fnn_model(64,64,10)
+res_full = m_full.fit(X_train, y_train, X_test, y_test, n=2000)
+
+torch.manual_seed(1234)
+ckpt = interrupt_at(ckpt_dir, stop=1234, every=100)
+try:
+  mnist_fnn_model(64,64,10).fit(X_train, y_train, X_test, y_test, n=2000, checkpoint=ckpt)
+except KeyboardInterrupt:
+  ckpt.wait()
+ckpt.steps(), ckpt.stats
+
+torch.manual_seed(4321) # the resumed fit does not depend on the initial weights
+m_resumed = mnist_fnn_model(64,64,10)
+res_resumed = m_resumed.fit(
+  X_train, y_train, X_test, y_test, n=2000,
+  checkpoint=Checkpointer(ckpt_dir, every=100)
+)
+
+all(
+  torch.equal(a, b) for a, b in zip(m_full.state_dict().values(), m_resumed.state_dict().values())
+), res_full == res_resumed
+
+# Cost of checkpointing every 10 steps, the writes happen in the background
+shutil.rmtree(ckpt_dir)
+
+torch.manual_seed(1234)
+start = time.perf_counter()
+res = mnist_fnn_model(64,64,10).fit(X_train, y_train, X_test, y_test, n=2000)
+t_plain = time.perf_counter() - start
+
+torch.manual_seed(1234)
+ckpt = Checkpointer(ckpt_dir, every=10)
+start = time.perf_counter()
+res = mnist_fnn_model(64,64,10).fit(X_train, y_train, X_test, y_test, n=2000, checkpoint=ckpt)
+t_ckpt = time.perf_counter() - start
+
+{"no checkpoints": t_plain, "checkpoint every 10 steps": t_ckpt}, ckpt.stats
+
+shutil.rmtree(tmp)
+
+
+## Mini-batches with a DataLoader
+#
+# One epoch of mini-batch SGD takes as many optimizer steps as there are
+# batches, so it needs far fewer passes over the data than the full batch fit
+# for the same accuracy. Throughput is measured in training samples processed
+# per second (a full batch step processes all of X_train).
+
+train_loader = torch.utils.data.DataLoader(
+  torch.utils.data.TensorDataset(X_train, y_train),
+  batch_size=32, shuffle=True
+)
+
+torch.manual_seed(1234)
+loss, train_acc, test_acc = mnist_fnn_model(64,64,10).fit_loader(
+  train_loader, X_test, y_test, lr=0.01, epochs=20
+)
+train_acc[-5:]
+test_acc[-5:]
+
+plt.figure(figsize=(12,6))
+plt.subplot(121)
+plt.plot(loss, label="loss")
+plt.legend()
+
+plt.subplot(122)
+plt.plot(train_acc, label="train accuracy")
+plt.plot(test_acc, label="test accuracy")
+plt.legend()
+
+plt.show()
+
+# Gradient accumulation - 4 batches of 32 take the same steps as batches of 128
+# (in a fixed order, so both see the same rows in the same groups)
+fixed_loader = lambda batch_size: torch.utils.data.DataLoader(
+  torch.utils.data.TensorDataset(X_train, y_train), batch_size=batch_size
+)
+
+torch.manual_seed(1234)
+m_accum = mnist_fnn_model(64,64,10)
+res_accum = m_accum.fit_loader(fixed_loader(32), lr=0.01, epochs=5, accum_steps=4)
+
+torch.manual_seed(1234)
+m_128 = mnist_fnn_model(64,64,10)
+res_128 = m_128.fit_loader(fixed_loader(128), lr=0.01, epochs=5)
+
+max(
+  (a - b).abs().max().item() for a, b in zip(m_accum.parameters(), m_128.parameters())
+)
+
+# Throughput and accuracy, full batch vs mini-batches
+def throughput(fit, n_samples):
+  torch.manual_seed(1234)
+  model = mnist_fnn_model(64,64,10)
+  start = time.perf_counter()
+  fit(model)
+  t = time.perf_counter() - start
+  return {"samples/sec": n_samples / t, "time": t, "test accuracy": model.accuracy(X_test, y_test)}
+
+n_train = len(X_train)
+bench = {
+  "full batch (2000 steps)": throughput(
+    lambda m: m.fit(X_train, y_train, X_test, y_test, n=2000),
+    2000 * n_train
+  )
+}
+for batch_size in [16, 64, 256]:
+  loader = torch.utils.data.DataLoader(
+    torch.utils.data.TensorDataset(X_train, y_train),
+    batch_size=batch_size, shuffle=True
+  )
+  bench[f"DataLoader, batch_size={batch_size} (20 epochs)"] = throughput(
+    lambda m: m.fit_loader(loader, lr=0.01, epochs=20),
+    20 * n_train
+  )
+
+pd.DataFrame(bench).T
@@ -0,0 +1,592 @@
+## Setup
+
+import itertools
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import torch
+
+from sklearn.metrics import classification_report
+
+from checkpoint import Checkpointer
+from array_dataset import ArrayDataset, make_loader, save_npy
+from profiling import Profile, profiling
+
+# Stand-in for torchvision's CIFAR10 (3 x 32 x 32 images, 10 classes) so these
+# notes run without downloading it. With signal > 0 each image is mixed with a
+# fixed pattern for its class, so there is something to learn. Pixels are
+# normalized to [-1, 1], as with transforms.Normalize((0.5,)*3, (0.5,)*3).
+def fake_cifar(n, seed=1234, signal=0.0):
+  g = torch.Generator().manual_seed(seed)
+  X = torch.rand(n, 3, 32, 32, generator=g)
+  y = torch.randint(0, 10, (n,), generator=g)
+  if signal > 0:
+    patterns = torch.rand(10, 3, 32, 32, generator=torch.Generator().manual_seed(0))
+    X = (1 - signal) * X + signal * patterns[y]
+  return torch.utils.data.TensorDataset((X - 0.5) / 0.5, y)
+
+training_data = fake_cifar(5000)
+
+
+## Resumable shuffling
+#
+# DataLoader(shuffle=True) draws each epoch's order from the global torch RNG,
+# so a restarted process can not get the interrupted epoch's order back. This
+# sampler draws it from its own generator: state_dict() is the generator state
+# at the start of the current epoch, and load_state_dict(state, skip) replays
+# that epoch's order without its first `skip` samples.
+
+class ResumableSampler(torch.utils.data.Sampler):
+  def __init__(self, data_source, seed=1234):
+    self.n = len(data_source)
+    self.generator = torch.Generator().manual_seed(seed)
+    self.epoch_state = self.generator.get_state()
+    self.skip = 0
+
+  def __len__(self):
+    return self.n - self.skip
+
+  def __iter__(self):
+    self.epoch_state = self.generator.get_state()
+    order = torch.randperm(self.n, generator=self.generator)[self.skip:]
+    self.skip = 0
+    return iter(order.tolist())
+
+  def state_dict(self):
+    return {"generator": self.epoch_state}
+
+  def load_state_dict(self, state, skip=0):
+    self.generator.set_state(state["generator"])
+    self.skip = skip
+
+
+## CIFAR models (from Lec19)
+#
+# cifar_conv_model and VGG16 share their fit in a base class.
+#
+# With a Checkpointer (checkpoint.py) as `checkpoint`, every checkpoint.every
+# mini-batches the weights, optimizer state, epoch and batch position, torch
+# RNG state and the loader's sampler state (when it has one, e.g. a
+# ResumableSampler) are saved in the background. A fit started with a
+# checkpoint directory that already has a checkpoint resumes mid-epoch, the
+# sampler replays the interrupted epoch and skips the batches already used.
+# Other samplers can only resume mid-epoch if they are sequential
+# (shuffle=False), the consumed batches are then skipped, otherwise fit raises.
+#
+# accelerate=True (or a dict overriding some of ACCELERATE) speeds up CPU
+# training:
+#
+# * compile - the model is compiled with torch.compile (once per model, the
+#   first batches are slow while it compiles)
+# * channels_last - weights and images are stored NHWC, the layout the oneDNN
+#   convolution kernels use, rather than being converted on every call
+# * bf16 - forward and loss run under CPU bfloat16 autocast. Autocast only
+#   lowers convolutions and matmuls to bf16, reductions, softmax / cross entropy
+#   and batch norm statistics stay in float32 as do the weights and the
+#   optimizer updates. Only worthwhile on CPUs with native bf16 (AVX512-BF16 /
+#   AMX), elsewhere it is emulated and slower.
+# * threads, interop_threads - torch.set_num_threads / set_num_interop_threads,
+#   None leaves them as they are (the interop pool can only be sized before
+#   its first use)
+#
+# profile (see profiling.py) records a window of mini-batches with
+# torch.profiler, writes a Chrome trace and prints the top operators.
+
+ACCELERATE = {"compile": True, "channels_last": True, "bf16": True, "threads": None, "interop_threads": None}
+
+class cifar_base(torch.nn.Module):
+    def __init__(self, device):
+        super().__init__()
+        self.device = torch.device(device)
+        self.epoch = 0
+
+    def forward(self, X):
+        return self.model(X)
+
+    def _accelerate(self, accelerate):
+        if not accelerate:
+            return {"compile": False, "channels_last": False, "bf16": False}, self
+        opts = ACCELERATE | (accelerate if isinstance(accelerate, dict) else {})
+
+        if opts["threads"] is not None:
+            torch.set_num_threads(opts["threads"])
+        if opts["interop_threads"] is not None:
+            try:
+                torch.set_num_interop_threads(opts["interop_threads"])
+            except RuntimeError:
+                pass
+        if opts["channels_last"]:
+            self.to(memory_format=torch.channels_last)
+
+        forward = self
+        if opts["compile"]:
+            # Kept out of the module's attributes so it is not a submodule (and
+            # not part of state_dict)
+            if "_compiled" not in self.__dict__:
+                self.__dict__["_compiled"] = torch.compile(self.model)
+            forward = self.__dict__["_compiled"]
+        return opts, forward
+
+    def fit(self, loader, epochs=10, n_report=250, lr=0.001, checkpoint=None, accelerate=False, profile=None):
+        opt = torch.optim.SGD(self.parameters(), lr=lr, momentum=0.9)
+        opts, forward = self._accelerate(accelerate)
+        memory_format = torch.channels_last if opts["channels_last"] else torch.preserve_format
+        sampler = loader.sampler if hasattr(loader.sampler, "state_dict") else None
+        n_step, first, skip, running_loss = 0, 0, 0, 0.0
+        self.losses = []
+
+        saved = checkpoint.restore() if checkpoint is not None else None
+        if saved is not None:
+            n_step, state = saved
+            self.load_state_dict(state["model"])
+            opt.load_state_dict(state["opt"])
+            torch.set_rng_state(state["rng"])
+            self.epoch, self.losses = state["epoch"], state["losses"]
+            first, skip = state["epochs_done"], state["batch"]
+            running_loss = state["running_loss"]
+            if sampler is not None:
+                sampler.load_state_dict(state["sampler"], skip * loader.batch_size)
+            elif skip > 0 and not isinstance(getattr(loader, "sampler", None), torch.utils.data.SequentialSampler):
+                raise ValueError(
+                  "can not resume mid-epoch, the loader's sampler does not save its order "
+                  "(use a ResumableSampler or shuffle=False)"
+                )
+
+        with profiling(profile, f"{type(self).__name__}.fit") as prof:
+            for j in range(first, epochs):
+                if sampler is not None:
+                    batches = enumerate(loader, start=skip)
+                else:
+                    # A sequential loader repeats its order, skip the used batches
+                    batches = itertools.islice(enumerate(loader), skip, None)
+
+                for i, (X, y) in batches:
+                    X, y = X.to(self.device, memory_format=memory_format), y.to(self.device)
+                    opt.zero_grad()
+                    with torch.autocast("cpu", dtype=torch.bfloat16, enabled=opts["bf16"]):
+                        loss = torch.nn.CrossEntropyLoss()(forward(X), y)
+                    loss.backward()
+                    opt.step()
+                    self.losses.append(loss.item())
+                    prof.step()
+
+                    # print statistics
+                    running_loss += loss.item()
+                    if i % n_report == (n_report-1):    # print every 100 mini-batches
+                        print(f'[Epoch {self.epoch + 1}, Minibatch {i + 1:4d}] loss: {running_loss / n_report:.3f}')
+                        running_loss = 0.0
+
+                    n_step += 1
+                    if checkpoint is not None and checkpoint.due(n_step):
+                        checkpoint.save(n_step, {
+                            "model": self.state_dict(), "opt": opt.state_dict(),
+                            "rng": torch.get_rng_state(),
+                            "sampler": sampler.state_dict() if sampler is not None else None,
+                            "epoch": self.epoch, "epochs_done": j, "batch": i + 1,
+                            "running_loss": running_loss, "losses": self.losses
+                        })
+
+                skip, running_loss = 0, 0.0
+                self.epoch += 1
+
+        if checkpoint is not None:
+            checkpoint.wait()
+
+
+class cifar_conv_model(cifar_base):
+    def __init__(self, device):
+        super().__init__(device)
+        self.model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 6, kernel_size=5),
+            torch.nn.ReLU(),
+            torch.nn.MaxPool2d(2, 2),
+            torch.nn.Conv2d(6, 16, kernel_size=5),
+            torch.nn.ReLU(),
+            torch.nn.MaxPool2d(2, 2),
+            torch.nn.Flatten(),
+            torch.nn.Linear(16 * 5 * 5, 120),
+            torch.nn.ReLU(),
+            torch.nn.Linear(120, 84),
+            torch.nn.ReLU(),
+            torch.nn.Linear(84, 10)
+        ).to(device=self.device)
+
+
+class VGG16(cifar_base):
+    def make_layers(self):
+        cfg = [64, 64, 'M', 128, 128, 'M', 256, 256, 256, 'M', 512, 512, 512, 'M', 512, 512, 512, 'M']
+        layers = []
+        in_channels = 3
+        for x in cfg:
+            if x == 'M':
+                layers += [torch.nn.MaxPool2d(kernel_size=2, stride=2)]
+            else:
+                layers += [torch.nn.Conv2d(in_channels, x, kernel_size=3, padding=1),
+                           torch.nn.BatchNorm2d(x),
+                           torch.nn.ReLU(inplace=True)]
+                in_channels = x
+        layers += [
+            torch.nn.AvgPool2d(kernel_size=1, stride=1),
+            torch.nn.Flatten(),
+            torch.nn.Linear(512,10)
+        ]
+
+        return torch.nn.Sequential(*layers).to(self.device)
+
+    def __init__(self, device):
+        super().__init__(device)
+        self.model = self.make_layers()
+
+
+def accuracy(model, loader, device, profile=None):
+    total, correct = 0, 0
+    with torch.no_grad(), profiling(profile, "accuracy") as prof:
+        for X, y in loader:
+            X, y = X.to(device=device), y.to(device=device)
+            pred = model(X)
+            # the class with the highest energy is what we choose as prediction
+            val, idx = torch.max(pred, 1)
+            total += pred.size(0)
+            correct += (idx == y).sum().item()
+            prof.step()
+
+    return correct / total
+
+
+def report(model, loader, device, profile=None):
+    y_true, y_pred = [], []
+    with torch.no_grad(), profiling(profile, "report") as prof:
+        for X, y in loader:
+            X = X.to(device=device)
+            y_true.append( y.cpu().numpy() )
+            y_pred.append( model(X).max(1)[1].cpu().numpy() )
+            prof.step()
+
+    y_true = np.concatenate(y_true)
+    y_pred = np.concatenate(y_pred)
+
+    return classification_report(y_true, y_pred, target_names=getattr(loader.dataset, "classes", None))
+
+
+## Checkpoint and resume
+#
+# A fit interrupted part way through its second epoch and restarted with the
+# same checkpoint directory resumes mid-epoch and ends with the same weights
+# and losses as an uninterrupted fit.
+
+tmp = tempfile.mkdtemp()
+ckpt_dir = os.path.join(tmp, "ckpt")
+
+def resumable_loader(seed=1234):
+  return torch.utils.data.DataLoader(
+    training_data, batch_size=100,
+    sampler=ResumableSampler(training_data, seed=seed)
+  )
+
+class interrupt_at(Checkpointer):
+  def __init__(self, directory, stop, **kwargs):
+    super().__init__(directory, **kwargs)
+    self.stop = stop
+
+  def due(self, step):
+    if step == self.stop:
+      raise KeyboardInterrupt("preempted")
+    return super().due(step)
+
+torch.manual_seed(1234)
+m_full = cifar_conv_model(device="cpu")
+m_full.fit(loader=resumable_loader(), epochs=3, n_report=25)
+
+torch.manual_seed(1234)
+ckpt = interrupt_at(ckpt_dir, stop=77, every=10)
+try:
+  cifar_conv_model(device="cpu").fit(loader=resumable_loader(), epochs=3, n_report=25, checkpoint=ckpt)
+except KeyboardInterrupt:
+  ckpt.wait()
+ckpt.steps(), ckpt.stats
+
+torch.manual_seed(4321)
+m_resumed = cifar_conv_model(device="cpu")
+m_resumed.fit(
+  loader=resumable_loader(), epochs=3, n_report=25,
+  checkpoint=Checkpointer(ckpt_dir, every=10)
+)
+
+all(
+  torch.equal(a, b) for a, b in zip(m_full.state_dict().values(), m_resumed.state_dict().values())
+), m_full.losses == m_resumed.losses, m_resumed.epoch
+
+# A shuffling DataLoader can not replay the interrupted epoch
+try:
+  cifar_conv_model(device="cpu").fit(
+    loader=torch.utils.data.DataLoader(training_data, batch_size=100, shuffle=True),
+    epochs=3, checkpoint=Checkpointer(ckpt_dir, every=10)
+  )
+except ValueError as err:
+  print(err)
+
+# A sequential one can, the used batches are skipped
+seq_loader = lambda: torch.utils.data.DataLoader(training_data, batch_size=100)
+shutil.rmtree(ckpt_dir)
+
+torch.manual_seed(1234)
+m_full = cifar_conv_model(device="cpu")
+m_full.fit(loader=seq_loader(), epochs=2, n_report=1000)
+
+torch.manual_seed(1234)
+ckpt = interrupt_at(ckpt_dir, stop=77, every=10)
+try:
+  cifar_conv_model(device="cpu").fit(loader=seq_loader(), epochs=2, n_report=1000, checkpoint=ckpt)
+except KeyboardInterrupt:
+  ckpt.wait()
+
+m_resumed = cifar_conv_model(device="cpu")
+m_resumed.fit(loader=seq_loader(), epochs=2, n_report=1000, checkpoint=Checkpointer(ckpt_dir, every=10))
+m_full.losses == m_resumed.losses, len(m_resumed.losses)
+
+# Cost of checkpointing every 10 mini-batches, the writes happen in the background
+shutil.rmtree(ckpt_dir)
+
+torch.manual_seed(1234)
+start = time.perf_counter()
+cifar_conv_model(device="cpu").fit(loader=resumable_loader(), epochs=3, n_report=1000)
+t_plain = time.perf_counter() - start
+
+torch.manual_seed(1234)
+ckpt = Checkpointer(ckpt_dir, every=10)
+start = time.perf_counter()
+cifar_conv_model(device="cpu").fit(loader=resumable_loader(), epochs=3, n_report=1000, checkpoint=ckpt)
+t_ckpt = time.perf_counter() - start
+
+{"no checkpoints": t_plain, "checkpoint every 10 mini-batches": t_ckpt}, ckpt.stats
+
+
+## Batched datasets (from Lec19)
+#
+# The Lec19 `data` Dataset is indexed one row at a time and the DataLoader
+# collates the rows into a batch, ArrayDataset (array_dataset.py) gathers a
+# whole batch with one np.take. The images are kept as uint8, as they are on
+# disk, and scaled / normalized per batch.
+
+class data(torch.utils.data.Dataset):
+    def __init__(self, X, y):
+        self.X = X
+        self.y = y
+
+    def __len__(self):
+        return len(self.X)
+
+    def __getitem__(self, idx):
+        return self.X[idx], self.y[idx]
+
+# Like torchvision's CIFAR10 with a ToTensor / Normalize transform, uint8 rows
+# converted one image at a time
+class data_u8(data):
+    def __getitem__(self, idx):
+        X = (torch.from_numpy(self.X[idx]).float() / 255 - 0.5) / 0.5
+        return X, self.y[idx]
+
+rng = np.random.default_rng(1234)
+X_u8 = rng.integers(0, 256, (20000, 3, 32, 32), dtype=np.uint8)
+y_u8 = rng.integers(0, 10, 20000)
+
+norm = dict(scale=1/255, mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+X_float = (torch.from_numpy(X_u8).float() / 255 - 0.5) / 0.5
+
+ds_rows = data(X_float, torch.from_numpy(y_u8))
+ds_rows_u8 = data_u8(X_u8, torch.from_numpy(y_u8))
+ds_mem = ArrayDataset(X_u8, y_u8, **norm)
+
+save_npy(os.path.join(tmp, "cifar"), X_u8, y_u8)
+ds_mmap = ArrayDataset.from_npy(os.path.join(tmp, "cifar"), **norm)
+
+# Same rows either way
+idx = [17, 3, 12000]
+X_b, y_b = ds_mmap.__getitems__(idx)
+torch.allclose(X_b, X_float[sorted(idx)], atol=1e-6), torch.equal(y_b, torch.from_numpy(y_u8[sorted(idx)]))
+
+# Memory - the float32 copy vs the uint8 memory map (which is not in RAM until read)
+X_float.nbytes / 2**20, X_u8.nbytes / 2**20
+
+# Time for one epoch of batches
+def epoch_time(loader, reps=3):
+  times = []
+  for r in range(reps):
+    start = time.perf_counter()
+    for X, y in loader:
+      pass
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+pd.DataFrame({
+  "data (one row per call), float32": epoch_time(torch.utils.data.DataLoader(ds_rows, batch_size=1000, shuffle=True)),
+  "data (one row per call), uint8": epoch_time(torch.utils.data.DataLoader(ds_rows_u8, batch_size=1000, shuffle=True)),
+  "ArrayDataset, in memory": epoch_time(make_loader(ds_mem, batch_size=1000, shuffle=True)),
+  "ArrayDataset, memory mapped": epoch_time(make_loader(ds_mmap, batch_size=1000, shuffle=True)),
+}, index=["epoch (s)"]).T.assign(**{"images/sec": lambda df: len(X_u8) / df["epoch (s)"]})
+
+# Worker processes reopen the memory map rather than receiving a pickled copy
+loader = make_loader(ds_mmap, batch_size=1000, shuffle=True, num_workers=2)
+sum(len(y) for X, y in loader)
+
+# Training directly from the memory mapped store, with a resumable order
+m = cifar_conv_model(device="cpu")
+m.fit(
+  loader=make_loader(ds_mmap, batch_size=100, sampler=ResumableSampler(ds_mmap)),
+  epochs=1, n_report=50
+)
+
+shutil.rmtree(tmp)
+
+
+## CPU acceleration
+#
+# Images/sec is measured after the first epoch, which includes the time to
+# compile, and the test accuracy after the last. The fake images have a class
+# pattern mixed in so the accuracies are comparable.
+
+train_data = fake_cifar(10000, signal=0.3)
+test_data = fake_cifar(2000, seed=4321, signal=0.3)
+
+class timed_loader:
+  def __init__(self, loader):
+    self.loader, self.sampler, self.starts = loader, None, []
+
+  def __len__(self):
+    return len(self.loader)
+
+  def __iter__(self):
+    self.starts.append(time.perf_counter())
+    yield from self.loader
+
+def bench(make_model, accelerate, n_train, epochs, batch_size=100):
+  loader = timed_loader(torch.utils.data.DataLoader(
+    torch.utils.data.Subset(train_data, range(n_train)), batch_size=batch_size, shuffle=True
+  ))
+  torch.manual_seed(1234)
+  m = make_model()
+  m.fit(loader, epochs=epochs, n_report=10**6, lr=0.01, accelerate=accelerate)
+  end = time.perf_counter()
+
+  m.eval()
+  test_loader = torch.utils.data.DataLoader(test_data, batch_size=500)
+  return {
+    "first epoch (s)": loader.starts[1] - loader.starts[0],
+    "images/sec": n_train * (epochs - 1) / (end - loader.starts[1]),
+    "test accuracy": accuracy(m, test_loader, "cpu")
+  }
+
+configs = {
+  "eager fp32": False,
+  "channels_last": {"compile": False, "bf16": False},
+  "bf16": {"compile": False, "channels_last": False},
+  "compile": {"channels_last": False, "bf16": False},
+  "compile + channels_last + bf16": True
+}
+
+pd.DataFrame({
+  name: bench(lambda: cifar_conv_model("cpu"), acc, n_train=10000, epochs=4)
+  for name, acc in configs.items()
+}).T
+
+# VGG16 is far more work per image, so a subset and fewer configurations - 20
+# steps are too few for it to learn anything, only images/sec is comparable
+pd.DataFrame({
+  name: bench(lambda: VGG16("cpu"), configs[name], n_train=1000, epochs=2)
+  for name in ["eager fp32", "bf16", "compile + channels_last + bf16"]
+}).T
+
+
+## MNIST CNN (from Lec19)
+
+from sklearn.datasets import load_digits
+from sklearn.model_selection import train_test_split
+
+digits = load_digits()
+X, y = digits.data, digits.target
+
+X_train, X_test, y_train, y_test = train_test_split(
+    X, y, test_size=0.20, shuffle=True, random_state=1234
+)
+
+X_train = torch.from_numpy(X_train).float()
+y_train = torch.from_numpy(y_train)
+X_test = torch.from_numpy(X_test).float()
+y_test = torch.from_numpy(y_test)
+
+class mnist_conv_model(torch.nn.Module):
+    def __init__(self, device):
+        super().__init__()
+        self.device = torch.device(device)
+
+        self.model = torch.nn.Sequential(
+          torch.nn.Unflatten(1, (1,8,8)),
+          torch.nn.Conv2d(
+            in_channels=1, out_channels=8,
+            kernel_size=3, stride=1, padding=1
+          ),
+          torch.nn.ReLU(),
+          torch.nn.MaxPool2d(kernel_size=2),
+          torch.nn.Flatten(),
+          torch.nn.Linear(8 * 4 * 4, 10)
+        ).to(device=self.device)
+
+    def forward(self, X):
+        return self.model(X)
+
+    def fit(self, X, y, lr=0.001, n=1000, acc_step=10, profile=None):
+      opt = torch.optim.SGD(self.parameters(), lr=lr, momentum=0.9)
+      losses = []
+      with profiling(profile, "mnist_conv_model.fit") as prof:
+        for i in range(n):
+            opt.zero_grad()
+            loss = torch.nn.CrossEntropyLoss()(self(X), y)
+            loss.backward()
+            opt.step()
+            losses.append(loss.item())
+            prof.step()
+
+      return losses
+
+    def accuracy(self, X, y):
+      val, pred = torch.max(self(X), dim=1)
+      return( (pred == y).sum() / len(y) )
+
+
+## Profiling
+#
+# Rather than profiling a whole fit (or a single hand picked step), the
+# profiler skips the first steps, warms up and records a few steady state
+# ones. Each window writes a trace file and prints its top operators.
+
+prof_dir = tempfile.mkdtemp()
+
+m = mnist_conv_model(device="cpu")
+prof = Profile(dir=prof_dir, wait=10, warmup=5, active=5, row_limit=8)
+loss = m.fit(X_train, y_train, n=100, profile=prof)
+prof.traces
+
+# Two windows of 3 mini-batches, with the summary grouped by input shape
+m = cifar_conv_model(device="cpu")
+m.fit(
+  torch.utils.data.DataLoader(train_data, batch_size=100, shuffle=True),
+  epochs=1, n_report=1000, lr=0.01,
+  profile={"dir": prof_dir, "wait": 5, "warmup": 2, "active": 3, "repeat": 2, "group_by_shape": True}
+)
+
+# Evaluation, sorted by memory use instead of time
+test_loader = torch.utils.data.DataLoader(test_data, batch_size=100)
+prof = Profile(dir=prof_dir, wait=2, warmup=1, active=3, sort_by="self_cpu_memory_usage", verbose=False)
+accuracy(m, test_loader, "cpu", profile=prof)
+print(prof.summary(row_limit=5))
+
+print(report(m, test_loader, "cpu", profile={"dir": prof_dir, "active": 2, "row_limit": 5}))
+
+sorted(os.listdir(prof_dir))
+
+shutil.rmtree(prof_dir)
@@ -0,0 +1,110 @@
+## Batched, memory mapped torch Dataset (Lec19)
+#
+# The custom `data` Dataset from Lec19 returns one (X[idx], y[idx]) pair per
+# call, so a DataLoader with batch_size=1000 makes 1000 calls and then collates
+# 1000 small tensors for every batch. ArrayDataset instead serves a whole batch
+# of indices with a single gather through __getitems__, which the DataLoader
+# calls with the batch sampler's indices - pass collate_fn=collate (or use
+# make_loader) so the already batched tensors are passed through as is.
+#
+# Images can be stored as uint8 (4x smaller than float32) and are converted
+# on the fly, x * scale then (x - mean) / std per channel. save_npy() writes X
+# and y as .npy files and from_npy() memory maps them, so a dataset larger than
+# RAM only reads the rows of each batch. The memory maps are opened lazily in
+# each process rather than pickled, so num_workers > 0 works without copying
+# the data to the workers.
+#
+#   save_npy("cifar", X_uint8, y)
+#   ds = ArrayDataset.from_npy("cifar", scale=1/255, mean=[0.5]*3, std=[0.5]*3)
+#   loader = make_loader(ds, batch_size=1000, shuffle=True, num_workers=2)
+
+import os
+
+import numpy as np
+import torch
+
+
+def save_npy(path, X, y):
+  os.makedirs(path, exist_ok=True)
+  np.save(os.path.join(path, "X.npy"), np.asarray(X))
+  np.save(os.path.join(path, "y.npy"), np.asarray(y))
+
+
+def collate(batch):
+  return batch
+
+
+def make_loader(dataset, batch_size, shuffle=False, **kwargs):
+  return torch.utils.data.DataLoader(
+    dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate, **kwargs
+  )
+
+
+class ArrayDataset(torch.utils.data.Dataset):
+  def __init__(self, X, y, scale=None, mean=None, std=None, dtype=torch.float32):
+    if len(X) != len(y):
+      raise ValueError(f"X and y have different numbers of rows ({len(X)} and {len(y)})")
+
+    self._X, self._y = X, y
+    self._path = None
+    self.n = len(X)
+    self.scale = scale
+    self.dtype = dtype
+
+    # Per channel (dim 1) mean / std, broadcast over any trailing dims
+    shape = (-1,) + (1,) * (np.ndim(X) - 2)
+    self.mean = None if mean is None else torch.as_tensor(mean, dtype=dtype).reshape(shape)
+    self.std = None if std is None else torch.as_tensor(std, dtype=dtype).reshape(shape)
+
+  @classmethod
+  def from_npy(cls, path, **kwargs):
+    X, y = cls._open(path)
+    ds = cls(X, y, **kwargs)
+    ds._path = path
+    return ds
+
+  @staticmethod
+  def _open(path):
+    return (
+      np.load(os.path.join(path, "X.npy"), mmap_mode="r"),
+      np.load(os.path.join(path, "y.npy"), mmap_mode="r")
+    )
+
+  # Memory maps are reopened in each worker instead of being pickled (which
+  # would copy them)
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    if self._path is not None:
+      state["_X"] = state["_y"] = None
+    return state
+
+  def _arrays(self):
+    if self._X is None:
+      self._X, self._y = self._open(self._path)
+    return self._X, self._y
+
+  def __len__(self):
+    return self.n
+
+  def _transform(self, X):
+    X = torch.from_numpy(np.ascontiguousarray(X)).to(self.dtype)
+    if self.scale is not None:
+      X *= self.scale
+    if self.mean is not None:
+      X -= self.mean
+    if self.std is not None:
+      X /= self.std
+    return X
+
+  def __getitem__(self, idx):
+    if not isinstance(idx, (int, np.integer)):
+      return self.__getitems__(idx)
+    X, y = self._arrays()
+    return self._transform(np.take(X, [idx], axis=0))[0], torch.as_tensor(np.asarray(y[idx]))
+
+  def __getitems__(self, indices):
+    X, y = self._arrays()
+    # Sorted indices keep reads from a memory map mostly sequential, the order
+    # of the rows within a batch does not matter for training
+    rows = np.sort(np.asarray(indices, dtype=np.intp))
+    return self._transform(np.take(X, rows, axis=0)), torch.from_numpy(np.take(y, rows))
@@ -0,0 +1,123 @@
+## Mini-batch iterator for the optax / jax training loops (Lec16)
+#
+# Every pass over a BatchLoader is one epoch, drawing a new permutation of the
+# rows (from a generator seeded once, so the sequence of epochs is
+# reproducible). Batches are (X_b, y_b, mask):
+#
+# * every batch has batch_size rows - the last partial batch is padded with
+#   zeros and mask (1 for real rows, 0 for padding) marks the padding, so a
+#   jitted step sees a single shape and is compiled once. Use the mask as
+#   weights in the loss, e.g. jnp.average(loss, weights=mask).
+# * rows are gathered with sorted indices (their order within a batch does not
+#   matter for the gradient), which keeps reads from a np.memmap mostly
+#   sequential, so X and y can be memory mapped arrays larger than RAM.
+# * with prefetch > 0 a background thread gathers the next batches and copies
+#   them to the device while the current one is being used.
+# * get_state() before an epoch and set_state() + epoch(skip=b) replay that
+#   epoch from batch b onwards, e.g. to resume from a checkpoint mid-epoch.
+#
+#   loader = BatchLoader(X, y, batch_size=100)
+#   for epoch in range(10):
+#     for X_b, y_b, mask in loader:
+#       ...
+
+import queue
+import threading
+
+import numpy as np
+
+_DONE = object()
+
+
+class BatchLoader:
+  def __init__(self, X, y, batch_size, shuffle=True, seed=1234, pad=True, prefetch=2, device_put=True):
+    if len(X) != len(y):
+      raise ValueError(f"X and y have different numbers of rows ({len(X)} and {len(y)})")
+
+    self.X = X
+    self.y = y
+    self.batch_size = batch_size
+    self.shuffle = shuffle
+    self.pad = pad
+    self.prefetch = prefetch
+    self.device_put = device_put
+    self.rng = np.random.default_rng(seed)
+
+  @property
+  def n(self):
+    return len(self.X)
+
+  def __len__(self):
+    return -(-self.n // self.batch_size)
+
+  def get_state(self):
+    return self.rng.bit_generator.state
+
+  def set_state(self, state):
+    self.rng.bit_generator.state = state
+
+  def _batches(self, order, skip=0):
+    bs = self.batch_size
+    for start in range(skip * bs, self.n, bs):
+      rows = np.sort(order[start:start+bs])
+      X_b, y_b = np.asarray(self.X[rows]), np.asarray(self.y[rows])
+      mask = np.ones(len(rows), dtype=X_b.dtype)
+
+      if self.pad and len(rows) < bs:
+        n_pad = bs - len(rows)
+        X_b = np.concatenate([X_b, np.zeros((n_pad,) + X_b.shape[1:], dtype=X_b.dtype)])
+        y_b = np.concatenate([y_b, np.zeros((n_pad,) + y_b.shape[1:], dtype=y_b.dtype)])
+        mask = np.concatenate([mask, np.zeros(n_pad, dtype=mask.dtype)])
+
+      if self.device_put:
+        import jax
+        X_b, y_b, mask = jax.device_put((X_b, y_b, mask))
+
+      yield X_b, y_b, mask
+
+  def epoch(self, skip=0):
+    order = self.rng.permutation(self.n) if self.shuffle else np.arange(self.n)
+    batches = self._batches(order, skip)
+    if self.prefetch:
+      batches = _prefetch(batches, self.prefetch)
+    return iter(batches)
+
+  def __iter__(self):
+    return self.epoch()
+
+
+def _prefetch(batches, size):
+  q = queue.Queue(maxsize=size)
+  stop = threading.Event()
+
+  def put(item):
+    while not stop.is_set():
+      try:
+        q.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def worker():
+    try:
+      for batch in batches:
+        if not put(batch):
+          return
+      put(_DONE)
+    except BaseException as err:
+      put(err)
+
+  threading.Thread(target=worker, daemon=True).start()
+
+  try:
+    while True:
+      item = q.get()
+      if item is _DONE:
+        return
+      if isinstance(item, BaseException):
+        raise item
+      yield item
+  finally:
+    # Stops the worker if the consumer breaks out of the epoch early
+    stop.set()
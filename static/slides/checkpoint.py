@@ -0,0 +1,158 @@
+## Checkpointing long training loops (Lec16, Lec18, Lec19)
+#
+# Checkpointer.save(step, state) takes a snapshot of `state` (any nesting of
+# dicts / lists / tuples of numpy, jax or torch arrays and plain python
+# objects) on the calling thread - torch tensors and numpy arrays are copied,
+# jax arrays are immutable and are only referenced - and a background thread
+# pickles it to `directory`. Writes go to a temporary file that is fsynced and
+# then renamed, so a checkpoint file is either complete or absent, and only the
+# newest `keep` checkpoints are kept. If a write is still running when the
+# next save comes in, the pending snapshot is replaced rather than making the
+# training thread wait.
+#
+#   ckpt = Checkpointer("ckpt", keep=3, every=100)
+#   saved = ckpt.restore()          # None or (step, state) of the latest
+#   ...
+#   if ckpt.due(step):
+#     ckpt.save(step, {"params": params, "opt_state": opt_state, ...})
+#   ckpt.wait()
+
+import copy
+import os
+import pickle
+import re
+import sys
+import threading
+
+import numpy as np
+
+_FILE = re.compile(r"ckpt-(\d+)\.pkl$")
+
+
+def snapshot(obj):
+  if isinstance(obj, np.ndarray):
+    return obj.copy()
+  if "torch" in sys.modules and isinstance(obj, sys.modules["torch"].Tensor):
+    return obj.detach().to("cpu", copy=True)
+  if "jax" in sys.modules and isinstance(obj, sys.modules["jax"].Array):
+    return obj
+  if isinstance(obj, dict):
+    return type(obj)((k, snapshot(v)) for k, v in obj.items())
+  if isinstance(obj, tuple) and hasattr(obj, "_fields"):
+    return type(obj)(*[snapshot(v) for v in obj])
+  if isinstance(obj, (list, tuple)):
+    return type(obj)(snapshot(v) for v in obj)
+  return copy.deepcopy(obj)
+
+
+def _to_host(obj):
+  if "jax" in sys.modules and isinstance(obj, sys.modules["jax"].Array):
+    return np.asarray(obj)
+  if isinstance(obj, dict):
+    return type(obj)((k, _to_host(v)) for k, v in obj.items())
+  if isinstance(obj, tuple) and hasattr(obj, "_fields"):
+    return type(obj)(*[_to_host(v) for v in obj])
+  if isinstance(obj, (list, tuple)):
+    return type(obj)(_to_host(v) for v in obj)
+  return obj
+
+
+class Checkpointer:
+  def __init__(self, directory, keep=3, every=100, background=True):
+    self.directory = directory
+    self.keep = keep
+    self.every = every
+    self.background = background
+    self.stats = {"saved": 0, "written": 0, "replaced": 0}
+
+    self._cond = threading.Condition()
+    self._pending = None
+    self._writing = False
+    self._error = None
+    self._thread = None
+
+    os.makedirs(directory, exist_ok=True)
+
+  def __repr__(self):
+    return f"Checkpointer(directory={self.directory!r}, keep={self.keep}, every={self.every})"
+
+  def due(self, step):
+    return self.every is not None and step % self.every == 0
+
+  def path(self, step):
+    return os.path.join(self.directory, f"ckpt-{step:010d}.pkl")
+
+  def steps(self):
+    return sorted(
+      int(m.group(1)) for f in os.listdir(self.directory) if (m := _FILE.match(f))
+    )
+
+  def save(self, step, state):
+    self._raise_error()
+    item = (step, snapshot(state))
+    self.stats["saved"] += 1
+
+    if not self.background:
+      self._write(*item)
+      return
+
+    with self._cond:
+      if self._pending is not None:
+        self.stats["replaced"] += 1
+      self._pending = item
+      self._cond.notify()
+
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._worker, daemon=True)
+      self._thread.start()
+
+  def wait(self):
+    with self._cond:
+      while self._pending is not None or self._writing:
+        self._cond.wait()
+    self._raise_error()
+
+  def restore(self, step=None):
+    self.wait()
+    steps = self.steps()
+    if step is None:
+      if not steps:
+        return None
+      step = steps[-1]
+    with open(self.path(step), "rb") as f:
+      return step, pickle.load(f)
+
+  def _raise_error(self):
+    if self._error is not None:
+      err, self._error = self._error, None
+      raise err
+
+  def _worker(self):
+    while True:
+      with self._cond:
+        while self._pending is None:
+          self._cond.wait()
+        item, self._pending = self._pending, None
+        self._writing = True
+
+      try:
+        self._write(*item)
+      except BaseException as err:
+        self._error = err
+      finally:
+        with self._cond:
+          self._writing = False
+          self._cond.notify_all()
+
+  def _write(self, step, state):
+    path = self.path(step)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+      pickle.dump(_to_host(state), f, protocol=pickle.HIGHEST_PROTOCOL)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp, path)
+    self.stats["written"] += 1
+
+    for old in self.steps()[:-self.keep]:
+      os.remove(self.path(old))
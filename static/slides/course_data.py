@@ -0,0 +1,284 @@
+## Cached loading of the course datasets
+#
+# Each csv in data/ is parsed once, its dtypes are inferred (nullable ints,
+# strings, categoricals) and the result is written to data/_cache/ as
+# parquet or (uncompressed) feather. Cache files are keyed by a hash of the
+# csv contents so editing a csv invalidates its cached copy.
+#
+#   import course_data
+#   penguins = course_data.load("penguins")
+#   loans = course_data.load(
+#     "openintro_loans", columns=["grade", "loan_amount"],
+#     filters=[("grade", "in", ["A", "B"])]
+#   )
+
+import glob
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+CACHE_DIR = os.path.join(DATA_DIR, "_cache")
+FORMATS = {"parquet": "parquet", "feather": "arrow"}
+
+
+def file_hash(path, block_size=2**20):
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(block_size), b""):
+      h.update(block)
+  return h.hexdigest()
+
+
+def csv_path(name):
+  if os.path.exists(name):
+    return name
+
+  path = os.path.join(DATA_DIR, name)
+  if not path.endswith(".csv"):
+    path += ".csv"
+  if not os.path.exists(path):
+    raise FileNotFoundError(f"No dataset named {name!r} in {DATA_DIR}")
+
+  return path
+
+
+def cache_path(path, format="parquet", cache_dir=CACHE_DIR):
+  if format not in FORMATS:
+    raise ValueError(f"format must be one of {list(FORMATS)}, not {format!r}")
+
+  stem = os.path.splitext(os.path.basename(path))[0]
+  return os.path.join(cache_dir, f"{stem}-{file_hash(path)[:16]}.{FORMATS[format]}")
+
+
+def infer_dtypes(df, max_categories=50, max_unique_frac=0.5):
+  df = df.convert_dtypes(dtype_backend="numpy_nullable")
+
+  for col in df.columns:
+    s = df[col]
+    if not pd.api.types.is_string_dtype(s):
+      continue
+    n_unique = s.nunique(dropna=True)
+    if n_unique <= max_categories and n_unique <= max_unique_frac * max(len(s), 1):
+      df[col] = s.astype("category")
+
+  return df
+
+
+def _write_cache(df, path, format, row_group_size):
+  tmp = path + ".tmp"
+  table = pa.Table.from_pandas(df, preserve_index=False)
+
+  if format == "parquet":
+    pq.write_table(table, tmp, row_group_size=row_group_size)
+  else:
+    # Uncompressed so that reads can be served straight from the memory map
+    feather.write_feather(table, tmp, compression="uncompressed")
+
+  os.replace(tmp, path)
+
+
+def _remove_stale(path, current):
+  stem = os.path.splitext(os.path.basename(path))[0]
+  ext = os.path.splitext(current)[1]
+  for old in glob.glob(os.path.join(os.path.dirname(current), f"{stem}-*{ext}")):
+    if old != current:
+      os.remove(old)
+
+
+def cache(name, format="parquet", refresh=False, row_group_size=2**16,
+          cache_dir=CACHE_DIR):
+  path = csv_path(name)
+  cached = cache_path(path, format, cache_dir)
+
+  if refresh or not os.path.exists(cached):
+    os.makedirs(cache_dir, exist_ok=True)
+    df = infer_dtypes(pd.read_csv(path))
+    _write_cache(df, cached, format, row_group_size)
+    _remove_stale(path, cached)
+
+  return cached
+
+
+# Columns used by filters given as a list of (column, op, value) tuples (or a
+# list of such lists), None for an Expression
+def _filter_columns(filters):
+  if isinstance(filters, pc.Expression):
+    return None
+  if filters and isinstance(filters[0], tuple):
+    filters = [filters]
+  return {f[0] for conj in filters for f in conj}
+
+
+def read_table(name, columns=None, filters=None, format="parquet", refresh=False,
+               cache_dir=CACHE_DIR):
+  cached = cache(name, format, refresh, cache_dir=cache_dir)
+
+  read_columns = columns
+  if filters is not None:
+    if columns is not None:
+      used = _filter_columns(filters)
+      read_columns = None if used is None else list(columns) + sorted(used - set(columns))
+    if not isinstance(filters, pc.Expression):
+      filters = pq.filters_to_expression(filters)
+
+  if format == "parquet":
+    # Row groups whose statistics cannot satisfy `filters` are never read
+    return pq.read_table(cached, columns=columns, filters=filters, memory_map=True)
+
+  # Filter columns outside `columns` are read too, and dropped after filtering
+  table = feather.read_table(cached, columns=read_columns, memory_map=True)
+  if filters is not None:
+    table = table.filter(filters)
+    if columns is not None:
+      table = table.select(columns)
+  return table
+
+
+def load(name, columns=None, filters=None, format="parquet", refresh=False,
+         cache_dir=CACHE_DIR):
+  table = read_table(
+    name, columns=columns, filters=filters, format=format, refresh=refresh,
+    cache_dir=cache_dir
+  )
+  return table.to_pandas()
+
+
+def clear_cache(cache_dir=CACHE_DIR):
+  for path in glob.glob(os.path.join(cache_dir, "*")):
+    os.remove(path)
+
+
+## Shrinking DataFrames
+#
+# shrink() profiles each column and picks the smallest dtype that holds it:
+# integers (and integral floats) are downcast to the narrowest (nullable) int,
+# floats go to float32 when that is lossless (or always with float32=True) and
+# low cardinality strings become categoricals. shrink_csv() does the same for
+# csvs too large to load at once by profiling them chunk-wise first.
+#
+#   loans, report = course_data.shrink(course_data.load("openintro_loans"), report=True)
+
+INT_DTYPES = [
+  (np.int8, "Int8"), (np.uint8, "UInt8"), (np.int16, "Int16"), (np.uint16, "UInt16"),
+  (np.int32, "Int32"), (np.uint32, "UInt32"), (np.int64, "Int64")
+]
+
+
+def _profile(s, max_categories):
+  p = {"kind": "other", "na": bool(s.isna().any())}
+  vals = s.dropna()
+
+  if pd.api.types.is_bool_dtype(s):
+    return p
+
+  if pd.api.types.is_integer_dtype(s) or pd.api.types.is_float_dtype(s):
+    vals = vals.to_numpy(dtype=np.float64)
+    integral = pd.api.types.is_integer_dtype(s) or bool(np.all(np.mod(vals, 1) == 0))
+    p.update(
+      kind = "int" if integral else "float",
+      min = vals.min() if len(vals) else 0,
+      max = vals.max() if len(vals) else 0,
+      lossless = bool(np.array_equal(vals.astype(np.float32), vals))
+    )
+  elif pd.api.types.is_string_dtype(s) or isinstance(s.dtype, pd.CategoricalDtype):
+    uniques = set(vals.unique())
+    p.update(kind = "str", uniques = uniques if len(uniques) <= max_categories else None)
+
+  return p
+
+
+def _merge_profiles(p, q):
+  kinds = {p["kind"], q["kind"]}
+  if len(kinds) > 1:
+    kind = "float" if kinds == {"int", "float"} else "other"
+  else:
+    kind = p["kind"]
+
+  r = {"kind": kind, "na": p["na"] or q["na"]}
+  if kind in ("int", "float"):
+    r.update(
+      min = min(p["min"], q["min"]),
+      max = max(p["max"], q["max"]),
+      lossless = p["lossless"] and q["lossless"]
+    )
+  elif kind == "str":
+    if p["uniques"] is None or q["uniques"] is None:
+      r["uniques"] = None
+    else:
+      r["uniques"] = p["uniques"] | q["uniques"]
+
+  return r
+
+
+def _target_dtype(p, n, max_categories, max_unique_frac, float32):
+  if p["kind"] == "int":
+    for dtype, nullable in INT_DTYPES:
+      info = np.iinfo(dtype)
+      if info.min <= p["min"] and p["max"] <= info.max:
+        return pd.api.types.pandas_dtype(nullable) if p["na"] else np.dtype(dtype)
+  elif p["kind"] == "float":
+    if float32 or p["lossless"]:
+      return pd.Float32Dtype() if p["na"] else np.dtype(np.float32)
+  elif p["kind"] == "str":
+    u = p["uniques"]
+    if u is not None and len(u) <= max_categories and len(u) <= max_unique_frac * max(n, 1):
+      return pd.CategoricalDtype(sorted(u))
+
+  return None
+
+
+def memory_report(before, after):
+  report = pd.DataFrame({
+    "dtype_before": before.dtypes.astype(str),
+    "dtype_after": after.dtypes.astype(str),
+    "bytes_before": before.memory_usage(deep=True, index=False),
+    "bytes_after": after.memory_usage(deep=True, index=False)
+  })
+  report.loc["(total)"] = [
+    "", "", report["bytes_before"].sum(), report["bytes_after"].sum()
+  ]
+  report["ratio"] = report["bytes_after"] / report["bytes_before"]
+  return report
+
+
+def shrink(df, max_categories=1000, max_unique_frac=0.5, float32=False, report=False):
+  new = {}
+  for col in df.columns:
+    p = _profile(df[col], max_categories)
+    dtype = _target_dtype(p, len(df), max_categories, max_unique_frac, float32)
+    new[col] = df[col] if dtype is None else df[col].astype(dtype)
+
+  shrunk = pd.DataFrame(new, index=df.index)
+  if report:
+    return shrunk, memory_report(df, shrunk)
+  return shrunk
+
+
+def profile_csv(name, chunksize=100_000, max_categories=1000, max_unique_frac=0.5,
+                float32=False):
+  profiles, n = {}, 0
+  for chunk in pd.read_csv(csv_path(name), chunksize=chunksize):
+    n += len(chunk)
+    for col in chunk.columns:
+      p = _profile(chunk[col], max_categories)
+      profiles[col] = _merge_profiles(profiles[col], p) if col in profiles else p
+
+  dtypes = {
+    col: _target_dtype(p, n, max_categories, max_unique_frac, float32)
+    for col, p in profiles.items()
+  }
+  return {col: dtype for col, dtype in dtypes.items() if dtype is not None}
+
+
+def shrink_csv(name, chunksize=100_000, max_categories=1000, max_unique_frac=0.5,
+               float32=False):
+  dtypes = profile_csv(name, chunksize, max_categories, max_unique_frac, float32)
+  chunks = pd.read_csv(csv_path(name), dtype=dtypes, chunksize=chunksize)
+  return pd.concat(chunks, ignore_index=True)
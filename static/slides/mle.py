@@ -0,0 +1,147 @@
+## Vectorized maximum likelihood for the gamma and normal models (Lec14)
+#
+# Both log likelihoods only depend on the data through a few sums, so these are
+# computed once and every evaluation afterwards is O(1) in the sample size:
+#
+#   gamma(a, scale): n, sum(x), sum(log x) (and the variance for a moment based start)
+#   normal(mu, sigma): n, mean(x), sum((x - mean(x))^2)
+#
+# The centered sum of squares is computed directly rather than from sum(x^2),
+# which cancels catastrophically when the mean is large relative to the spread.
+#
+# nll(), score() and hess() accept a single θ or any batch of them with shape
+# (..., 2) and broadcast over the leading dimensions, e.g. to evaluate a grid
+# of starting values or a profile likelihood in one call. score() is the
+# gradient of the negative log likelihood, so fit() can use it as jac.
+# Invalid parameter values (a, scale or sigma <= 0) have an nll of inf.
+
+import numpy as np
+from scipy import optimize, special
+
+
+class SuffStatMLE:
+  def _split(self, θ):
+    θ = np.asarray(θ, dtype=np.float64)
+    if θ.shape[-1] != 2:
+      raise ValueError(f"θ must have shape (..., 2), not {θ.shape}")
+    return θ, θ[..., 0], θ[..., 1]
+
+  def value_and_grad(self, θ):
+    return self.nll(θ), self.score(θ)
+
+  def grid(self, *axes):
+    θ = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+    return θ, self.nll(θ)
+
+  def grid_start(self, *axes):
+    θ, nll = self.grid(*axes)
+    return θ.reshape(-1, 2)[np.argmin(nll)]
+
+  def fit(self, θ0=None, method="L-BFGS-B", **kwargs):
+    if θ0 is None:
+      θ0 = self.default_start()
+    return optimize.minimize(
+      self.value_and_grad, θ0, jac=True, method=method,
+      bounds = kwargs.pop("bounds", self.bounds if method.upper() == "L-BFGS-B" else None),
+      **kwargs
+    )
+
+
+class GammaMLE(SuffStatMLE):
+  bounds = [(1e-8, None), (1e-8, None)]
+
+  def __init__(self, x):
+    x = np.asarray(x, dtype=np.float64)
+    self.n = x.size
+    self.sum_x = x.sum()
+    self.mean = self.sum_x / self.n
+    self.ss_c = ((x - self.mean)**2).sum()
+    self.sum_log_x = np.log(x).sum()
+
+  def nll(self, θ):
+    θ, a, s = self._split(θ)
+    with np.errstate(invalid="ignore", divide="ignore"):
+      ll = (
+        (a - 1) * self.sum_log_x - self.sum_x / s
+        - self.n * a * np.log(s) - self.n * special.gammaln(a)
+      )
+    return np.where((a > 0) & (s > 0), -ll, np.inf)
+
+  def score(self, θ):
+    θ, a, s = self._split(θ)
+    with np.errstate(invalid="ignore", divide="ignore"):
+      d_a = -(self.sum_log_x - self.n * np.log(s) - self.n * special.digamma(a))
+      d_s = -(self.sum_x / s**2 - self.n * a / s)
+    return np.stack([d_a, d_s], axis=-1)
+
+  def hess(self, θ):
+    θ, a, s = self._split(θ)
+    d_aa = self.n * special.polygamma(1, a)
+    d_as = self.n / s
+    d_ss = 2 * self.sum_x / s**3 - self.n * a / s**2
+    return np.stack([
+      np.stack([d_aa, d_as], axis=-1),
+      np.stack([d_as, d_ss], axis=-1)
+    ], axis=-2)
+
+  # For a fixed shape the scale's MLE is closed form, sum(x) / (n a)
+  def profile_scale(self, a):
+    return self.sum_x / (self.n * np.asarray(a, dtype=np.float64))
+
+  def profile_nll(self, a):
+    a = np.asarray(a, dtype=np.float64)
+    return self.nll(np.stack([a, self.profile_scale(a)], axis=-1))
+
+  # Method of moments
+  def default_start(self):
+    var = self.ss_c / self.n
+    return np.array([self.mean**2 / var, var / self.mean])
+
+
+class NormalMLE(SuffStatMLE):
+  bounds = [(None, None), (1e-8, None)]
+
+  def __init__(self, x):
+    x = np.asarray(x, dtype=np.float64)
+    self.n = x.size
+    self.mean = x.mean()
+    self.ss_c = ((x - self.mean)**2).sum()
+
+  def _ss(self, mu):
+    # sum((x - mu)^2)
+    return self.ss_c + self.n * (self.mean - mu)**2
+
+  def nll(self, θ):
+    θ, mu, sigma = self._split(θ)
+    with np.errstate(invalid="ignore", divide="ignore"):
+      nll = (
+        self.n * np.log(sigma) + 0.5 * self.n * np.log(2 * np.pi)
+        + self._ss(mu) / (2 * sigma**2)
+      )
+    return np.where(sigma > 0, nll, np.inf)
+
+  def score(self, θ):
+    θ, mu, sigma = self._split(θ)
+    d_mu = -self.n * (self.mean - mu) / sigma**2
+    d_sigma = self.n / sigma - self._ss(mu) / sigma**3
+    return np.stack([d_mu, d_sigma], axis=-1)
+
+  def hess(self, θ):
+    θ, mu, sigma = self._split(θ)
+    d_mm = np.broadcast_to(self.n / sigma**2, mu.shape)
+    d_ms = 2 * self.n * (self.mean - mu) / sigma**3
+    d_ss = -self.n / sigma**2 + 3 * self._ss(mu) / sigma**4
+    return np.stack([
+      np.stack([d_mm, d_ms], axis=-1),
+      np.stack([d_ms, d_ss], axis=-1)
+    ], axis=-2)
+
+  def profile_sigma(self, mu):
+    return np.sqrt(self._ss(np.asarray(mu, dtype=np.float64)) / self.n)
+
+  def profile_nll(self, mu):
+    mu = np.asarray(mu, dtype=np.float64)
+    return self.nll(np.stack([mu, self.profile_sigma(mu)], axis=-1))
+
+  def default_start(self):
+    return np.array([0.0, 1.0])
@@ -0,0 +1,275 @@
+## Benchmark harness for scipy.optimize methods (Lec14)
+#
+# Replaces the ad-hoc define_methods / time_cost_func / run_collect timings
+# from Lec14 with a problem registry (optim_problems.PROBLEMS) x a method
+# registry (METHODS). For each cell the objective, gradient and Hessian are
+# wrapped to count calls and to time how long is spent inside them, so the
+# total time can be split into objective cost and optimizer overhead. Cells
+# are warmed up before timing and run in parallel worker processes with BLAS /
+# OpenMP pinned to a single thread. Results can be saved as json or parquet and
+# compared against a baseline run.
+#
+#   df = optim_bench.run(jobs=4)
+#   optim_bench.save(df, "bench.json")
+#   optim_bench.compare(df, optim_bench.load("baseline.json"))
+#
+# or from the shell
+#
+#   python optim_bench.py --jobs 4 --out bench.json --baseline baseline.json
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import optimize
+
+import optim_problems
+
+# fork avoids re-running the calling script in each worker, elsewhere fork is
+# not safe with the system BLAS
+START_METHOD = "fork" if sys.platform == "linux" else "spawn"
+
+THREAD_VARS = [
+  "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+  "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"
+]
+
+
+## Methods
+
+def _minimize(method, use_grad=True, use_hess=False):
+  def run(x0, f, grad, hess, tol):
+    return optimize.minimize(
+      f, x0, method=method, tol=tol,
+      jac = grad if use_grad else None,
+      hess = hess if use_hess else None
+    )
+  return run
+
+# name -> run(x0, f, grad, hess, tol), mirroring define_methods() in Lec14
+METHODS = {
+  "CG":             _minimize("CG"),
+  "newton-cg":      _minimize("Newton-CG"),
+  "newton-cg w/ H": _minimize("Newton-CG", use_hess=True),
+  "bfgs":           _minimize("BFGS"),
+  "bfgs w/o G":     _minimize("BFGS", use_grad=False),
+  "l-bfgs-b":       _minimize("L-BFGS-B", use_grad=False),
+  "nelder-mead":    _minimize("Nelder-Mead", use_grad=False)
+}
+
+# Methods that cannot run without an analytic gradient
+NEEDS_GRAD = {"newton-cg", "newton-cg w/ H"}
+NEEDS_HESS = {"newton-cg w/ H"}
+
+
+def register_method(name, run, needs_grad=False, needs_hess=False):
+  METHODS[name] = run
+  if needs_grad:
+    NEEDS_GRAD.add(name)
+  if needs_hess:
+    NEEDS_HESS.add(name)
+
+
+## Instrumentation
+
+class Counted:
+  def __init__(self, func):
+    self.func = func
+    self.calls = 0
+    self.time = 0.0
+
+  def __call__(self, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+      return self.func(*args, **kwargs)
+    finally:
+      self.time += time.perf_counter() - start
+      self.calls += 1
+
+  def reset(self):
+    self.calls = 0
+    self.time = 0.0
+
+
+def _instrument(f, grad, hess):
+  return tuple(None if g is None else Counted(g) for g in (f, grad, hess))
+
+
+## Running
+
+# Returns the threadpool limiter (None without threadpoolctl), so the caller can
+# restore the original limits
+def _pin_threads(n_threads):
+  for var in THREAD_VARS:
+    os.environ[var] = str(n_threads)
+  try:
+    from threadpoolctl import threadpool_limits
+  except ImportError:
+    return None
+  return threadpool_limits(n_threads)
+
+
+def run_cell(problem, method, repeat=10, warmup=2, tol=1e-8, spec=None):
+  (f, grad, hess), x0 = optim_problems.get_problem(problem, spec)
+  res = {"problem": problem, "method": method}
+
+  if (method in NEEDS_GRAD and grad is None) or (method in NEEDS_HESS and hess is None):
+    return res | {"skipped": True}
+
+  f, grad, hess = counted = _instrument(f, grad, hess)
+  run = METHODS[method]
+
+  for _ in range(warmup):
+    run(x0, f, grad, hess, tol)
+
+  times, eval_times, counts = [], [], None
+  for _ in range(repeat):
+    for c in counted:
+      if c is not None:
+        c.reset()
+
+    start = time.perf_counter()
+    opt = run(x0, f, grad, hess, tol)
+    times.append(time.perf_counter() - start)
+    eval_times.append(sum(c.time for c in counted if c is not None))
+
+    if counts is None:
+      counts = [None if c is None else c.calls for c in counted]
+
+  times, eval_times = np.array(times), np.array(eval_times)
+
+  return res | {
+    "skipped":       False,
+    "success":       bool(opt.success),
+    "fun":           float(opt.fun),
+    "nit":           opt.get("nit"),
+    "nfev":          counts[0],
+    "njev":          counts[1],
+    "nhev":          counts[2],
+    "time_min":      times.min(),
+    "time_median":   np.median(times),
+    "eval_median":   np.median(eval_times),
+    "overhead_median": np.median(times - eval_times),
+    "repeat":        repeat
+  }
+
+
+def _run_cell(args):
+  problem, method, repeat, warmup, tol, spec = args
+  return run_cell(problem, method, repeat, warmup, tol, spec)
+
+
+def run(problems=None, methods=None, repeat=10, warmup=2, tol=1e-8, jobs=None, threads=1):
+  problems = list(optim_problems.PROBLEMS) if problems is None else problems
+  methods = list(METHODS) if methods is None else methods
+  # Forked workers inherit problems registered at runtime, otherwise the specs
+  # are sent along with each cell (and their factories must be picklable)
+  send_spec = jobs != 1 and START_METHOD != "fork"
+  cells = [
+    (p, m, repeat, warmup, tol, optim_problems.PROBLEMS[p] if send_spec else None)
+    for p, m in itertools.product(problems, methods)
+  ]
+
+  # Set before the workers start so BLAS picks them up on import, the
+  # initializer then also limits any pools that are already loaded
+  old_env = {var: os.environ.get(var) for var in THREAD_VARS}
+  limits = _pin_threads(threads)
+  try:
+    if jobs == 1:
+      results = list(map(_run_cell, cells))
+    else:
+      with ProcessPoolExecutor(
+        max_workers = jobs,
+        mp_context = multiprocessing.get_context(START_METHOD),
+        initializer = _pin_threads, initargs = (threads,)
+      ) as pool:
+        results = list(pool.map(_run_cell, cells))
+  finally:
+    if limits is not None:
+      limits.restore_original_limits()
+    for var, value in old_env.items():
+      if value is None:
+        os.environ.pop(var, None)
+      else:
+        os.environ[var] = value
+
+  df = pd.DataFrame(results)
+  df.attrs["meta"] = {
+    "python": platform.python_version(),
+    "numpy": np.__version__,
+    "machine": platform.machine(),
+    "threads": threads,
+    "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+  }
+  return df
+
+
+## Storing and comparing results
+
+def save(df, path):
+  if path.endswith(".parquet"):
+    df.to_parquet(path, index=False)
+  else:
+    df.to_json(path, orient="records", indent=1)
+
+
+def load(path):
+  if path.endswith(".parquet"):
+    return pd.read_parquet(path)
+  return pd.read_json(path, orient="records")
+
+
+def compare(current, baseline, threshold=0.1, time_col="time_median"):
+  keys = ["problem", "method"]
+  cols = keys + [time_col, "nfev", "njev", "nhev", "success"]
+  df = current[cols].merge(
+    baseline[cols], on=keys, how="left", suffixes=("", "_baseline")
+  )
+
+  df["time_ratio"] = df[time_col] / df[time_col + "_baseline"]
+  df["regression"] = df["time_ratio"] > 1 + threshold
+  df["improvement"] = df["time_ratio"] < 1 - threshold
+  df["evals_changed"] = np.any([
+    df[col].fillna(-1) != df[col + "_baseline"].fillna(-1)
+    for col in ["nfev", "njev", "nhev"]
+  ], axis=0) & df[time_col + "_baseline"].notna()
+
+  return df.sort_values("time_ratio", ascending=False, ignore_index=True)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark scipy.optimize methods")
+  parser.add_argument("--problems", nargs="*", default=None)
+  parser.add_argument("--methods", nargs="*", default=None)
+  parser.add_argument("--repeat", type=int, default=10)
+  parser.add_argument("--warmup", type=int, default=2)
+  parser.add_argument("--jobs", type=int, default=None)
+  parser.add_argument("--threads", type=int, default=1)
+  parser.add_argument("--out", default=None)
+  parser.add_argument("--baseline", default=None)
+  parser.add_argument("--threshold", type=float, default=0.1)
+  args = parser.parse_args()
+
+  df = run(
+    args.problems, args.methods, repeat=args.repeat, warmup=args.warmup,
+    jobs=args.jobs, threads=args.threads
+  )
+
+  with pd.option_context("display.width", 200, "display.max_columns", 20):
+    print(df)
+
+    if args.out:
+      save(df, args.out)
+
+    if args.baseline:
+      cmp = compare(df, load(args.baseline), threshold=args.threshold)
+      print(cmp[["problem", "method", "time_ratio", "regression", "evals_changed"]])
+      if cmp["regression"].any():
+        raise SystemExit(1)
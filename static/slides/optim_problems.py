@@ -0,0 +1,268 @@
+## Test problems for the optimization lectures (Lec13 / Lec14)
+#
+# Every problem factory returns the tuple (f, grad, hess) where grad and hess
+# may be None when no analytic version is available. The f and grad of mk_quad
+# and mk_rosenbrock also accept a batch of points with shape (..., ndim).
+
+import numpy as np
+from scipy.stats import gamma
+
+
+# Code from https://scipy-lectures.org/ on optimization
+def mk_quad(epsilon, ndim=2):
+  def f(x):
+    x = np.asarray(x)
+    y = x.copy()
+    y *= np.power(epsilon, np.arange(ndim))
+    return .33*np.sum(y**2, axis=-1)
+
+  def gradient(x):
+    x = np.asarray(x)
+    y = x.copy()
+    scaling = np.power(epsilon, np.arange(ndim))
+    y *= scaling
+    return .33*2*scaling*y
+
+  def hessian(x):
+    scaling = np.power(epsilon, np.arange(ndim))
+    return .33*2*np.diag(scaling**2)
+
+  return f, gradient, hessian
+
+
+def mk_rosenbrock(y=None):
+  def f(x):
+    x = np.asarray(x)
+    y = 4*x
+    y[..., 0] += 1
+    y[..., 1:] += 3
+    return np.sum(.5*(1 - y[..., :-1])**2 + (y[..., 1:] - y[..., :-1]**2)**2, axis=-1)
+
+  def gradient(x):
+    x = np.asarray(x)
+    y = 4*x
+    y[..., 0] += 1
+    y[..., 1:] += 3
+    xm = y[..., 1:-1]
+    xm_m1 = y[..., :-2]
+    xm_p1 = y[..., 2:]
+    der = np.zeros_like(y)
+    der[..., 1:-1] = 2*(xm - xm_m1**2) - 4*(xm_p1 - xm**2)*xm - .5*2*(1 - xm)
+    der[..., 0] = -4*y[..., 0]*(y[..., 1] - y[..., 0]**2) - .5*2*(1 - y[..., 0])
+    der[..., -1] = 2*(y[..., -1] - y[..., -2]**2)
+    return 4*der
+
+  def hessian(x):
+    x = np.asarray(x)
+    y = 4*x
+    y[0] += 1
+    y[1:] += 3
+
+    H = np.diag(-4*y[:-1], 1) - np.diag(4*y[:-1], -1)
+    diagonal = np.zeros_like(y)
+    diagonal[0] = 12*y[0]**2 - 4*y[1] + 2*.5
+    diagonal[-1] = 2
+    diagonal[1:-1] = 3 + 12*y[1:-1]**2 - 4*y[2:]
+    H = H + np.diag(diagonal)
+    return 4*4*H
+
+  return f, gradient, hessian
+
+
+## Hessian-vector products
+#
+# hessp(x, p) returns H(x) @ p without forming H(x), so it needs O(ndim)
+# memory. Used by matrix-free Newton-CG for large ndim.
+
+def mk_quad_hessp(epsilon, ndim=2):
+  scaling = np.power(epsilon, np.arange(ndim))
+
+  def hessp(x, p):
+    return .33*2*scaling**2*np.asarray(p)
+
+  return hessp
+
+
+def mk_rosenbrock_hessp(y=None):
+  def hessp(x, p):
+    x, p = np.asarray(x), np.asarray(p)
+    y = 4*x
+    y[0] += 1
+    y[1:] += 3
+
+    diagonal = np.zeros_like(y)
+    diagonal[0] = 12*y[0]**2 - 4*y[1] + 2*.5
+    diagonal[-1] = 2
+    diagonal[1:-1] = 3 + 12*y[1:-1]**2 - 4*y[2:]
+
+    Hp = diagonal*p
+    Hp[:-1] -= 4*y[:-1]*p[1:]
+    Hp[1:] -= 4*y[:-1]*p[:-1]
+    return 4*4*Hp
+
+  return hessp
+
+
+def mk_mvn(mu, Sigma):
+  Sigma_inv = np.linalg.inv(Sigma)
+  norm_const = 1 / (np.sqrt(np.linalg.det(2*np.pi*Sigma)))
+
+  # Returns the negative density (since we want the max not min)
+  def f(x):
+    x_m = x - mu
+    return -(norm_const *
+      np.exp(
+        -0.5 * x_m.T @ Sigma_inv @ x_m
+      )
+    ).item()
+
+  def grad(x):
+    return (-f(x) * Sigma_inv @ (x - mu))
+
+  def hess(x):
+    n = len(x)
+    x_m = x - mu
+    return f(x) * (
+      (Sigma_inv @ x_m).reshape((n,1))
+      @ (x_m.T @ Sigma_inv).reshape((1,n))
+      - Sigma_inv
+    )
+
+  return f, grad, hess
+
+
+# Lec14-notes.py, Exercise 1
+def mk_exercise1():
+  def f(x):
+    return np.exp(x[0]-1) + np.exp(-x[1]+1) + (x[0]-x[1])**2
+
+  def grad(x):
+    return np.array([
+      np.exp(x[0]-1) + 2 * (x[0]-x[1]),
+      -np.exp(-x[1]+1) - 2 * (x[0]-x[1])
+    ])
+
+  def hess(x):
+    return np.array([
+      [ np.exp(x[0]-1) + 2, -2                  ],
+      [ -2                , np.exp(-x[1]+1) + 2 ]
+    ])
+
+  return f, grad, hess
+
+
+# Negative log likelihood of a gamma sample (Lec14-notes.py, Exercise 2)
+def mk_mle_gamma(a=2.0, scale=2.0, size=100, seed=1234):
+  x = gamma(a=a, scale=scale).rvs(size=size, random_state=seed)
+
+  def mle_gamma(θ):
+    if θ[0] <= 0 or θ[1] <= 0:
+      return 1e16
+    else:
+      return -np.sum(gamma.logpdf(x, a=θ[0], scale=θ[1]))
+
+  return mle_gamma, None, None
+
+
+## Fused objectives
+#
+# FusedProblem builds f, grad and hess from a `terms(x)` function that computes
+# the subexpressions they share (e.g. exp(x[0]-1)) once per point, each of
+# value(x, terms), grad(x, terms) and hess(x, terms) then reuses them. The terms
+# and every result are memoized for the last x evaluated, so asking for the
+# value, gradient and Hessian at the same point only computes the terms once,
+# and value_and_grad() can be passed to optimize.minimize with jac=True.
+# Gradients and Hessians are returned as contiguous float64 arrays (read-only,
+# as they are shared with the cache).
+
+class FusedProblem:
+  def __init__(self, terms, value, grad, hess=None):
+    self.terms_fn = terms
+    self.value_fn = value
+    self.grad_fn = grad
+    self.hess_fn = hess
+    self.n_terms = 0
+    self._key = None
+
+  def _update(self, x):
+    x = np.asarray(x, dtype=np.float64)
+    key = x.tobytes()
+    if key != self._key:
+      self._key = key
+      self._x = x.copy()
+      self._terms = self.terms_fn(self._x)
+      self._value = self._grad = self._hess = None
+      self.n_terms += 1
+
+  @staticmethod
+  def _array(res):
+    res = np.ascontiguousarray(res, dtype=np.float64)
+    res.flags.writeable = False
+    return res
+
+  def f(self, x):
+    self._update(x)
+    if self._value is None:
+      self._value = float(self.value_fn(self._x, self._terms))
+    return self._value
+
+  def grad(self, x):
+    self._update(x)
+    if self._grad is None:
+      self._grad = self._array(self.grad_fn(self._x, self._terms))
+    return self._grad
+
+  def hess(self, x):
+    if self.hess_fn is None:
+      raise ValueError("No Hessian was given for this problem")
+    self._update(x)
+    if self._hess is None:
+      self._hess = self._array(self.hess_fn(self._x, self._terms))
+    return self._hess
+
+  def value_and_grad(self, x):
+    return self.f(x), self.grad(x)
+
+  # So that `f, grad, hess = problem` works like the mk_*() factories
+  def __iter__(self):
+    return iter((self.f, self.grad, None if self.hess_fn is None else self.hess))
+
+
+def mk_mvn_fused(mu, Sigma):
+  Sigma_inv = np.linalg.inv(Sigma)
+  norm_const = 1 / (np.sqrt(np.linalg.det(2*np.pi*Sigma)))
+
+  def terms(x):
+    x_m = x - mu
+    S_x = Sigma_inv @ x_m
+    return S_x, norm_const * np.exp(-0.5 * (x_m @ S_x))
+
+  return FusedProblem(
+    terms,
+    value = lambda x, t: -t[1],
+    grad = lambda x, t: t[1] * t[0],
+    hess = lambda x, t: -t[1] * (np.outer(t[0], t[0]) - Sigma_inv)
+  )
+
+
+# name -> (factory, factory args, starting value)
+PROBLEMS = {
+  "well-cond quad": (mk_quad, (0.7,), (1.6, 1.1)),
+  "ill-cond quad":  (mk_quad, (0.02,), (1.6, 1.1)),
+  "rosenbrock":     (mk_rosenbrock, (), (1.6, 1.1)),
+  "mvn (5d)":       (mk_mvn, (np.zeros(5), np.eye(5)), (0.5, -0.3, 0.2, -0.6, 0.4)),
+  "mvn (5d) fused": (mk_mvn_fused, (np.zeros(5), np.eye(5)), (0.5, -0.3, 0.2, -0.6, 0.4)),
+  "mle gamma":      (mk_mle_gamma, (), (1, 1)),
+  "exercise 1":     (mk_exercise1, (), (0, 0))
+}
+
+
+# factory must be a module level function (not a lambda or a function defined
+# in a script) for optim_bench.run(jobs > 1) to send it to spawned workers
+def register_problem(name, factory, args=(), x0=None):
+  PROBLEMS[name] = (factory, tuple(args), x0)
+
+
+def get_problem(name, spec=None):
+  factory, args, x0 = PROBLEMS[name] if spec is None else spec
+  return tuple(factory(*args)), np.asarray(x0, dtype=np.float64)
@@ -0,0 +1,224 @@
+## Caching pipeline stages across hyper-parameter searches
+#
+# TransformCache implements the part of the joblib.Memory interface that
+# Pipeline(memory=...) uses, so fitted preprocessing steps (and their
+# transformed output) are keyed by a content hash of the step's parameters and
+# input data. Entries are kept in memory up to max_bytes, least recently used
+# entries are spilled to an on-disk store at `location` (if given) and are
+# reloaded from there on the next hit.
+#
+# Only the raw input to the first step is hashed by content: an array returned
+# by a cached step is identified by that step's key when it is passed on to the
+# next step, so the (often much larger) intermediate outputs are never hashed.
+#
+# Cached arrays are shared by every hit, so numpy arrays are made read-only when
+# they are stored (sklearn's validation copies read-only input before changing
+# it in place) and sparse matrices / DataFrames are copied on each hit.
+#
+#   cache = TransformCache(location="pipeline_cache", max_bytes=512 * 2**20)
+#   pipe = make_pipeline(StandardScaler(), PolynomialFeatures(), Ridge(), memory=cache)
+#   GridSearchCV(pipe, {"ridge__alpha": [0.1, 1, 10]}).fit(X, y)
+#   cache.stats
+
+import functools
+import inspect
+import os
+import pickle
+import uuid
+import weakref
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Per process registry, so that copies of a cache made by sklearn's clone() or
+# by pickling it to a worker process share the same in-memory store. Weak
+# references, so a cache (and its store) is freed once nothing else uses it.
+_registry = weakref.WeakValueDictionary()
+
+
+def _get_cache(token, location, max_bytes):
+  cache = _registry.get(token)
+  if cache is None:
+    cache = TransformCache(location, max_bytes, _token=token)
+  return cache
+
+
+def nbytes(obj):
+  if isinstance(obj, np.ndarray):
+    return obj.nbytes
+  if sp.issparse(obj):
+    return sum(getattr(obj, a).nbytes for a in ("data", "indices", "indptr") if hasattr(obj, a))
+  if isinstance(obj, (pd.DataFrame, pd.Series)):
+    return int(np.sum(obj.memory_usage(deep=True)))
+  if isinstance(obj, (tuple, list)):
+    return sum(nbytes(o) for o in obj)
+  return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _freeze(obj):
+  if isinstance(obj, np.ndarray):
+    obj.setflags(write=False)
+  elif isinstance(obj, tuple):
+    for o in obj:
+      _freeze(o)
+
+
+def _unshared(obj):
+  if sp.issparse(obj) or isinstance(obj, (pd.DataFrame, pd.Series)):
+    return obj.copy()
+  if isinstance(obj, tuple):
+    return tuple(_unshared(o) for o in obj)
+  return obj
+
+
+class TransformCache:
+  def __init__(self, location=None, max_bytes=256 * 2**20, _token=None):
+    self.location = location
+    self.max_bytes = max_bytes
+    self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "spills": 0}
+
+    self._token = _token or uuid.uuid4().hex
+    self._store = OrderedDict()
+    self._sizes = {}
+    self._provenance = {}
+    self._bytes = 0
+    _registry.setdefault(self._token, self)
+
+    if location is not None:
+      os.makedirs(location, exist_ok=True)
+
+  def __repr__(self):
+    return (
+      f"TransformCache(location={self.location!r}, max_bytes={self.max_bytes}, "
+      f"entries={len(self._store)}, bytes={self._bytes})"
+    )
+
+  # clone() deep copies non-estimator parameters, returning self keeps a single
+  # store per search
+  def __deepcopy__(self, memo):
+    return self
+
+  def __reduce__(self):
+    return (_get_cache, (self._token, self.location, self.max_bytes))
+
+  def cache(self, func=None, ignore=None, **kwargs):
+    if func is None:
+      return functools.partial(self.cache, ignore=ignore, **kwargs)
+    return CachedFunc(self, func, ignore or [])
+
+  def _path(self, key):
+    return os.path.join(self.location, key + ".pkl")
+
+  def lookup_key(self, obj):
+    entry = self._provenance.get(id(obj))
+    if entry is not None and entry[0] is obj:
+      return entry[1]
+    return None
+
+  def _register(self, key, value):
+    if isinstance(value, tuple):
+      for i, v in enumerate(value):
+        self._provenance[id(v)] = (v, f"{key}:{i}")
+
+  def _unregister(self, value):
+    if isinstance(value, tuple):
+      for v in value:
+        self._provenance.pop(id(v), None)
+
+  def get(self, key):
+    if key in self._store:
+      self._store.move_to_end(key)
+      self.stats["hits"] += 1
+      return True, _unshared(self._store[key])
+
+    if self.location is not None and os.path.exists(self._path(key)):
+      value = joblib.load(self._path(key))
+      self.stats["disk_hits"] += 1
+      self._put_memory(key, value)
+      return True, _unshared(value)
+
+    self.stats["misses"] += 1
+    return False, None
+
+  def put(self, key, value):
+    if nbytes(value) > self.max_bytes:
+      self._spill(key, value)
+    else:
+      self._put_memory(key, value)
+
+  def _put_memory(self, key, value):
+    size = nbytes(value)
+    if size > self.max_bytes:
+      return
+
+    _freeze(value)
+    self._store[key] = value
+    self._sizes[key] = size
+    self._bytes += size
+    self._register(key, value)
+
+    while self._bytes > self.max_bytes:
+      old_key, old_value = self._store.popitem(last=False)
+      self._bytes -= self._sizes.pop(old_key)
+      self._unregister(old_value)
+      self._spill(old_key, old_value)
+
+  def _spill(self, key, value):
+    if self.location is None:
+      return
+
+    path = self._path(key)
+    if not os.path.exists(path):
+      tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+      joblib.dump(value, tmp)
+      os.replace(tmp, path)
+      self.stats["spills"] += 1
+
+  def hit_rate(self):
+    total = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+    return (self.stats["hits"] + self.stats["disk_hits"]) / max(total, 1)
+
+  def clear(self):
+    self._store.clear()
+    self._sizes.clear()
+    self._provenance.clear()
+    self._bytes = 0
+    self.stats = dict.fromkeys(self.stats, 0)
+
+    if self.location is not None:
+      for f in os.listdir(self.location):
+        if f.endswith(".pkl"):
+          os.remove(os.path.join(self.location, f))
+
+
+class CachedFunc:
+  # Pipeline's logging arguments do not change the result of a fit
+  always_ignore = ["message_clsname", "message"]
+
+  def __init__(self, cache, func, ignore):
+    self.cache = cache
+    self.func = func
+    self.ignore = set(ignore) | set(self.always_ignore)
+    self.signature = inspect.signature(func)
+    functools.update_wrapper(self, func)
+
+  def key(self, *args, **kwargs):
+    bound = self.signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    hashed = {}
+    for k, v in bound.arguments.items():
+      if k not in self.ignore:
+        cached_key = self.cache.lookup_key(v)
+        hashed[k] = v if cached_key is None else ("cached", cached_key)
+    return joblib.hash((self.func.__module__, self.func.__qualname__, hashed))
+
+  def __call__(self, *args, **kwargs):
+    key = self.key(*args, **kwargs)
+    found, value = self.cache.get(key)
+    if not found:
+      value = self.func(*args, **kwargs)
+      self.cache.put(key, value)
+    return value
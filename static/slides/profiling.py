@@ -0,0 +1,117 @@
+## Scheduled torch.profiler runs for training / evaluation loops (Lec19)
+#
+# Lec19 profiles by wrapping a call in torch.autograd.profiler.profile, which
+# records every step of it (including the slow first ones) and keeps it all in
+# memory. The loops in the Lec19 notes instead take a `profile` option and call
+# prof.step() once per step (batch), the profiler then only records a window:
+#
+#   skip_first, then repeat times: wait steps -> warmup steps -> active steps
+#
+# Only the active steps are recorded. At the end of each window a Chrome trace
+# is written to `dir` (<worker>.<timestamp>.pt.trace.json, open in
+# chrome://tracing or https://ui.perfetto.dev, or point TensorBoard's profile
+# plugin at the directory) and the top `row_limit` operators are printed.
+# Shapes and memory are recorded by default, so the summary can be grouped by
+# input shape.
+#
+#   profile=True                     Profile() defaults
+#   profile={"active": 10, ...}      Profile(**options)
+#   profile=Profile(...)             as is, e.g. to look at prof.summary() later
+#   profile=None / False             no profiling
+#
+#   with profiling(profile, "fit") as prof:
+#     for batch in loader:
+#       ...
+#       prof.step()
+
+import os
+
+import torch
+
+
+class Profile:
+  def __init__(
+    self, dir="profiles", wait=1, warmup=1, active=3, repeat=1, skip_first=0,
+    record_shapes=True, profile_memory=True, with_stack=False,
+    sort_by="self_cpu_time_total", row_limit=10, group_by_shape=False, verbose=True
+  ):
+    self.dir = dir
+    self.schedule = torch.profiler.schedule(
+      wait=wait, warmup=warmup, active=active, repeat=repeat, skip_first=skip_first
+    )
+    self.record_shapes = record_shapes
+    self.profile_memory = profile_memory
+    self.with_stack = with_stack
+    self.sort_by = sort_by
+    self.row_limit = row_limit
+    self.group_by_shape = group_by_shape and record_shapes
+    self.verbose = verbose
+    self.name = None
+    self.traces = []
+    self._prof = None
+
+  def __repr__(self):
+    return f"Profile(dir={self.dir!r}, traces={len(self.traces)})"
+
+  def summary(self, sort_by=None, row_limit=None):
+    return self._prof.key_averages(group_by_input_shape=self.group_by_shape).table(
+      sort_by=sort_by or self.sort_by, row_limit=row_limit or self.row_limit
+    )
+
+  def _trace_ready(self, prof):
+    before = set(os.listdir(self.dir))
+    torch.profiler.tensorboard_trace_handler(self.dir, worker_name=self.name)(prof)
+    self.traces += sorted(
+      os.path.join(self.dir, f) for f in set(os.listdir(self.dir)) - before
+    )
+    if self.verbose:
+      print(f"{self.name}: {self.traces[-1]}")
+      print(self.summary())
+
+  def start(self, name):
+    os.makedirs(self.dir, exist_ok=True)
+    self.name = name
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+      activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    self._prof = torch.profiler.profile(
+      activities=activities, schedule=self.schedule, on_trace_ready=self._trace_ready,
+      record_shapes=self.record_shapes, profile_memory=self.profile_memory,
+      with_stack=self.with_stack
+    )
+    self._prof.start()
+    return self
+
+  def step(self):
+    self._prof.step()
+
+  def stop(self):
+    self._prof.stop()
+
+
+class _NoProfile:
+  def step(self):
+    pass
+
+
+class profiling:
+  def __init__(self, profile, name="main"):
+    if profile is None or profile is False:
+      self.profile = None
+    elif profile is True:
+      self.profile = Profile()
+    elif isinstance(profile, dict):
+      self.profile = Profile(**profile)
+    else:
+      self.profile = profile
+    self.name = name
+
+  def __enter__(self):
+    if self.profile is None:
+      return _NoProfile()
+    return self.profile.start(self.name)
+
+  def __exit__(self, *exc):
+    if self.profile is not None:
+      self.profile.stop()
@@ -0,0 +1,214 @@
+## Stochastic gradient descent for linear regression (Lec15)
+#
+# One loop for sto_grad_desc_lm, mb_grad_desc_lm, adagrad_lm, rmsprop_lm and
+# adam_lm from Lec15, the only difference between them is how a gradient is
+# turned into a step, which is an update rule object:
+#
+#   rule.init(k)                    allocates its state for k parameters
+#   rule.update(beta, G, step, t)   updates beta in place, t counts from 1
+#
+# Each epoch the rows are permuted (or resampled) into a preallocated copy of
+# the data once, so every mini-batch is a contiguous slice and its gradient
+# 2 X_j^T (X_j beta - y_j) is two matrix-vector products into preallocated
+# buffers. The loss is only evaluated every `eval_every` steps (None for once
+# per epoch), and with `eval_sample=m` it is estimated from a fixed random
+# subset of m rows (scaled up by n/m) rather than the full data.
+#
+#   res = sgd_lm(X, y, np.zeros(X.shape[1]+1), step=0.5, rule="adam", batch_size=25)
+#
+# returns {"x", "loss", "iter"} like the Lec15 functions, with entries only at
+# the evaluated steps.
+
+import numpy as np
+
+
+## Update rules
+
+class SGD:
+  def init(self, k):
+    self.tmp = np.empty(k)
+
+  def update(self, beta, G, step, t):
+    np.multiply(G, step, out=self.tmp)
+    beta -= self.tmp
+
+
+class Momentum:
+  def __init__(self, b=0.9):
+    self.b = b
+
+  def init(self, k):
+    self.V = np.zeros(k)
+    self.tmp = np.empty(k)
+
+  def update(self, beta, G, step, t):
+    self.V *= self.b
+    self.V += G
+    np.multiply(self.V, step, out=self.tmp)
+    beta -= self.tmp
+
+
+class AdaGrad:
+  def __init__(self, eps=1e-8):
+    self.eps = eps
+
+  def init(self, k):
+    self.S = np.zeros(k)
+    self.tmp = np.empty(k)
+
+  def update(self, beta, G, step, t):
+    np.multiply(G, G, out=self.tmp)
+    self.S += self.tmp
+    np.add(self.S, self.eps, out=self.tmp)
+    np.sqrt(self.tmp, out=self.tmp)
+    np.divide(G, self.tmp, out=self.tmp)
+    self.tmp *= step
+    beta -= self.tmp
+
+
+class RMSProp:
+  def __init__(self, eps=1e-8, b=0.9):
+    self.eps = eps
+    self.b = b
+
+  def init(self, k):
+    self.S = np.zeros(k)
+    self.tmp = np.empty(k)
+
+  def update(self, beta, G, step, t):
+    np.multiply(G, G, out=self.tmp)
+    self.tmp *= 1 - self.b
+    self.S *= self.b
+    self.S += self.tmp
+    np.add(self.S, self.eps, out=self.tmp)
+    np.sqrt(self.tmp, out=self.tmp)
+    np.divide(G, self.tmp, out=self.tmp)
+    self.tmp *= step
+    beta -= self.tmp
+
+
+class Adam:
+  def __init__(self, eps=1e-6, b1=0.9, b2=0.999):
+    self.eps = eps
+    self.b1 = b1
+    self.b2 = b2
+
+  def init(self, k):
+    self.S = np.zeros(k)
+    self.M = np.zeros(k)
+    self.tmp = np.empty(k)
+
+  def update(self, beta, G, step, t):
+    b1, b2 = self.b1, self.b2
+    np.multiply(G, G, out=self.tmp)
+    self.tmp *= 1 - b2
+    self.S *= b2
+    self.S += self.tmp
+
+    np.multiply(G, 1 - b1, out=self.tmp)
+    self.M *= b1
+    self.M += self.tmp
+
+    # M_hat / sqrt(S_hat + eps)
+    np.multiply(self.S, 1 / (1 - b2**t), out=self.tmp)
+    self.tmp += self.eps
+    np.sqrt(self.tmp, out=self.tmp)
+    np.divide(self.M, self.tmp, out=self.tmp)
+    self.tmp *= step / (1 - b1**t)
+    beta -= self.tmp
+
+
+RULES = {
+  "sgd": SGD,
+  "momentum": Momentum,
+  "adagrad": AdaGrad,
+  "rmsprop": RMSProp,
+  "adam": Adam
+}
+
+
+## Engine
+
+def sgd_lm(
+  X, y, beta, step, rule="sgd", batch_size=1, max_step=50, seed=1234,
+  replace=True, eval_every=1, eval_sample=None, **rule_args
+):
+  X = np.asarray(X, dtype=np.float64)
+  y = np.asarray(y, dtype=np.float64)
+  Xb = np.c_[np.ones(X.shape[0]), X]
+  n, k = Xb.shape
+
+  if isinstance(rule, str):
+    rule = RULES[rule](**rule_args)
+  rule.init(k)
+
+  beta = np.array(beta, dtype=np.float64)
+  rng = np.random.default_rng(seed)
+
+  # Rows the loss is evaluated on, from a separate stream so that monitoring
+  # doesn't change the batches drawn by rng
+  if eval_sample is None or eval_sample >= n:
+    X_eval, y_eval, scale = Xb, y, 1.
+  else:
+    rows = np.sort(np.random.default_rng([seed, 1]).choice(n, eval_sample, replace=False))
+    X_eval, y_eval, scale = Xb[rows], y[rows], n / eval_sample
+  r_eval = np.empty(len(y_eval))
+
+  def loss(beta):
+    np.dot(X_eval, beta, out=r_eval)
+    np.subtract(r_eval, y_eval, out=r_eval)
+    return scale * (r_eval @ r_eval)
+
+  batches = range(0, n, batch_size)
+  n_steps = max_step * len(batches)
+  eval_every = eval_every or len(batches)
+  n_evals = n_steps // eval_every + 2
+  res_x = np.empty((n_evals, k))
+  res_loss = np.empty(n_evals)
+  res_iter = np.empty(n_evals, dtype=np.intp)
+
+  res_x[0], res_loss[0], res_iter[0] = beta, loss(beta), 0
+  n_eval = 1
+
+  # Preallocated epoch data and per-batch buffers
+  X_epoch = np.empty_like(Xb)
+  y_epoch = np.empty_like(y)
+  r = np.empty(batch_size)
+  G = np.empty(k)
+
+  t = 0
+  for i in range(max_step):
+    if replace:
+      js = rng.integers(0,n,n)
+    else:
+      js = np.array(range(n))
+      rng.shuffle(js)
+    np.take(Xb, js, axis=0, out=X_epoch)
+    np.take(y, js, out=y_epoch)
+
+    for start in batches:
+      X_j = X_epoch[start:start+batch_size]
+      r_j = r[:len(X_j)]
+
+      # G = 2 X_j^T (X_j beta - y_j)
+      np.dot(X_j, beta, out=r_j)
+      r_j -= y_epoch[start:start+batch_size]
+      np.dot(r_j, X_j, out=G)
+      G *= 2
+
+      t += 1
+      rule.update(beta, G, step, t)
+
+      if t % eval_every == 0:
+        res_x[n_eval], res_loss[n_eval], res_iter[n_eval] = beta, loss(beta), t
+        n_eval += 1
+
+  if res_iter[n_eval-1] != t:
+    res_x[n_eval], res_loss[n_eval], res_iter[n_eval] = beta, loss(beta), t
+    n_eval += 1
+
+  return {
+    "x": list(res_x[:n_eval]),
+    "loss": res_loss[:n_eval],
+    "iter": res_iter[:n_eval]
+  }